@@ -0,0 +1,534 @@
+"""
+**Module providing the AsyncConnector.**
+
+This module provides the `AsyncConnector` class, an `asyncio` based
+counterpart of `Connector`, which speaks the same length-prefixed protobuf
+protocol over asyncio streams.
+"""
+from __future__ import annotations
+from typing import Optional, Tuple
+import asyncio
+import collections
+import os
+import socket
+import ssl
+import struct
+import sys
+import time
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+from threading import Lock
+
+import keepalive
+
+from aperturedb.Configuration import Configuration
+from aperturedb.Connector import (
+    DEFAULT_MAX_MESSAGE_SIZE_MB,
+    DEFAULT_PORT,
+    DEFAULT_RETRY_INTERVAL_SECONDS,
+    DEFAULT_RETRY_MAX_ATTEMPTS,
+    MESSAGE_LENGTH_FORMAT,
+    MESSAGE_LENGTH_SIZE,
+    PROTOCOL_SSL,
+    PROTOCOL_TCP,
+    PROTOCOL_VERSION,
+    RENEW_SESSION_MAX_ATTEMPTS,
+    RENEW_SESSION_RETRY_INTERVAL_SEC,
+    STATUS_ERROR_DEFAULT,
+    STATUS_OK,
+    Session,
+    UnauthorizedException,
+    build_ssl_context,
+    parse_response,
+    serialize_query,
+)
+from aperturedb.types import Blobs, CommandResponses
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnector(object):
+    """
+    **Class to facilitate asyncio connections with an instance of ApertureDB**
+
+    It offers the same protocol, SSL handshake, authentication, session refresh
+    and retry behaviour as [Connector](/python_sdk/connectors/Connector),
+    but `query` is a coroutine, so that many queries can be awaited concurrently
+    from a single event loop without a thread per query.
+
+    Concurrent queries on one AsyncConnector share its connection: they are
+    sent back-to-back and their responses are matched in order.
+    For server side parallelism, use several connectors (see `clone`).
+
+    Example usage:
+    ``` python
+        client = AsyncConnector(host="localhost", user="admin", password="admin")
+        responses = await asyncio.gather(*[client.query(q) for q in queries])
+        await client.close()
+    ```
+
+    Args:
+        str (host): Address of the host to connect to.
+        int (port): Port to connect to.
+        str (user): Username to specify while establishing a connection.
+        str (password): Password to specify while connecting to ApertureDB.
+        str (token): Token to use while connecting to the database.
+        bool (use_ssl): Use SSL to encrypt communication with the database.
+        bool (use_keepalive): Set keepalive on the connection with the database.
+        Configuration (config): Configuration object to use for connection.
+        str (key): Apeture Key, configuration as a deflated compressed string
+
+    As with Connector, the initializer options are ignored if a config or key is passed in.
+    """
+
+    def __init__(self, host="localhost", port=DEFAULT_PORT,
+                 user="", password="", token="",
+                 use_ssl=True,
+                 ca_cert=None,
+                 shared_data=None,
+                 authenticate=True,
+                 use_keepalive=True,
+                 verify_hostname=True,
+                 retry_interval_seconds=DEFAULT_RETRY_INTERVAL_SECONDS,
+                 retry_max_attempts=DEFAULT_RETRY_MAX_ATTEMPTS,
+                 config: Optional[Configuration] = None,
+                 key: Optional[str] = None):
+        self.connected = False
+        self.authenticated = False
+        self.last_query_time = 0
+        self.last_query_timestamp = None
+
+        if key is not None:
+            self.config = Configuration.reinflate(key)
+        elif config is not None:
+            self.config = config
+        else:
+            self.config = Configuration(
+                host=host,
+                port=port,
+                use_ssl=use_ssl,
+                ca_cert=ca_cert,
+                verify_hostname=verify_hostname,
+                username=user,
+                password=password,
+                name="runtime",
+                token=token,
+                use_keepalive=use_keepalive,
+                retry_interval_seconds=retry_interval_seconds,
+                retry_max_attempts=retry_max_attempts
+            )
+
+        self.host = self.config.host
+        self.port = self.config.port
+        self.use_ssl = self.config.use_ssl
+        self.use_keepalive = self.config.use_keepalive
+        self.token = self.config.token
+
+        # The session is compatible with the one of Connector,
+        # so both kinds of connectors can share it.
+        if shared_data is None:
+            self.shared_data = SimpleNamespace()
+            self.shared_data.session = None
+            self.shared_data.lock = Lock()
+        else:
+            self.shared_data = shared_data
+
+        self.should_authenticate = authenticate
+
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = collections.deque()
+        # asyncio primitives are created lazily, inside the running loop.
+        self._send_lock = None
+        self._connect_lock = None
+        self._session_lock = None
+
+    def _locks(self):
+        if self._send_lock is None:
+            self._send_lock = asyncio.Lock()
+            self._connect_lock = asyncio.Lock()
+            self._session_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _handshake(self, sock, protocol):
+        loop = asyncio.get_running_loop()
+        hello_msg = struct.pack('@II', PROTOCOL_VERSION, protocol)
+        await loop.sock_sendall(
+            sock, struct.pack(MESSAGE_LENGTH_FORMAT, len(hello_msg)) + hello_msg)
+
+        async def recv_exactly(size):
+            data = b''
+            while len(data) < size:
+                packet = await loop.sock_recv(sock, size - len(data))
+                if not packet:
+                    raise ConnectionError(
+                        "Connection closed during protocol handshake")
+                data += packet
+            return data
+
+        recv_len = struct.unpack(MESSAGE_LENGTH_FORMAT,
+                                 await recv_exactly(MESSAGE_LENGTH_SIZE))[0]
+        return struct.unpack('@II', await recv_exactly(recv_len))
+
+    async def _connect(self):
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(self.host, self.port,
+                                       family=socket.AF_INET, type=socket.SOCK_STREAM)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        if self.use_keepalive:
+            keepalive.set(sock)
+        if sys.platform.startswith('linux'):
+            sock.setsockopt(socket.SOL_TCP, socket.TCP_QUICKACK, 1)
+
+        try:
+            await loop.sock_connect(sock, infos[0][4])
+
+            # Handshake with server to negotiate protocol, in the clear.
+            protocol = PROTOCOL_SSL if self.use_ssl else PROTOCOL_TCP
+            version, server_protocol = await self._handshake(sock, protocol)
+
+            if version != PROTOCOL_VERSION:
+                logger.warning("Protocol version differ from server")
+
+            if server_protocol != protocol:
+                raise Exception(
+                    "Server did not accept protocol. Aborting Connection.")
+
+            if self.use_ssl:
+                self.context = build_ssl_context(self.config)
+                # An empty server_hostname disables hostname matching.
+                self._reader, self._writer = await asyncio.open_connection(
+                    sock=sock, ssl=self.context,
+                    server_hostname=self.host if self.config.verify_hostname else "")
+            else:
+                self._reader, self._writer = await asyncio.open_connection(
+                    sock=sock)
+        except BaseException:
+            sock.close()
+            self.connected = False
+            self.authenticated = False
+            raise
+
+        self.connected = True
+        self._reader_task = asyncio.create_task(self._read_responses())
+
+    async def connect(self, details: str = None):
+        """
+        Establishes the connection, unless it is already established.
+        """
+        self._locks()
+        async with self._connect_lock:
+            if self.connected:
+                return
+            try:
+                await self._connect()
+            except OSError as e:
+                logger.error(
+                    f"Error connecting to server: "
+                    f"{self.config} \r\n{details}. {e=}",
+                    exc_info=True,
+                    stack_info=True)
+
+    async def _disconnect(self, error: BaseException = None):
+        self.connected = False
+        self.authenticated = False
+        if error is None:
+            error = ConnectionError("Connection closed")
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+            self._writer = None
+        self._reader = None
+
+    async def close(self):
+        """
+        Closes the connection. Pending queries fail with ConnectionError.
+        """
+        task = self._reader_task
+        self._reader_task = None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        await self._disconnect()
+
+    async def _read_responses(self):
+        reader = self._reader
+        try:
+            while True:
+                header = await reader.readexactly(MESSAGE_LENGTH_SIZE)
+                recv_len = struct.unpack(MESSAGE_LENGTH_FORMAT, header)[0]
+                response = await reader.readexactly(recv_len)
+                if not self._pending:
+                    raise ConnectionError(
+                        "Received a response with no query pending")
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(response)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            if self._pending:
+                logger.warning(
+                    f"Connection error on process {os.getpid()}: {e!r}")
+            if self._reader is reader:
+                await self._disconnect(e)
+
+    async def _exchange(self, data: list):
+        """
+        Sends a framed message, given as a list of buffers, and waits for its response.
+        Responses are matched to requests in the order they were sent.
+        """
+        length = sum(len(buffer) for buffer in data)
+        if length > (DEFAULT_MAX_MESSAGE_SIZE_MB * 2**20):
+            logger.warning(
+                "Message sent is larger than default for ApertureDB Server. Server may disconnect.")
+        future = asyncio.get_running_loop().create_future()
+        async with self._send_lock:
+            if not self.connected:
+                raise ConnectionError("Not connected")
+            self._pending.append(future)
+            try:
+                self._writer.write(
+                    struct.pack(MESSAGE_LENGTH_FORMAT, length))
+                self._writer.writelines(data)
+                await self._writer.drain()
+            except BaseException as e:
+                # A partial write leaves the stream unusable.
+                future.cancel()
+                await self._disconnect(e)
+                raise
+        return await future
+
+    async def authenticate(self, shared_data, user, password, token):
+        """
+        Authenticate with the database. This will be called automatically from query.
+        """
+        self._locks()
+        async with self._session_lock:
+            if not self.authenticated:
+                if shared_data.session is None:
+                    await self._authenticate(user, password, token)
+                else:
+                    self.shared_data = shared_data
+                self.authenticated = True
+
+    async def _authenticate(self, user, password="", token=""):
+        query = [{
+            "Authenticate": {
+            }
+        }]
+
+        if user is not None:
+            query[0]["Authenticate"]["username"] = user
+
+        if password:
+            query[0]["Authenticate"]["password"] = password
+        elif token:
+            query[0]["Authenticate"]["token"] = token
+        else:
+            raise Exception(
+                "Either password or token must be specified for authentication")
+
+        response, _ = await self._query(query, [], try_resume=False)
+
+        if not isinstance(response, (list, tuple)
+                          ) or "Authenticate" not in response[0]:
+            raise Exception(
+                "Unexpected response from server upon authenticate request: " +
+                str(response))
+        session_info = response[0]["Authenticate"]
+        if session_info["status"] != STATUS_OK:
+            raise Exception(session_info["info"])
+
+        self.shared_data.session = Session(
+            session_info["session_token"],
+            session_info["refresh_token"],
+            session_info["session_token_expires_in"],
+            session_info["refresh_token_expires_in"],
+            time.time())
+
+    async def _refresh_token(self):
+        query = [{
+            "RefreshToken": {
+                "refresh_token": self.shared_data.session.refresh_token
+            }
+        }]
+
+        response, _ = await self._query(query, [], try_resume=False)
+
+        logger.info(f"Refresh token response: \r\n{response}")
+        if isinstance(response, list):
+            session_info = response[0]["RefreshToken"]
+            if session_info["status"] != STATUS_OK:
+                # Refresh token failed, we need to re-authenticate.
+                self.authenticated = False
+                self.should_authenticate = True
+                self.shared_data.session = None
+                await self._authenticate(self.config.username,
+                                         self.config.password,
+                                         self.token)
+                self.authenticated = True
+                raise UnauthorizedException(response)
+
+            self.shared_data.session = Session(
+                session_info["session_token"],
+                session_info["refresh_token"],
+                session_info["session_token_expires_in"],
+                session_info["refresh_token_expires_in"],
+                time.time())
+        else:
+            raise UnauthorizedException(response)
+
+    async def _renew_session(self):
+        self._locks()
+        count = 0
+        while count < RENEW_SESSION_MAX_ATTEMPTS:
+            try:
+                if self.shared_data.session and not self.shared_data.session.valid():
+                    async with self._session_lock:
+                        # Another task may have refreshed it meanwhile.
+                        if not self.shared_data.session.valid():
+                            await self._refresh_token()
+                break
+            except UnauthorizedException:
+                logger.warning(
+                    f"[Attempt {count + 1} of "
+                    f"{RENEW_SESSION_MAX_ATTEMPTS}] "
+                    "Failed to refresh token.",
+                    exc_info=True,
+                    stack_info=True)
+                await asyncio.sleep(RENEW_SESSION_RETRY_INTERVAL_SEC)
+                count += 1
+
+    async def _query(self, query, blob_array=[], try_resume=True) -> Tuple[CommandResponses, Blobs]:
+        self._locks()
+        tries = 0
+        while tries < self.config.retry_max_attempts:
+            try:
+                if not self.connected:
+                    await self.connect(details="Connect from _query")
+                data = serialize_query(
+                    query, blob_array, self.shared_data.session)
+                response = await self._exchange(data)
+                return parse_response(response)
+            except (OSError, ssl.SSLError, asyncio.IncompleteReadError) as e:
+                logger.warning(
+                    f"Connection error on process {os.getpid()}: {e!r}")
+
+            tries += 1
+            logger.warning(
+                f"Connection broken. Reconnecting attempt [{tries}/{self.config.retry_max_attempts}] .. PID = {os.getpid()}")
+            await asyncio.sleep(self.config.retry_interval_seconds)
+
+            await self.connect(
+                details=f"Will retry in {self.config.retry_interval_seconds} seconds")
+            # Resuming the session is skipped when already in the
+            # authentication path, as in Connector.
+            if try_resume and self.connected:
+                await self._renew_session()
+
+        raise Exception(
+            f"Could not query ApertureDB using TCP. \r\n\
+            {self.connected=}\r\n \
+            {self.authenticated=} \r\n \
+            attempts={tries}/{self.config.retry_max_attempts} \r\n \
+            {self.config=}")
+
+    async def query(self, q, blobs=[]) -> Tuple[CommandResponses, Blobs]:
+        """
+        Query the database with a query string or a json object.
+        First it checks if the session is valid, if not, it refreshes the token.
+        Then it sends the query to the server and returns the response.
+
+        Args:
+            q (json): native query to be sent
+            blobs (list, optional): Blobs if needed with the query. Defaults to [].
+
+        Returns:
+            tuple: The response and the returned blobs.
+        """
+        await self._renew_session()
+        if self.should_authenticate:
+            await self.authenticate(
+                shared_data=self.shared_data,
+                user=self.config.username,
+                password=self.config.password,
+                token=self.token)
+
+        try:
+            start = time.time()
+            response, response_blobs = await self._query(q, blobs)
+            if not isinstance(response, list) and response.get("info") == "Not Authenticated!":
+                # The session expired while the query was sent.
+                logger.warning(
+                    f"Session expired while query was sent. Retrying... {self.config}")
+                await self._renew_session()
+                start = time.time()
+                response, response_blobs = await self._query(q, blobs)
+            self.last_query_time = time.time() - start
+            self.last_query_timestamp = datetime.now()
+            return response, response_blobs
+        except BaseException:
+            logger.critical("Failed to query",
+                            exc_info=True, stack_info=True)
+            raise
+
+    def clone(self) -> AsyncConnector:
+        """
+        Create a new AsyncConnector with the same parameters and session as the current one.
+        Each clone has its own connection to the database.
+
+        Returns:
+            AsyncConnector: Clone of original AsyncConnector
+        """
+        return type(self)(
+            shared_data=self.shared_data,
+            config=self.config)
+
+    def get_last_query_time(self):
+
+        return self.last_query_time
+
+    def check_status(self, json_res: CommandResponses) -> int:
+        """
+        Returns the status of the first command response from the server.
+        Can traverse a JSON recursively to find the first status.
+
+        Args:
+            json_res (CommandResponses): The actual response from the server.
+
+        Returns:
+            int: The value recieved from the server, or -2 if not found.
+        """
+        status = STATUS_ERROR_DEFAULT
+        if (isinstance(json_res, dict)):
+            if ("status" not in json_res):
+                status = self.check_status(json_res[list(json_res.keys())[0]])
+            else:
+                status = json_res["status"]
+        elif (isinstance(json_res, (tuple, list))):
+            if ("status" not in json_res[0]):
+                status = self.check_status(json_res[0])
+            else:
+                status = json_res[0]["status"]
+
+        return status
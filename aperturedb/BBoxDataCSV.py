@@ -75,8 +75,9 @@ class BBoxDataCSV(CSVParser.CSVParser):
         }
 
     def getitem(self, idx):
+        idx = self.df.index.start + idx
         q = []
-        img_id = self.df.loc[idx, self.img_key]
+        img_id = self.cell(idx, self.img_key)
         fi = {
             "FindImage": {
                 "_ref": 1,
@@ -91,7 +92,7 @@ class BBoxDataCSV(CSVParser.CSVParser):
 
         box_data_headers = [HEADER_X_POS,
                             HEADER_Y_POS, HEADER_WIDTH, HEADER_HEIGHT]
-        box_data = [int(self.df.loc[idx, h]) for h in box_data_headers]
+        box_data = [int(self.cell(idx, h)) for h in box_data_headers]
 
         rect_attrs = ["x", "y", "width", "height"]
         custom_fields = {
@@ -1,6 +1,7 @@
 import logging
 import os
 from aperturedb import CSVParser
+from aperturedb.Sources import map_file
 
 PROPERTIES = "properties"
 CONSTRAINTS = "constraints"
@@ -66,8 +67,9 @@ class BlobDataCSV(CSVParser.CSVParser):
         }
 
     def getitem(self, idx):
+        idx = self.df.index.start + idx
         filename = os.path.join(self.relative_path_prefix,
-                                self.df.loc[idx, BLOB_PATH])
+                                self.cell(idx, BLOB_PATH))
         blob_ok, blob = self.load_blob(filename)
         if not blob_ok:
             logger.error("Error loading blob: " + filename)
@@ -82,6 +84,8 @@ class BlobDataCSV(CSVParser.CSVParser):
     def load_blob(self, filename):
 
         try:
+            if self.mmap_blobs:
+                return True, map_file(filename)
             fd = open(filename, "rb")
             buff = fd.read()
             fd.close()
@@ -1,4 +1,5 @@
 from typing import Set
+import numpy as np
 import pandas as pd
 import logging
 from aperturedb.Subscriptable import Subscriptable
@@ -22,6 +23,147 @@ PARTITIONS_PER_CORE = 10
 # Use 90% os the CPU cores by default.
 CORES_USED_FOR_PARALLELIZATION = 0.9
 
+# Files with these extensions are read as typed columns rather than CSV text.
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+
+def columnar_format(filename: str):
+    """
+    "parquet" or "arrow" for columnar files, None for CSV.
+    """
+    name = str(filename).lower()
+    if name.endswith(PARQUET_EXTENSIONS):
+        return "parquet"
+    if name.endswith(ARROW_EXTENSIONS):
+        return "arrow"
+    return None
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turns typed columns into the object DataFrame the loaders expect:
+    dates and timestamps become ISO strings, and nulls become NaN as in a CSV.
+    """
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].map(
+                lambda t: t.isoformat() if not pd.isna(t) else np.nan).astype('object')
+        elif isinstance(df[column].dtype, pd.api.extensions.ExtensionDtype) and \
+                pd.api.types.is_integer_dtype(df[column]):
+            # Nullable integers, sent as Python ints rather than floats.
+            df[column] = pd.Series([int(v) if not pd.isna(v) else np.nan for v in df[column]],
+                                   index=df.index, dtype='object')
+    df = df.astype('object')
+    return df.where(df.notna(), np.nan)
+
+
+def columnar_to_pandas(table) -> pd.DataFrame:
+    """
+    Converts an Arrow table to the DataFrame the loaders expect.
+    """
+    import pyarrow as pa
+    # Integer columns with nulls would otherwise become float64.
+    nullable_integers = {
+        pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(),
+        pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(),
+        pa.uint8(): pd.UInt8Dtype(), pa.uint16(): pd.UInt16Dtype(),
+        pa.uint32(): pd.UInt32Dtype(), pa.uint64(): pd.UInt64Dtype(),
+    }
+    return normalize_columns(table.to_pandas(
+        date_as_object=False, types_mapper=nullable_integers.get))
+
+
+def _read_arrow(filename: str):
+    import pyarrow as pa
+    # Record batches stay in the mapped file until converted.
+    return pa.ipc.open_file(pa.memory_map(filename, "r")).read_all()
+
+
+def read_columnar(filename: str, row_groups: list = None) -> pd.DataFrame:
+    """
+    Reads a Parquet or Arrow IPC (Feather v2) file, memory mapped.
+    With Parquet, `row_groups` selects a subset of the row groups,
+    so that parallel workers can each take their own.
+    """
+    if columnar_format(filename) == "parquet":
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(filename, memory_map=True)
+        if row_groups is None:
+            table = parquet.read()
+        else:
+            table = parquet.read_row_groups(row_groups)
+    else:
+        if row_groups is not None:
+            raise ValueError("row_groups only applies to Parquet files.")
+        table = _read_arrow(filename)
+    return columnar_to_pandas(table)
+
+
+def conform_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """
+    Casts the numeric columns of a streamed CSV chunk to the dtypes inferred
+    for the first chunk, where pandas inferred them differently: integers
+    of a float column become floats, and floats of an integer column, which
+    only differ by missing values, become integers again.
+    """
+    for column, dtype in dtypes.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        values = df[column]
+        if pd.api.types.is_float_dtype(dtype) and pd.api.types.is_numeric_dtype(values) \
+                and not pd.api.types.is_bool_dtype(values):
+            df[column] = values.astype(dtype)
+        elif pd.api.types.is_integer_dtype(dtype) and pd.api.types.is_float_dtype(values):
+            present = values.dropna()
+            if (present == present.round()).all():
+                # Missing values stay NaN, and are skipped as properties.
+                df[column] = pd.Series([int(v) if v == v else v for v in values],
+                                       index=values.index, dtype="object")
+    return df
+
+
+def iter_columnar(filename: str, chunksize: int):
+    """
+    Streams a Parquet or Arrow IPC file by DataFrames of `chunksize` rows.
+
+    Returns:
+        (chunks, progress): The iterator of DataFrames, and a function giving
+        the bytes of the file consumed so far, estimated from the rows read.
+    """
+    import pyarrow as pa
+    size = os.path.getsize(filename)
+    if columnar_format(filename) == "parquet":
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(filename, memory_map=True)
+        total = parquet.metadata.num_rows
+        schema = parquet.schema_arrow
+        tables = (pa.Table.from_batches([batch])
+                  for batch in parquet.iter_batches(batch_size=chunksize))
+    else:
+        table = _read_arrow(filename)
+        total = table.num_rows
+        schema = table.schema
+        tables = (table.slice(offset, chunksize)
+                  for offset in range(0, total, chunksize))
+    rows = [0]
+
+    def chunks():
+        if total == 0:
+            yield columnar_to_pandas(schema.empty_table())
+            return
+        for table in tables:
+            df = columnar_to_pandas(table)
+            # Keep the row labels running across chunks, as with CSV chunks.
+            df.index = pd.RangeIndex(rows[0], rows[0] + len(df))
+            rows[0] += len(df)
+            yield df
+
+    def progress():
+        return size if total == 0 else size * rows[0] // total
+
+    return chunks(), progress
+
 
 class CSVParser(Subscriptable):
     """
@@ -34,6 +176,20 @@ class CSVParser(Subscriptable):
         The tricky bit is that the chunk size is not known till the loader is created, so the processing happens when ingest is called.
         So the Data CSV has another signature, where the df is passed explicitly.
 
+    With `chunksize=N` in normal mode, the CSV file is streamed: only N rows are in memory
+    at a time, and `ParallelLoader` ingests the file chunk by chunk, reporting progress in bytes.
+    `len()` is then the length of the current chunk. The numeric types of the columns
+    follow the first chunk: a column of integers stays integers when a later chunk has
+    missing values, while a full read would turn the whole column into floats.
+
+    Files named `*.parquet` or `*.arrow` / `*.feather` (Arrow IPC) are read as typed columns,
+    memory mapped, with the same header conventions as the CSV files. With Parquet,
+    `row_groups=[...]` restricts a loader to some of the row groups, and Dask mode
+    uses one partition per row group.
+
+    Loaders that read blobs from local files (images, videos, blobs) accept `mmap_blobs=True`
+    to map the files instead of reading them, so that a batch does not need to be resident in memory.
+
     Typically, the response_handler is application specific, and loading does not break
     on errors in response_handlers, so the default behavior is to log the error and continue.
     If you want to break on errors, set strict_response_validation to True.
@@ -52,13 +208,42 @@ class CSVParser(Subscriptable):
         self.blobs_relative_to_csv = "blobs_relative_to_csv" in kwargs and kwargs[
             "blobs_relative_to_csv"]
         self.use_dask = "use_dask" in kwargs and kwargs["use_dask"]
+        # Map local files used as blobs rather than reading them into memory.
+        self.mmap_blobs = "mmap_blobs" in kwargs and kwargs["mmap_blobs"]
+        # Rows per chunk when streaming the CSV file.
+        self.chunksize = kwargs["chunksize"] if "chunksize" in kwargs else None
         df = kwargs["df"] if "df" in kwargs else None
+        # Parquet row groups to read, all by default.
+        row_groups = kwargs["row_groups"] if "row_groups" in kwargs else None
+        columnar = columnar_format(filename)
+        self._csv_file = None
+        self._chunks = None
+        self._progress = None
+        # Dtypes of the first CSV chunk, which the next chunks are cast to.
+        self._chunk_dtypes = None
+
+        if self.chunksize and (df is not None or self.use_dask):
+            raise ValueError(
+                "Streaming with chunksize requires a CSV filename and normal mode.")
 
         self.relative_path_prefix = os.path.dirname(self.filename) if self.blobs_relative_to_csv \
             else ""
 
         if not self.use_dask:
-            if df is None:
+            if df is None and self.chunksize and columnar:
+                self._chunks, self._progress = iter_columnar(
+                    filename, self.chunksize)
+                self.df = next(self._chunks)
+            elif df is None and self.chunksize:
+                self._csv_file = open(filename, "rb")
+                self._chunks = pd.read_csv(
+                    self._csv_file, chunksize=self.chunksize)
+                self._progress = self._csv_file.tell
+                self.df = next(self._chunks)
+                self._chunk_dtypes = self.df.dtypes.to_dict()
+            elif df is None and columnar:
+                self.df = read_columnar(filename, row_groups)
+            elif df is None:
                 self.df = pd.read_csv(filename)
             else:
                 self.df = df
@@ -73,6 +258,14 @@ class CSVParser(Subscriptable):
             if df is not None:
                 raise ValueError(
                     "Dask mode requires a CSV filename; DataFrame inputs are not supported.")
+        if self.use_dask and columnar:
+            if columnar != "parquet":
+                raise ValueError(
+                    "Dask mode supports CSV and Parquet files, not Arrow IPC.")
+            self.df = dataframe.read_parquet(
+                self.filename, split_row_groups=True,
+                dtype_backend="numpy_nullable").map_partitions(normalize_columns)
+        elif self.use_dask:
             # It'll impact the number of partitions, and memory usage.
             # TODO: tune this for the best performance.
             cores_used = int(CORES_USED_FOR_PARALLELIZATION * mp.cpu_count())
@@ -97,6 +290,123 @@ class CSVParser(Subscriptable):
     def __len__(self):
         return len(self.df.index)
 
+    def __getstate__(self):
+        # The column arrays are views of the DataFrame, they are rebuilt on demand.
+        state = self.__dict__.copy()
+        state.pop("_columns", None)
+        state.pop("_columns_df", None)
+        state.pop("_progress", None)
+        if state.get("_chunks") is not None:
+            raise TypeError("A streamed CSVParser cannot be pickled.")
+        return state
+
+    def streaming(self) -> bool:
+        return self._chunks is not None
+
+    def next_chunk(self) -> bool:
+        """
+        When streaming, replaces the rows with the next chunk of the file.
+
+        Returns:
+            bool: False once the file is exhausted.
+        """
+        if self._chunks is None:
+            return False
+        try:
+            df = next(self._chunks)
+        except StopIteration:
+            self._chunks.close()
+            if self._csv_file is not None:
+                self._csv_file.close()
+            self._chunks = None
+            return False
+        if self._chunk_dtypes is not None:
+            df = conform_dtypes(df, self._chunk_dtypes)
+        self.df = df.astype('object')
+        return True
+
+    def file_size(self) -> int:
+        return os.path.getsize(self.filename)
+
+    def bytes_read(self) -> int:
+        """
+        Bytes of the file consumed so far, by chunks of the parser's buffer.
+        """
+        if self._chunks is None:
+            return self.file_size()
+        return self._progress()
+
+    def _column(self, key):
+        """
+        Values of a column as a NumPy array, cached so that rows are read
+        by position rather than through the pandas indexing machinery.
+        """
+        if getattr(self, "_columns_df", None) is not self.df:
+            self._columns = {}
+            self._columns_df = self.df
+        column = self._columns.get(key)
+        if column is None:
+            column = self.df[key].to_numpy()
+            self._columns[key] = column
+        return column
+
+    def cell(self, idx, key):
+        """
+        Value of column `key` in the row labelled `idx`, same as `self.df.loc[idx, key]`.
+        Raises KeyError for labels outside of the rows, as `loc` does.
+        """
+        index = self.df.index
+        column = self._column(key)
+        position, offset = divmod(idx - index.start, index.step)
+        if offset != 0 or not 0 <= position < len(column):
+            raise KeyError(idx)
+        return column[position]
+
+    def _key_mapping(self, keys) -> list:
+        """
+        Properties named by the columns `keys`, with their prefixes parsed once:
+        a list of (column, property, is_date).
+        """
+        mappings = self.__dict__.setdefault("_key_mappings", {})
+        keys = tuple(keys)
+        mapping = mappings.get(keys)
+        if mapping is None:
+            mapping = []
+            for key in keys:
+                prop, value = self._parse_prop(key)
+                mapping.append((key, prop, value is not None))
+            mappings[keys] = mapping
+        return mapping
+
+    def _other_constraint_mapping(self, constraint_name, keys) -> list:
+        """
+        Constraints named by the columns `keys`, with their prefixes parsed once:
+        a list of (column, property, operator, is_date).
+        """
+        mappings = self.__dict__.setdefault("_other_constraint_mappings", {})
+        mapping_key = (constraint_name, tuple(keys))
+        mapping = mappings.get(mapping_key)
+        if mapping is None:
+            mapping = []
+            for key in keys:
+                res = re.search(f"^{constraint_name}_date(>|<)?:", key)
+                if res is not None:
+                    prop = key[len(res.group(0)):]  # remove prefix
+                    sort = res.group(0)[-2:][:1]  # get character before :
+
+                    if sort != ">" and sort != "<":
+                        sort = "=="
+                    mapping.append((key, prop, sort, True))
+                else:
+                    prop = key[len(constraint_name):]  # remove "prefix
+                    op = "=="
+                    if prop[0] in [">", "<", "!"]:
+                        op = prop[0]
+                        prop = str(prop[1:])
+                    mapping.append((key, prop, op, False))
+            mappings[mapping_key] = mapping
+        return mapping
+
     def get_indexed_properties(self) -> Set[str]:
         if self.constraints_keys:
             return {self._parse_prop(k)[0] for k in self.constraints_keys}
@@ -117,9 +427,11 @@ class CSVParser(Subscriptable):
 
         properties = {}
         if len(self.props_keys) > 0:
-            for key in self.props_keys:
-                prop, value = self._parse_prop(key, self.df.loc[idx, key])
-                if value == value:  # skips nan valies
+            for key, prop, is_date in self._key_mapping(self.props_keys):
+                value = self.cell(idx, key)
+                if is_date:
+                    properties[prop] = {"_date": value}
+                elif value == value:  # skips nan valies
                     properties[prop] = value
         return properties
 
@@ -127,34 +439,19 @@ class CSVParser(Subscriptable):
 
         constraints = {}
         if len(self.constraints_keys) > 0:
-            for key in self.constraints_keys:
-                prop, value = self._parse_prop(key, self.df.loc[idx, key])
-                constraints[prop] = ["==", self.df.loc[idx, key]]
+            for key, prop, _ in self._key_mapping(self.constraints_keys):
+                constraints[prop] = ["==", self.cell(idx, key)]
         return constraints
 
     def parse_other_constraint(self, constraint_name, keys, idx):
 
         other_constraints = {}
         if len(keys) > 0:
-            for key in keys:
-                res = re.search(f"^{constraint_name}_date(>|<)?:", key)
-                if res is not None:
-                    prop = key[len(res.group(0)):]  # remove prefix
-                    sort = res.group(0)[-2:][:1]  # get character before :
-
-                    if sort != ">" and sort != "<":
-                        sort = "=="
-                    other_constraints[prop] = [
-                        sort, {"_date": self.df.loc[idx, key]}]
-                else:
-                    prop = key[len(constraint_name):]  # remove "prefix
-                    op = "=="
-                    if prop[0] in [">", "<", "!"]:
-                        op = prop[0]
-                        prop = str(prop[1:])
-
-                    value = self.df.loc[idx, key]
-                    other_constraints[prop] = [op, value]
+            for key, prop, op, is_date in self._other_constraint_mapping(constraint_name, keys):
+                value = self.cell(idx, key)
+                if is_date:
+                    value = {"_date": value}
+                other_constraints[prop] = [op, value]
 
         return other_constraints
 
@@ -12,6 +12,7 @@ import logging
 import json
 
 from aperturedb.Configuration import Configuration
+from aperturedb.AsyncConnector import AsyncConnector
 from aperturedb.Connector import Connector
 from aperturedb.ConnectorRest import ConnectorRest
 from aperturedb.types import Blobs, CommandResponses, Commands
@@ -296,12 +297,44 @@ def execute_query(client: Connector, query: Commands,
         CommandResponses: The response.
         Blobs: The blobs.
     """
-    result = 0
     logger.debug(f"Query={query}")
     r, b = client.query(query, blobs)
     logger.debug(f"Response={r}")
 
-    if client.last_query_ok():
+    return _handle_query_result(query, blobs, r, b, client.last_query_ok(),
+                                success_statuses, response_handler,
+                                commands_per_query, blobs_per_query,
+                                strict_response_validation, cmd_index)
+
+
+async def execute_query_async(client: AsyncConnector, query: Commands,
+                              blobs: Blobs = [],
+                              success_statuses: list[int] = [0],
+                              response_handler: Optional[Callable] = None, commands_per_query: int = 1, blobs_per_query: int = 0,
+                              strict_response_validation: bool = False, cmd_index=None) -> Tuple[int, CommandResponses, Blobs]:
+    """
+    Counterpart of `execute_query` for an AsyncConnector.
+    Takes the same arguments and returns the same result code, responses and blobs.
+
+    Unlike `Connector.last_query_ok`, the status is computed from this query's own response,
+    so that many queries can be awaited concurrently on the same client.
+    """
+    logger.debug(f"Query={query}")
+    r, b = await client.query(query, blobs)
+    logger.debug(f"Response={r}")
+
+    return _handle_query_result(query, blobs, r, b, client.check_status(r) >= 0,
+                                success_statuses, response_handler,
+                                commands_per_query, blobs_per_query,
+                                strict_response_validation, cmd_index)
+
+
+def _handle_query_result(query, blobs, r, b, query_ok: bool,
+                         success_statuses, response_handler,
+                         commands_per_query, blobs_per_query,
+                         strict_response_validation, cmd_index) -> Tuple[int, CommandResponses, Blobs]:
+    result = 0
+    if query_ok:
         if response_handler is not None:
             try:
                 map_response_to_handler(response_handler,
@@ -77,9 +77,10 @@ class ConnectionDataCSV(CSVParser):
         }
 
     def getitem(self, idx):
-        src_value = self.df.loc[idx, self.header[1]]
-        dst_value = self.df.loc[idx, self.header[2]]
-        connection_class = self.df.loc[idx, CONNECTION_CLASS]
+        idx = self.df.index.start + idx
+        src_value = self.cell(idx, self.header[1])
+        dst_value = self.cell(idx, self.header[2])
+        connection_class = self.cell(idx, CONNECTION_CLASS)
         q = []
 
         try:
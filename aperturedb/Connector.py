@@ -39,7 +39,9 @@ from datetime import datetime, timedelta
 
 import keepalive
 
-from threading import Lock
+import queue
+from concurrent.futures import Future
+from threading import BoundedSemaphore, Condition, Lock, Thread
 from types import SimpleNamespace
 from dataclasses import dataclass
 from aperturedb.Configuration import Configuration
@@ -52,6 +54,9 @@ PROTOCOL_VERSION = 1
 MESSAGE_LENGTH_FORMAT = '@I'
 MESSAGE_LENGTH_SIZE = struct.calcsize(MESSAGE_LENGTH_FORMAT)
 
+# Maximum number of buffers passed to a single sendmsg call (IOV_MAX on Linux)
+SENDMSG_MAX_BUFFERS = 1024
+
 # Protocol types
 PROTOCOL_TCP = 1
 PROTOCOL_SSL = 2
@@ -66,6 +71,9 @@ DEFAULT_RETRY_MAX_ATTEMPTS = 3
 DEFAULT_SESSION_EXPIRY_OFFSET_SEC = 10
 DEFAULT_QUERY_CONNECTION_ERROR_SUPPRESSION_DELTA_SEC = 30
 
+# Maximum number of requests in flight on a pipelined connection
+DEFAULT_PIPELINE_DEPTH = 8
+
 # Session renewal constants
 RENEW_SESSION_MAX_ATTEMPTS = 3
 RENEW_SESSION_RETRY_INTERVAL_SEC = 1
@@ -105,6 +113,69 @@ class Session():
         return True
 
 
+def serialize_query(query, blob_array, session: Optional[Session] = None) -> list:
+    """
+    Builds the queryMessage for a query and its blobs.
+    The session token is attached when a session is available.
+
+    Returns a list of buffers whose concatenation is the message:
+    blobs are referenced rather than copied, so they can be any bytes-like
+    object (bytes, memoryview, mmap, NumPy arrays...).
+    """
+    # Check the query type
+    if not isinstance(query, str):  # assumes json
+        query_str = json.dumps(query, default=str)
+    else:
+        query_str = query
+
+    # Same field order as the protobuf serializer: json, blobs, token.
+    fields = [(queryMessage.FIELD_JSON, query_str.encode("utf-8"))]
+    fields.extend((queryMessage.FIELD_BLOBS, blob) for blob in blob_array)
+
+    # Set Auth token, only when not authenticated before
+    if session:
+        fields.append((queryMessage.FIELD_TOKEN,
+                       session.session_token.encode("utf-8")))
+
+    return queryMessage.encode_fields(fields)
+
+
+def parse_response(response, zero_copy_blobs: bool = False) -> tuple:
+    """
+    Parses a protobuf response message into the JSON response and the list of blobs.
+
+    The message is decoded in place rather than through the protobuf runtime,
+    which would copy the whole message, and then every blob again.
+    With zero_copy_blobs, blobs are returned as memoryview slices of the
+    received buffer; otherwise each blob is copied once into its own bytes object.
+    """
+    json_str = ""
+    blobs = []
+    for field, value in queryMessage.decode_fields(response):
+        if field == queryMessage.FIELD_BLOBS:
+            blobs.append(value if zero_copy_blobs else value.tobytes())
+        elif field == queryMessage.FIELD_JSON:
+            json_str = str(value, "utf-8")
+    return json.loads(json_str), blobs
+
+
+def build_ssl_context(config: Configuration) -> ssl.SSLContext:
+    """
+    Builds the client SSL context described by a Configuration.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    if not config.verify_hostname:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif config.ca_cert:
+        context.load_verify_locations(
+            cafile=config.ca_cert
+        )
+    else:
+        context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    return context
+
+
 class Connector(object):
     """
     **Class to facilitate connections with an instance of ApertureDB**
@@ -130,6 +201,10 @@ class Connector(object):
             Turn this off to reduce traffic on high-cost network connections.
         Configuration (config): Configuration object to use for connection.
         str (key): Apeture Key, configuration as a deflated compressed string
+        bool (zero_copy_blobs): Return the blobs of a response as memoryview slices
+            of the received message instead of bytes copies.
+            This halves peak memory on large responses (FindImage, FindVideo),
+            but the blobs then keep the whole response buffer alive.
 
     The Configuration class options:
     host,port,user,password,token,use_ssl,use_keepalive,retry_interval_seconds,retrun_max_attempts
@@ -154,10 +229,12 @@ class Connector(object):
                  retry_max_attempts=DEFAULT_RETRY_MAX_ATTEMPTS,
                  config: Optional[Configuration] = None,
                  key: Optional[str] = None,
-                 connect: bool = False):
+                 connect: bool = False,
+                 zero_copy_blobs: bool = False):
         """
         Constructor for the Connector class.
         """
+        self.zero_copy_blobs = zero_copy_blobs
         self.connected = False
         self.last_response = ''
         self.last_query_time = 0
@@ -203,6 +280,7 @@ class Connector(object):
             self.shared_data = SimpleNamespace()
             self.shared_data.session = None
             self.shared_data.lock = Lock()
+            self.shared_data.query_observers = []
         else:
             self.shared_data = shared_data
 
@@ -229,35 +307,73 @@ class Connector(object):
             self.authenticated = True
 
     def __del__(self):
+        self.disconnect()
+
+    def disconnect(self):
+        """
+        Closes the socket of the connection, if open.
+        """
         if self.connected:
             self.conn.close()
             self.connected = False
 
     def _send_msg(self, data):
-        if len(data) > (DEFAULT_MAX_MESSAGE_SIZE_MB * 2**20):
+        # data is either a single buffer, or a list of buffers making up the message.
+        buffers = data if isinstance(data, list) else [data]
+        length = sum(len(buffer) for buffer in buffers)
+        if length > (DEFAULT_MAX_MESSAGE_SIZE_MB * 2**20):
             logger.warning(
                 "Message sent is larger than default for ApertureDB Server. Server may disconnect.")
 
         sent_len = struct.pack(MESSAGE_LENGTH_FORMAT,
-                               len(data))  # send size first
-        self.conn.sendall(sent_len + data)
+                               length)  # send size first
+        if hasattr(self.conn, "sendmsg") and not isinstance(self.conn, ssl.SSLSocket):
+            # Gather the header and the parts of the message in one system call,
+            # without concatenating them.
+            self._sendmsg_all([sent_len] + buffers)
+        else:
+            # SSL sockets do not support sendmsg; the parts are sent one by one.
+            # The header goes with the first part if it is small.
+            if len(buffers[0]) < queryMessage.ENCODE_INLINE_LIMIT:
+                buffers = [sent_len + buffers[0]] + buffers[1:]
+            else:
+                buffers = [sent_len] + buffers
+            for buffer in buffers:
+                self.conn.sendall(buffer)
+
+    def _sendmsg_all(self, buffers):
+        buffers = [memoryview(buffer) for buffer in buffers]
+        first = 0
+        while first < len(buffers):
+            sent = self.conn.sendmsg(
+                buffers[first:first + SENDMSG_MAX_BUFFERS])
+            # Skip what was sent, which may end in the middle of a buffer.
+            while sent > 0 and sent >= len(buffers[first]):
+                sent -= len(buffers[first])
+                first += 1
+            if sent > 0:
+                buffers[first] = buffers[first][sent:]
+
+    def _recv_into(self, view) -> bool:
+        # Fills the buffer in place; returns False if the connection is closed.
+        read = 0
+        while read < len(view):
+            received = self.conn.recv_into(view[read:])
+            if received == 0:
+                return False
+            read += received
+        return True
 
     def _recv_msg(self):
-        recv_len = self.conn.recv(MESSAGE_LENGTH_SIZE)  # get message size
-        if recv_len == b'':
+        header = bytearray(MESSAGE_LENGTH_SIZE)  # get message size
+        if not self._recv_into(memoryview(header)):
             return None
-        recv_len = struct.unpack(MESSAGE_LENGTH_FORMAT, recv_len)[0]
+        recv_len = struct.unpack(MESSAGE_LENGTH_FORMAT, header)[0]
+        # The whole message is received in a single preallocated buffer.
         response = bytearray(recv_len)
-        read = 0
-        while read < recv_len:
-            packet = self.conn.recv(recv_len - read)
-            if recv_len == b'':
-                return None
-            if not packet:
-                logger.error("Error receiving")
-                return None
-            response[read:] = packet
-            read += len(packet)
+        if not self._recv_into(memoryview(response)):
+            logger.error("Error receiving")
+            return None
 
         return response
 
@@ -347,16 +463,7 @@ class Connector(object):
         2. verify_hostname is True and ca_cert is provided, we verify the hostname using the provided ca_cert
         3. verify_hostname is True and ca_cert is not provided, we verify the hostname using the system's default CA certificates
         """
-        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        if not self.config.verify_hostname:
-            self.context.check_hostname = False
-            self.context.verify_mode = ssl.CERT_NONE
-        elif self.config.ca_cert:
-            self.context.load_verify_locations(
-                cafile=self.config.ca_cert
-            )
-        else:
-            self.context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+        self.context = build_ssl_context(self.config)
         return self.context
 
     def _connect(self):
@@ -457,27 +564,15 @@ class Connector(object):
                     exc_info=True,
                     stack_info=True)
 
-    def _query(self, query, blob_array = [], try_resume=True):
-        response_blob_array = []
-        # Check the query type
-        if not isinstance(query, str):  # assumes json
-            query_str = json.dumps(query, default=str)
-        else:
-            query_str = query
-
-        query_msg = queryMessage.queryMessage()
-        # query has .json and .blobs
-        query_msg.json = query_str
-
-        # Set Auth token, only when not authenticated before
-        if self.shared_data.session:
-            query_msg.token = self.shared_data.session.session_token
+    def _serialize_query(self, query, blob_array = []):
+        return serialize_query(query, blob_array, self.shared_data.session)
 
-        for blob in blob_array:
-            query_msg.blobs.append(blob)
+    def _parse_response(self, response):
+        return parse_response(response, zero_copy_blobs=self.zero_copy_blobs)
 
-        # Serialize with protobuf and send
-        data = query_msg.SerializeToString()
+    def _query(self, query, blob_array = [], try_resume=True):
+        response_blob_array = []
+        data = self._serialize_query(query, blob_array)
 
         if self.conn is None:
             self.connect(details="Initial connect from _query")
@@ -489,10 +584,8 @@ class Connector(object):
                 self._send_msg(data)
                 response = self._recv_msg()
                 if response is not None:
-                    querRes = queryMessage.queryMessage()
-                    queryMessage.ParseFromString(querRes, response)
-                    response_blob_array = [b for b in querRes.blobs]
-                    self.last_response = json.loads(querRes.json)
+                    self.last_response, response_blob_array = \
+                        self._parse_response(response)
                     break
             except ssl.SSLEOFError as ssle:
                 # this can happen when working in a notebook.
@@ -596,12 +689,63 @@ class Connector(object):
                 self.response, self.blobs = self._query(q, blobs)
             self.last_query_time = time.time() - start
             self.last_query_timestamp = datetime.now()
+            for observer in getattr(self.shared_data, "query_observers", []):
+                observer(q, self.response)
             return self.response, self.blobs
         except BaseException as e:
             logger.critical("Failed to query",
                             exc_info=True, stack_info=True)
             raise
 
+    def add_query_observer(self, observer) -> None:
+        """
+        Register a callable invoked as `observer(query, response)` after every
+        query sent with `query`, by this Connector or any of its clones.
+
+        Args:
+            observer (callable): Called from the thread that sent the query.
+        """
+        if not hasattr(self.shared_data, "query_observers"):
+            self.shared_data.query_observers = []
+        if observer not in self.shared_data.query_observers:
+            self.shared_data.query_observers.append(observer)
+
+    def remove_query_observer(self, observer) -> None:
+        """
+        Unregister an observer added with `add_query_observer`.
+        """
+        observers = getattr(self.shared_data, "query_observers", [])
+        if observer in observers:
+            observers.remove(observer)
+
+    def pipeline(self, depth: int = DEFAULT_PIPELINE_DEPTH) -> Pipeline:
+        """
+        Open a pipelined mode on this connection.
+        Queries submitted to the pipeline are sent back-to-back without
+        waiting for the previous response, and their responses are collected
+        in order, so that a single connection keeps the server busy across
+        the round trip time.
+
+        While the pipeline is open, `query` should not be called on this
+        Connector from other threads. Over SSL, the queries are run one at
+        a time instead.
+
+        Example usage:
+        ``` python
+            with client.pipeline(depth=16) as pipeline:
+                futures = [pipeline.submit(q, blobs) for q, blobs in queries]
+                for future in futures:
+                    response, blobs = future.result()
+        ```
+
+        Args:
+            depth (int, optional): Maximum number of queries in flight. Defaults to DEFAULT_PIPELINE_DEPTH.
+
+        Returns:
+            Pipeline: The pipeline, to be closed once done.
+        """
+        return Pipeline(self, depth=depth)
+
     def _renew_session(self):
         count = 0
         while count < RENEW_SESSION_MAX_ATTEMPTS:
@@ -628,9 +772,11 @@ class Connector(object):
         Returns:
             Connector: Clone of original Connector
         """
-        return type(self)(
+        clone = type(self)(
             shared_data=self.shared_data,
             config=self.config)
+        clone.zero_copy_blobs = self.zero_copy_blobs
+        return clone
 
     def create_new_connection(self):
         from aperturedb.CommonLibrary import issue_deprecation_warning
@@ -689,3 +835,191 @@ class Connector(object):
                 status = json_res[0]["status"]
 
         return status
+
+
+class Pipeline(object):
+    """
+    **Pipelined requests over a single Connector**
+
+    Requests are framed and sent as soon as they are submitted, and a
+    background reader matches responses to requests in submission order
+    (the server answers requests on a connection in the order it reads them).
+    Each submission returns a `concurrent.futures.Future` that resolves to
+    the same `(response, blobs)` tuple that `Connector.query` returns.
+
+    At most `depth` requests are in flight at any time; `submit` blocks
+    until a slot frees up. Authentication, session refresh and reconnection
+    go through the regular synchronous path of the Connector, and only
+    happen once all in-flight requests have been answered.
+
+    If the connection breaks, the futures for all requests in flight fail
+    with the underlying error, as their responses are lost. The next
+    submission reconnects. Requests are not retried automatically.
+
+    An SSL socket cannot be read from one thread while another one writes
+    to it, so over SSL the requests are not pipelined: each submission is
+    sent and answered synchronously, one at a time, and the returned
+    future is already resolved.
+
+    Args:
+        Connector (connector): The connector whose connection is used.
+        int (depth): Maximum number of requests in flight.
+    """
+
+    def __init__(self, connector: Connector, depth: int = DEFAULT_PIPELINE_DEPTH):
+        if depth <= 0:
+            raise ValueError("Pipeline depth must be greater than 0.")
+
+        self.connector = connector
+        self.depth = depth
+        self._slots = BoundedSemaphore(depth)
+        self._send_lock = Lock()
+        self._pending = queue.Queue()
+        self._in_flight = 0
+        self._idle = Condition()
+        self._broken = False
+        self._closed = False
+        self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _wait_idle(self):
+        with self._idle:
+            while self._in_flight > 0:
+                self._idle.wait()
+
+    def _needs_sync(self) -> bool:
+        connector = self.connector
+        session = connector.shared_data.session
+        return self._broken \
+            or not connector.connected \
+            or (connector.should_authenticate and not connector.authenticated) \
+            or (session is not None and not session.valid())
+
+    def _prepare(self):
+        """
+        Brings the connection into a usable state using the synchronous
+        Connector path. Must be called with nothing in flight.
+        """
+        connector = self.connector
+        if self._broken or not connector.connected:
+            if connector.connected:
+                connector.conn.close()
+                connector.connected = False
+            connector.connect(details="Reconnect from pipeline")
+            if not connector.connected:
+                raise ConnectionError(
+                    f"Could not connect pipeline to ApertureDB: {connector.config}")
+            self._broken = False
+
+        connector._renew_session()
+        if connector.should_authenticate:
+            connector.authenticate(
+                shared_data=connector.shared_data,
+                user=connector.config.username,
+                password=connector.config.password,
+                token=connector.token)
+
+    def _read_responses(self):
+        while True:
+            future = self._pending.get()
+            if future is None:
+                return
+            try:
+                if self._broken:
+                    raise ConnectionError(
+                        "Connection broken before the response was received")
+                response = self.connector._recv_msg()
+                if response is None:
+                    raise ConnectionError(
+                        "Connection closed while waiting for a pipelined response")
+                future.set_result(self.connector._parse_response(response))
+            except BaseException as e:
+                if not self._broken:
+                    logger.warning(
+                        f"Pipelined receive failed on process {os.getpid()}",
+                        exc_info=True)
+                self._broken = True
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+                with self._idle:
+                    self._in_flight -= 1
+                    self._idle.notify_all()
+
+    def submit(self, q, blobs=[]) -> Future:
+        """
+        Send a query without waiting for its response.
+
+        Args:
+            q (json): native query to be sent
+            blobs (list, optional): Blobs if needed with the query. Defaults to [].
+
+        Returns:
+            Future: Resolves to the (response, blobs) tuple of the query.
+        """
+        if self._closed:
+            raise RuntimeError("Pipeline is closed.")
+
+        if self.connector.use_ssl:
+            with self._send_lock:
+                return self._submit_sync(q, blobs)
+
+        self._slots.acquire()
+        future = Future()
+        try:
+            with self._send_lock:
+                if self._needs_sync():
+                    self._wait_idle()
+                    self._prepare()
+
+                if self._reader is None:
+                    self._reader = Thread(
+                        target=self._read_responses, daemon=True)
+                    self._reader.start()
+
+                # Serialize after any session refresh, to send the current token.
+                data = self.connector._serialize_query(q, blobs)
+                self.connector._send_msg(data)
+                with self._idle:
+                    self._in_flight += 1
+                self._pending.put(future)
+        except BaseException as e:
+            self._slots.release()
+            if isinstance(e, OSError):
+                self._broken = True
+            future.set_exception(e)
+
+        return future
+
+    def _submit_sync(self, q, blobs) -> Future:
+        future = Future()
+        try:
+            future.set_result(self.connector.query(q, blobs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def drain(self):
+        """
+        Wait until the responses for all submitted queries have been received.
+        """
+        self._wait_idle()
+
+    def close(self):
+        """
+        Wait for all submitted queries to complete, and stop the reader.
+        The Connector can be used normally afterwards.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.drain()
+        if self._reader is not None:
+            self._pending.put(None)
+            self._reader.join()
+            self._reader = None
@@ -33,7 +33,8 @@ import logging
 
 from types import SimpleNamespace
 from typing import Optional
-from aperturedb.Connector import Connector
+from concurrent.futures import Future
+from aperturedb.Connector import Connector, Pipeline, DEFAULT_PIPELINE_DEPTH
 from aperturedb.Configuration import Configuration
 from requests.adapters import HTTPAdapter
 import ssl
@@ -63,6 +64,21 @@ class CustomHTTPAdapter(HTTPAdapter):
         super().init_poolmanager(*args, **kwargs, ssl_context=context)
 
 
+class RestPipeline(Pipeline):
+    """
+    **Pipeline interface for ConnectorRest**
+
+    HTTP requests are not framed on a shared socket, so submissions
+    are executed synchronously, and the returned futures are already resolved.
+    """
+
+    def submit(self, q, blobs=[]) -> Future:
+        if self._closed:
+            raise RuntimeError("Pipeline is closed.")
+
+        return self._submit_sync(q, blobs)
+
+
 class ConnectorRest(Connector):
     """
     **Class to use ApertureDB's REST interface**
@@ -128,7 +144,11 @@ class ConnectorRest(Connector):
 
     def __del__(self):
         logger.info("Done with connector REST.")
+        self.disconnect()
+
+    def disconnect(self):
         self.http_session.close()
+        self.connected = False
 
     def _query(self, query, blob_array = [], try_resume=True):
         response_blob_array = []
@@ -188,6 +208,9 @@ class ConnectorRest(Connector):
                 f"Could not query ApertureDB {self.config} using REST.")
         return (self.last_response, response_blob_array)
 
+    def pipeline(self, depth: int = DEFAULT_PIPELINE_DEPTH) -> RestPipeline:
+        return RestPipeline(self, depth=depth)
+
     def _connect(self):
         logger.info("Connecting to ApertureDB using REST")
         self.connected = True
@@ -4,9 +4,17 @@
 This module provides the `DaskManager` class responsible for setting up a
 local Dask cluster and assigning parts of data to each worker to perform
 parallel distributed processing.
+
+Local clusters are shared by all the DaskManagers of the process: the first
+one with a given number of workers starts the cluster, and later ones reuse
+it. Setting the `scheduler-address` of the dask configuration (for instance
+through the `DASK_SCHEDULER_ADDRESS` environment variable) attaches to an
+existing scheduler instead.
 """
 from __future__ import annotations
+import atexit
 import logging
+import math
 from threading import Lock
 import time
 from types import SimpleNamespace
@@ -22,33 +30,142 @@ dask.config.set({"dataframe.convert-string": False})
 
 logger = logging.getLogger(__name__)
 
+# Local clusters of the process, by number of workers.
+_clusters = {}
+_clusters_lock = Lock()
+
+
+def _acquire_cluster(workers: int) -> SimpleNamespace:
+    with _clusters_lock:
+        shared = _clusters.get(workers)
+        if shared is None:
+            logger.info(f"Starting local cluster with {workers} workers")
+            cluster = LocalCluster(n_workers=workers)
+            cluster.shutdown_on_close = False
+            shared = SimpleNamespace(
+                cluster=cluster, client=Client(cluster), refs=0)
+            _clusters[workers] = shared
+        shared.refs += 1
+        return shared
+
+
+def _release_cluster(workers: int) -> None:
+    with _clusters_lock:
+        shared = _clusters.get(workers)
+        if shared is not None and shared.refs > 0:
+            shared.refs -= 1
+
+
+def shutdown_clusters(in_use: bool = False) -> None:
+    """
+    Closes the local clusters of the process which are not in use.
+    They are otherwise kept until the process exits, when all are closed.
+
+    Args:
+        in_use (bool, optional): Close the clusters still used by DaskManagers too. Defaults to False.
+    """
+    with _clusters_lock:
+        for workers, shared in list(_clusters.items()):
+            if shared.refs > 0 and not in_use:
+                continue
+            logger.info(".......Shutting cluster.........")
+            shared.client.close()
+            shared.cluster.close()
+            del _clusters[workers]
+
+
+# shutdown_on_close is off for the shared clusters, so they are closed here,
+# including the ones of DaskManagers which were never closed.
+atexit.register(shutdown_clusters, in_use=True)
+
+
+def _connect(host, port, use_ssl, ca_cert, verify_hostname, session, connector_type) -> Connector:
+    shared_data = SimpleNamespace()
+    shared_data.session = session
+    shared_data.lock = Lock()
+    return connector_type(
+        host=host, port=port,
+        use_ssl=use_ssl,
+        ca_cert=ca_cert,
+        verify_hostname=verify_hostname,
+        shared_data=shared_data)
+
+
+def _process_range(start: int, end: int, generator, QueryClass: type[ParallelQuery],
+                   batchsize: int, connection: tuple) -> Stats:
+    """
+    Runs on a dask worker: executes the queries of generator[start:end].
+    """
+    metrics = Stats()
+    client = _connect(*connection)
+    loader = QueryClass(client)
+    loader.progress_bar = False
+    try:
+        # A single run over the range, so that its one worker thread
+        # clones one connection, released when the thread ends.
+        loader.query(generator=generator[start:end], batchsize=batchsize,
+                     numthreads=1, stats=False)
+    finally:
+        loader.client.disconnect()
+        client.disconnect()
+    metrics.times_arr.extend(loader.times_arr)
+    metrics.error_counter += loader.error_counter
+    metrics.objects_existed += loader.get_objects_existed()
+    metrics.succeeded_queries += loader.get_succeeded_queries()
+    metrics.succeeded_commands += loader.get_succeeded_commands()
+    return metrics
+
 
 class DaskManager:
     """
     **Class responsible for setting up a local cluster and assigning parts
     of data to each worker**
+
+    Args:
+        num_workers (int, optional): Number of workers of the local cluster.
+            Defaults to -1, which uses 90% of the cores.
+        scheduler_address (str, optional): Address of a running scheduler to attach to,
+            instead of a local cluster. Defaults to the `scheduler-address` of the dask configuration.
     """
 
-    def __init__(self, num_workers: int = -1):
+    def __init__(self, num_workers: int = -1, scheduler_address: str = None):
         self.__num_workers = num_workers
         # The -1 magic number is to use as many 90% of the cores (1 worker per core).
         # This can be overridden by the user.
-        # Create a pool of workers.
-        # TODO: see if the same pool can be reused for multiple tasks.
-        workers = self.__num_workers if self.__num_workers != \
+        self._workers = self.__num_workers if self.__num_workers != \
             -1 else int(0.9 * mp.cpu_count())
+        self._scheduler_address = scheduler_address or \
+            dask.config.get("scheduler-address", None)
+        self._shared = None
+        self._client = None
 
-        self._cluster = LocalCluster(n_workers=workers)
-        self._cluster.shutdown_on_close = False
-        self._client = Client(self._cluster)
+        if self._scheduler_address:
+            logger.info(f"Attaching to scheduler {self._scheduler_address}")
+            self._client = Client(self._scheduler_address)
+        else:
+            # The pool of workers is shared with the other managers.
+            self._shared = _acquire_cluster(self._workers)
+            self._client = self._shared.client
         dask.config.set(scheduler="distributed")
 
+    def close(self) -> None:
+        """
+        Releases the cluster, which stays available to later managers.
+        """
+        if self._shared is not None:
+            _release_cluster(self._workers)
+            self._shared = None
+        elif self._client is not None:
+            self._client.close()
+        self._client = None
+
     def __del__(self):
-        logger.info(".......Shutting cluster.........")
-        self._client.close()
-        self._cluster.close()
+        self.close()
 
     def run(self, QueryClass: type[ParallelQuery], client: Connector, generator, batchsize, stats):
+        if not hasattr(generator, "df") or not hasattr(generator.df, "map_partitions"):
+            return self.run_ranges(QueryClass, client, generator, batchsize, stats)
+
         def process(df, host, port, use_ssl, ca_cert, verify_hostname, session, connnector_type):
             metrics = Stats()
             # Dask reads data in partitions, and the first partition is of 2 rows, with all
@@ -59,15 +176,8 @@ class DaskManager:
                     return
             count = 0
             try:
-                shared_data = SimpleNamespace()
-                shared_data.session = session
-                shared_data.lock = Lock()
-                client = connnector_type(
-                    host=host, port=port,
-                    use_ssl=use_ssl,
-                    ca_cert=ca_cert,
-                    verify_hostname=verify_hostname,
-                    shared_data=shared_data)
+                client = _connect(host, port, use_ssl, ca_cert,
+                                  verify_hostname, session, connnector_type)
             except Exception as e:
                 logger.exception(e)
             #from aperturedb.ParallelLoader import ParallelLoader
@@ -108,3 +218,36 @@ class DaskManager:
         results = computation.compute()
 
         return results, time.time() - start_time
+
+    def run_ranges(self, QueryClass: type[ParallelQuery], client: Connector, generator, batchsize, stats):
+        """
+        Distributes any Subscriptable (data loaders, transformer pipelines)
+        over the workers as ranges of indices, each range being a multiple of `batchsize`.
+        The generator is sent once to every worker, so it must be picklable.
+        """
+        total = getattr(generator, "sample_count", None)
+        if total is None:
+            total = len(generator)
+        workers = max(1, len(self._client.scheduler_info()["workers"]))
+        # A few ranges per worker, so that the slow ones can be balanced.
+        size = max(1, math.ceil(total / (4 * workers * batchsize))) * batchsize
+        starts = list(range(0, total, size))
+        ends = [min(start + size, total) for start in starts]
+
+        start_time = time.time()
+        # Subscriptables are iterators, which scatter would map over.
+        [remote] = self._client.scatter([generator], broadcast=True)
+        # Connector cannot be serialized across processes,
+        # so we pass session and host/port information instead.
+        connection = (client.host, client.port, client.use_ssl,
+                      client.config.ca_cert, client.config.verify_hostname,
+                      client.shared_data.session, type(client))
+        futures = self._client.map(
+            _process_range, starts, ends,
+            generator=remote, QueryClass=QueryClass, batchsize=batchsize,
+            connection=connection, pure=False)
+        if stats:
+            progress(futures)
+        results = self._client.gather(futures)
+
+        return results, time.time() - start_time
@@ -1,5 +1,8 @@
 import numpy as np
 from aperturedb import CSVParser
+from aperturedb.Subscriptable import Wrapper
+from collections import OrderedDict
+from threading import Lock
 import logging
 import os
 
@@ -12,6 +15,9 @@ HEADER_LABEL = "label"
 PROPERTIES = "properties"
 CONSTRAINTS = "constraints"
 
+# Number of descriptor files kept open (memory mapped) at a time.
+MAX_OPEN_DESCRIPTOR_FILES = 16
+
 
 class DescriptorDataCSV(CSVParser.CSVParser):
     """
@@ -25,6 +31,8 @@ class DescriptorDataCSV(CSVParser.CSVParser):
     :::
 
     **filename**: Path to a npz file which comprises of np arrays.
+    `.npy` files are memory mapped, so only the rows being ingested are read,
+    and at most `max_open_files` of them stay open.
 
     **index**: The 0 based index of a np array in the npz file.
 
@@ -68,10 +76,15 @@ class DescriptorDataCSV(CSVParser.CSVParser):
 
     """
 
-    def __init__(self, filename: str, **kwargs):
+    def __init__(self, filename: str, max_open_files: int = MAX_OPEN_DESCRIPTOR_FILES, **kwargs):
 
         super().__init__(filename, **kwargs)
-        self.npy_arrays = {}
+        # Least recently used last, shared by the threads of the loader.
+        self.npy_arrays = OrderedDict()
+        # Files being read by retrieve_by_index, which cannot be evicted.
+        self.npy_pins = {}
+        self.npy_lock = Lock()
+        self.max_open_files = max_open_files
         self.has_label = False
 
         self.props_keys = [x for x in self.header[3:]
@@ -87,12 +100,74 @@ class DescriptorDataCSV(CSVParser.CSVParser):
             }
         }
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["npy_arrays"] = OrderedDict()
+        state["npy_pins"] = {}
+        state.pop("npy_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.npy_lock = Lock()
+
+    def __getitem__(self, subscript):
+        if isinstance(subscript, slice) and \
+                type(self).retrieve_by_index is DescriptorDataCSV.retrieve_by_index:
+            start, stop, step = subscript.indices(len(self))
+            if step == 1:
+                return Wrapper(
+                    self.get_range(start, stop),
+                    self.response_handler if hasattr(
+                        self, "response_handler") else None,
+                    self.strict_response_validation if hasattr(
+                        self, "strict_response_validation") else None,
+                    self.blobs_relative_to_csv if hasattr(
+                        self, "blobs_relative_to_csv") else False)
+        return super().__getitem__(subscript)
+
+    def get_range(self, start: int, stop: int) -> list:
+        """
+        Queries for the rows [start, stop). Descriptors stored at consecutive
+        indices of the same file are read as one block, and each row gets a
+        view of its part of the block.
+        """
+        first = self.df.index.start
+        filenames = [self.cell(first + i, HEADER_PATH)
+                     for i in range(start, stop)]
+        indices = [self.cell(first + i, HEADER_INDEX)
+                   for i in range(start, stop)]
+
+        items = []
+        run_start = 0
+        while run_start < len(filenames):
+            run_end = run_start + 1
+            while run_end < len(filenames) and \
+                    filenames[run_end] == filenames[run_start] and \
+                    indices[run_end] == indices[run_end - 1] + 1:
+                run_end += 1
+            try:
+                filename = os.path.join(self.relative_path_prefix,
+                                        filenames[run_start])
+                descriptors = self.load_descriptors(
+                    filename, int(indices[run_start]), run_end - run_start)
+            except Exception:
+                # Row by row, to report the faulty one as getitem does.
+                descriptors = None
+            for k in range(run_start, run_end):
+                if descriptors is None:
+                    items.append(self.getitem(start + k))
+                else:
+                    items.append(self.descriptor_query(
+                        first + start + k, descriptors[k - run_start]))
+            run_start = run_end
+        return items
+
     def getitem(self, idx):
         idx = self.df.index.start + idx
         filename = os.path.join(self.relative_path_prefix,
-                                self.df.loc[idx, HEADER_PATH])
-        index = self.df.loc[idx, HEADER_INDEX]
-        desc_set = self.df.loc[idx, HEADER_SET]
+                                self.cell(idx, HEADER_PATH))
+        index = self.cell(idx, HEADER_INDEX)
 
         descriptor, desc_ok = self.load_descriptor(filename, index)
 
@@ -101,12 +176,17 @@ class DescriptorDataCSV(CSVParser.CSVParser):
             raise Exception("Error loading descriptor: " +
                             filename + ":" + index)
 
+        return self.descriptor_query(idx, descriptor)
+
+    def descriptor_query(self, idx, descriptor):
+        desc_set = self.cell(idx, HEADER_SET)
+
         q = []
         blobs = []
         # for data in image_data:
         custom_fields = {"set": desc_set}
         if self.has_label:
-            custom_fields["label"] = self.df.loc[idx, HEADER_LABEL]
+            custom_fields["label"] = self.cell(idx, HEADER_LABEL)
 
         ad = self._basic_command(idx, custom_fields)
 
@@ -128,13 +208,70 @@ class DescriptorDataCSV(CSVParser.CSVParser):
 
         return desc
 
-    def load_descriptor(self, filename, index):
+    def descriptor_file(self, filename, pin: bool = False):
+        """
+        The array of a descriptor file, memory mapped for .npy files.
+        A pinned file stays in `npy_arrays` until `unpin_file` is called.
+        """
+        with self.npy_lock:
+            if filename in self.npy_arrays:
+                self.npy_arrays.move_to_end(filename)
+                if pin:
+                    self.npy_pins[filename] = self.npy_pins.get(filename, 0) + 1
+                return self.npy_arrays[filename]
+
+        # mmap_mode is ignored for npz archives.
+        array = np.load(filename, mmap_mode="r")
+
+        with self.npy_lock:
+            # Another thread may have opened it meanwhile.
+            array = self.npy_arrays.setdefault(filename, array)
+            self.npy_arrays.move_to_end(filename)
+            if pin:
+                self.npy_pins[filename] = self.npy_pins.get(filename, 0) + 1
+            self.evict_files()
+        return array
+
+    def unpin_file(self, filename):
+        with self.npy_lock:
+            self.npy_pins[filename] -= 1
+            if self.npy_pins[filename] == 0:
+                del self.npy_pins[filename]
+            self.evict_files()
+
+    def evict_files(self):
+        # Called with npy_lock held. Pinned files may exceed the bound.
+        excess = len(self.npy_arrays) - max(1, self.max_open_files)
+        for filename in list(self.npy_arrays):
+            if excess <= 0:
+                break
+            if filename not in self.npy_pins:
+                del self.npy_arrays[filename]
+                excess -= 1
+
+    def load_descriptors(self, filename, index: int, count: int) -> list:
+        """
+        Descriptors at [index, index + count) of a file, as views of a single float32 buffer.
+        """
+        array = self.descriptor_file(filename)
+        if index < 0 or index + count > len(array):
+            raise IndexError(
+                f"Cannot retrieve descriptors {index}:{index + count} from {filename}")
+        block = np.ascontiguousarray(
+            array[index:index + count], dtype=np.float32).tobytes()
+        size = len(block) // count
+        view = memoryview(block)
+        return [view[i * size:(i + 1) * size] for i in range(count)]
 
-        if filename not in self.npy_arrays:
-            self.npy_arrays[filename] = np.load(filename)
+    def load_descriptor(self, filename, index):
 
-        # Can be defined by the user.
-        descriptor = self.retrieve_by_index(filename, index)
+        # Pinned, so that other threads cannot evict it before it is read.
+        self.descriptor_file(filename, pin=True)
+        try:
+            # Can be defined by the user.
+            descriptor = self.retrieve_by_index(filename, index)
+        finally:
+            self.unpin_file(filename)
 
         if len(descriptor) < 0:
             return [], False
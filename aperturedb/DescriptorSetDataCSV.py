@@ -68,14 +68,14 @@ class DescriptorSetDataCSV(CSVParser.CSVParser):
         #       "IP", or
         #       ["IP" ...]
         idx = self.df.index.start + idx
-        metrics = self.df.loc[idx, HEADER_METRIC]
+        metrics = self.cell(idx, HEADER_METRIC)
         metrics = metrics if "[" not in metrics else ast.literal_eval(metrics)
-        engines = self.df.loc[idx, HEADER_ENGINE]
+        engines = self.cell(idx, HEADER_ENGINE)
         engines = engines if "[" not in engines else ast.literal_eval(engines)
 
         data = {
-            "name":       self.df.loc[idx, HEADER_NAME],
-            "dimensions": self.df.loc[idx, HEADER_DIM],
+            "name":       self.cell(idx, HEADER_NAME),
+            "dimensions": self.cell(idx, HEADER_DIM),
             "engine":     engines,
             "metric":     metrics,
         }
@@ -1,19 +1,358 @@
+import hashlib
+import json
 import logging
+import time
+from collections import OrderedDict
+from threading import Lock
 
 import numpy as np
+import pandas as pd
 
 from aperturedb.Entities import Entities
 from aperturedb.CommonLibrary import execute_query
+from aperturedb.ParallelQuery import ParallelQuery
+from aperturedb.Subscriptable import Subscriptable
 
 logger = logging.getLogger(__name__)
 
 
+def similarity_matrix(metric: str, a, b) -> np.ndarray:
+    """
+    Similarity of every row of `a` to every row of `b`, the larger the more similar.
+
+    Args:
+        metric (str): Metric of the descriptor set, "CS", "L2" or "IP".
+        a (np.ndarray): (M, D) array.
+        b (np.ndarray): (N, D) array.
+
+    Returns:
+        np.ndarray: (M, N) array. L2 distances are negated.
+    """
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if metric == "CS":
+        a_norms = np.linalg.norm(a, axis=1, keepdims=True)
+        b_norms = np.linalg.norm(b, axis=1, keepdims=True)
+        return (a / np.where(a_norms == 0, 1, a_norms)) @ \
+            (b / np.where(b_norms == 0, 1, b_norms)).T
+    elif metric == "L2":
+        squared = np.sum(a * a, axis=1)[:, None] + \
+            np.sum(b * b, axis=1)[None, :] - 2 * (a @ b.T)
+        return -np.sqrt(np.maximum(squared, 0))
+    elif metric == "IP":
+        return a @ b.T
+    else:
+        raise ValueError("Unknown metric: %s" % metric)
+
+
+def mmr(vector, vectors, k: int, lambda_mult: float = 0.5, metric: str = "CS") -> list:
+    """
+    Maximal marginal relevance selection among the neighbors of a vector.
+
+    The first neighbor is always selected. Every next one maximizes
+    `lambda_mult * relevance - (1 - lambda_mult) * redundancy`, where the
+    redundancy is its highest similarity to the neighbors already selected.
+
+    Args:
+        vector (np.ndarray): (D,) query vector.
+        vectors (np.ndarray): (N, D) neighbors, in the order returned by the database.
+        k (int): Number of neighbors to select.
+        lambda_mult (float, optional): 1.0 means no diversity. Defaults to 0.5.
+        metric (str, optional): Metric of the descriptor set. Defaults to "CS".
+
+    Returns:
+        list: Indexes of the selected neighbors, in order of selection.
+    """
+    count = min(k, len(vectors))
+    if count <= 0:
+        return []
+    relevance = similarity_matrix(metric, np.reshape(vector, (1, -1)), vectors)[0]
+    pairwise = similarity_matrix(metric, vectors, vectors)
+
+    selected = [0]
+    redundancy = pairwise[0].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[0] = False
+    while len(selected) < count:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return selected
+
+
+class DescriptorMatrix(Subscriptable):
+    """
+    **Queries adding the rows of a matrix as descriptors of a set**
+
+    Every item is a whole transaction of `batchsize` AddDescriptor commands.
+    The blobs are views of the rows of the matrix, nothing is copied.
+
+    Args:
+        set (str): Descriptor set name.
+        matrix (np.ndarray): (N, D) array of descriptors, converted to float32 if needed.
+        properties (pd.DataFrame, optional): N rows of properties, one column per property.
+        batchsize (int, optional): Number of descriptors per transaction. Defaults to 1000.
+    """
+
+    def __init__(self, set: str, matrix, properties: pd.DataFrame = None, batchsize: int = 1000):
+        super().__init__()
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError(
+                f"Descriptors must be a (N, D) matrix, got shape {matrix.shape}")
+        if properties is not None and len(properties) != len(matrix):
+            raise ValueError(
+                f"{len(properties)} rows of properties for {len(matrix)} descriptors")
+        if batchsize < 1:
+            raise ValueError("batchsize must be positive")
+
+        self.set = set
+        self.matrix = matrix
+        self.properties = properties
+        self.batchsize = batchsize
+        self.row_bytes = matrix.shape[1] * matrix.itemsize
+        self.buffer = memoryview(matrix.reshape(-1)).cast("B")
+
+    def __len__(self):
+        return -(-len(self.matrix) // self.batchsize)
+
+    def property_records(self, start: int, end: int) -> list:
+        """
+        Properties of the rows [start, end), without the missing values.
+        """
+        df = self.properties.iloc[start:end]
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                df = df.assign(**{column: [
+                    {"_date": t.isoformat()} if not pd.isna(t) else None
+                    for t in df[column]]})
+        records = df.to_dict(orient="records")
+        if df.isna().values.any():
+            records = [{k: v for k, v in record.items() if v is not None and v == v}
+                       for record in records]
+        return records
+
+    def getitem(self, idx):
+        start = idx * self.batchsize
+        end = min(start + self.batchsize, len(self.matrix))
+        if self.properties is None:
+            query = [{"AddDescriptor": {"set": self.set}}
+                     for _ in range(start, end)]
+        else:
+            query = [{"AddDescriptor": {"set": self.set, "properties": properties}}
+                     if properties else {"AddDescriptor": {"set": self.set}}
+                     for properties in self.property_records(start, end)]
+        size = self.row_bytes
+        blobs = [self.buffer[i * size:(i + 1) * size]
+                 for i in range(start, end)]
+        return query, blobs
+
+
+class SimilarityQueries(Subscriptable):
+    """
+    **k-NN searches of the rows of a matrix, gathered into dense arrays**
+
+    Every item is a FindDescriptor of one row. The response handler stores
+    the neighbors of the i-th row at `ids[i]`, `distances[i]` and
+    `vectors[i]`. Missing neighbors are left as None and NaN.
+
+    Args:
+        set (str): Descriptor set name.
+        matrix (np.ndarray): (Q, D) array of query vectors.
+        k_neighbors (int): Number of neighbors of each vector.
+        constraints (aperturedb.Constraints.Constraints, optional): Constraints for the search.
+        distances (bool, optional): Fill `distances`. Defaults to True.
+        blobs (bool, optional): Fill `vectors` with the neighbors. Defaults to False.
+        id_property (str, optional): Property identifying the neighbors. Defaults to "_uniqueid".
+    """
+
+    def __init__(self, set: str, matrix, k_neighbors: int, constraints=None,
+                 distances: bool = True, blobs: bool = False, id_property: str = "_uniqueid"):
+        super().__init__()
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError(
+                f"Query vectors must be a (Q, D) matrix, got shape {matrix.shape}")
+
+        self.command = {
+            "set": set,
+            "k_neighbors": k_neighbors,
+            "distances": distances,
+            "blobs": blobs,
+            "results": {"list": [id_property]},
+        }
+        if constraints is not None:
+            self.command["constraints"] = constraints.constraints
+        self.id_property = id_property
+        self.matrix = matrix
+        self.row_bytes = matrix.shape[1] * matrix.itemsize
+        self.buffer = memoryview(matrix.reshape(-1)).cast("B")
+
+        count = len(matrix)
+        self.ids = np.full((count, k_neighbors), None, dtype=object)
+        self.distances = np.full(
+            (count, k_neighbors), np.nan, dtype=np.float32) if distances else None
+        self.vectors = np.full((count, k_neighbors, matrix.shape[1]), np.nan,
+                               dtype=np.float32) if blobs else None
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def getitem(self, idx):
+        size = self.row_bytes
+        return [{"FindDescriptor": dict(self.command)}], \
+            [self.buffer[idx * size:(idx + 1) * size]]
+
+    def response_handler(self, query, query_blobs, response, response_blobs, index):
+        entities = response[0]["FindDescriptor"].get("entities", [])
+        entities = entities[:self.ids.shape[1]]
+        self.ids[index, :len(entities)] = [e.get(self.id_property)
+                                           for e in entities]
+        if self.distances is not None:
+            self.distances[index, :len(entities)] = [e.get("_distance", np.nan)
+                                                     for e in entities]
+        if self.vectors is not None and response_blobs:
+            neighbors = np.frombuffer(
+                b"".join(response_blobs[:len(entities)]), dtype=np.float32)
+            self.vectors[index, :len(entities)] = neighbors.reshape(
+                len(entities), -1)
+
+
+class DescriptorCache:
+    """
+    **Bounded LRU cache of descriptor search results**
+
+    Entries are keyed by the set, a hash of the float32 query vector and the
+    parameters of the search. Once attached to a client, any AddDescriptor,
+    UpdateDescriptor or DeleteDescriptor sent through that client or its clones
+    drops the entries of the affected set, or all entries when the set is not
+    named in the command.
+
+    Args:
+        max_entries (int, optional): Number of searches kept. Defaults to 1024.
+        ttl (float, optional): Seconds an entry stays valid, None for no expiry. Defaults to None.
+    """
+
+    # Commands changing the results of searches, and the parameter naming their set.
+    INVALIDATING_COMMANDS = {
+        "AddDescriptor": "set",
+        "UpdateDescriptor": "set",
+        "DeleteDescriptor": "set",
+        "AddDescriptorSet": "name",
+        "UpdateDescriptorSet": "with_name",
+        "DeleteDescriptorSet": "with_name",
+    }
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(set: str, vector, k_neighbors: int, constraints=None,
+            distances: bool = False, blobs: bool = False, results=None) -> tuple:
+        digest = hashlib.sha1(
+            np.ascontiguousarray(vector, dtype=np.float32).tobytes()).hexdigest()
+        parameters = json.dumps([k_neighbors, constraints, distances, blobs, results],
+                                sort_keys=True, default=str)
+        return (set, digest, parameters)
+
+    def get(self, key: tuple):
+        """
+        The cached value of a key, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and \
+                    time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, value) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, set: str = None) -> None:
+        """
+        Drops the entries of a set, or all of them.
+        """
+        with self.lock:
+            if set is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == set]:
+                    del self.entries[key]
+
+    def observe(self, query, response=None) -> None:
+        """
+        Query observer of a Connector, invalidating after descriptor changes.
+        """
+        if isinstance(query, str):
+            try:
+                query = json.loads(query)
+            except ValueError:
+                return
+        for command in query if isinstance(query, list) else []:
+            if not isinstance(command, dict):
+                continue
+            for name, parameters in command.items():
+                if name in self.INVALIDATING_COMMANDS:
+                    set = parameters.get(self.INVALIDATING_COMMANDS[name]) \
+                        if isinstance(parameters, dict) else None
+                    self.invalidate(set if isinstance(set, str) else None)
+
+    def attach(self, client) -> None:
+        """
+        Invalidate on the descriptor changes sent through a client and its clones.
+        """
+        client.add_query_observer(self.observe)
+
+    def detach(self, client) -> None:
+        client.remove_query_observer(self.observe)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
 class Descriptors(Entities):
     """
     Python wrapper for ApertureDB Descriptors API.
+
+    Args:
+        cache (DescriptorCache, optional): Cache of the results of find_similar.
+            It is attached to the client for invalidation. Defaults to None.
     """
     db_object = "_Descriptor"
 
+    def __init__(self, client=None, response=None, type=None, spec=None,
+                 cache: DescriptorCache = None) -> None:
+        super().__init__(client=client, response=response, type=type, spec=spec)
+        self.cache = cache
+        if cache is not None and client is not None:
+            cache.attach(client)
+
     def find_similar(
         self,
         set: str,
@@ -53,9 +392,21 @@ class Descriptors(Entities):
         if constraints is not None:
             command["FindDescriptor"]["constraints"] = constraints.constraints
 
+        key = None
+        if self.cache is not None:
+            key = DescriptorCache.key(set, vector, k_neighbors,
+                                      command["FindDescriptor"].get(
+                                          "constraints"),
+                                      distances, blobs, results)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.response = [dict(entity) for entity in cached]
+                return
+
         query = [command]
         blobs_in = [np.array(vector, dtype=np.float32).tobytes()]
-        _, response, blobs_out = execute_query(self.client, query, blobs_in)
+        result, response, blobs_out = execute_query(
+            self.client, query, blobs_in)
 
         self.response = response[0]["FindDescriptor"].get("entities", [])
 
@@ -64,6 +415,91 @@ class Descriptors(Entities):
                 entity["vector"] = np.frombuffer(
                     blobs_out[i], dtype=np.float32)
 
+        if key is not None and result == 0:
+            self.cache.put(key, [dict(entity) for entity in self.response])
+
+    def add_bulk(
+        self,
+        set: str,
+        matrix,
+        properties: pd.DataFrame = None,
+        batchsize: int = 1000,
+        numthreads: int = 4,
+        stats: bool = False,
+    ) -> bool:
+        """
+        Adds all the rows of a matrix as descriptors of a set.
+
+        The matrix is sent `batchsize` descriptors per transaction, and the
+        transactions are spread over `numthreads` connections.
+
+        Args:
+            set (str): Descriptor set name.
+            matrix (np.ndarray): (N, D) array of descriptors.
+            properties (pd.DataFrame, optional): N rows of properties of the descriptors. Defaults to None.
+            batchsize (int, optional): Number of descriptors per transaction. Defaults to 1000.
+            numthreads (int, optional): Number of parallel connections. Defaults to 4.
+            stats (bool, optional): Print the ingestion statistics. Defaults to False.
+
+        Returns:
+            bool: True if all the descriptors were added.
+        """
+        generator = DescriptorMatrix(set, matrix, properties, batchsize)
+        querier = ParallelQuery(self.client)
+        querier.query(generator, batchsize=1,
+                      numthreads=numthreads, stats=stats)
+        # Transactions with some failed commands are not errors of ParallelQuery.
+        succeeded = querier.get_succeeded_queries()
+        if querier.error_counter > 0 or succeeded < len(generator):
+            logger.warning(
+                f"{len(generator) - succeeded} of {len(generator)} transactions adding descriptors to {set} failed")
+            return False
+        return True
+
+    def find_similar_batch(
+        self,
+        set: str,
+        matrix,
+        k_neighbors: int,
+        constraints=None,
+        distances: bool = True,
+        blobs: bool = False,
+        id_property: str = "_uniqueid",
+        batchsize: int = 100,
+        numthreads: int = 4,
+    ):
+        """
+        As find_similar, for every row of a matrix of query vectors.
+
+        The searches are sent `batchsize` per transaction, over `numthreads`
+        connections, and the neighbors are returned as dense arrays.
+        Searches with fewer than `k_neighbors` results, or which failed,
+        are padded with None ids and NaN distances and vectors.
+
+        Args:
+            set (str): Descriptor set name.
+            matrix (np.ndarray): (Q, D) array of query vectors.
+            k_neighbors (int): Number of neighbors of each vector.
+            constraints (aperturedb.Constraints.Constraints, optional): Constraints for the search. Defaults to None.
+            distances (bool, optional): Return similarity metric values. Defaults to True.
+            blobs (bool, optional): Return vectors of the neighbors. Defaults to False.
+            id_property (str, optional): Property returned as the id of the neighbors. Defaults to "_uniqueid".
+            batchsize (int, optional): Number of searches per transaction. Defaults to 100.
+            numthreads (int, optional): Number of parallel connections. Defaults to 4.
+
+        Returns:
+            tuple: ids (Q, k) object array, distances (Q, k) float32 array or None,
+                vectors (Q, k, D) float32 array or None.
+        """
+        generator = SimilarityQueries(set, matrix, k_neighbors, constraints,
+                                      distances, blobs, id_property)
+        querier = ParallelQuery(self.client)
+        querier.query(generator, batchsize=batchsize, numthreads=numthreads)
+        if querier.error_counter > 0:
+            logger.warning(
+                f"{querier.error_counter} batches of searches failed")
+        return generator.ids, generator.distances, generator.vectors
+
     def _descriptorset_metric(self, set: str):
         """Find default metric for descriptor set"""
         command = {"FindDescriptorSet": {"with_name": set, "metrics": True}}
@@ -75,15 +511,8 @@ class Descriptors(Entities):
 
     def _vector_similarity(self, v1, v2):
         """Find similarity between two vectors using the metric of the descriptor set."""
-        if self.metric == "CS":
-            return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
-        elif self.metric == "L2":
-            # negate to turn distance into similarity
-            return -np.linalg.norm(v1 - v2)
-        elif self.metric == "IP":
-            return np.dot(v1, v2)
-        else:
-            raise ValueError("Unknown metric: %s" % self.metric)
+        return similarity_matrix(self.metric, np.reshape(v1, (1, -1)),
+                                 np.reshape(v2, (1, -1)))[0, 0]
 
     def find_similar_mmr(
         self,
@@ -112,43 +541,53 @@ class Descriptors(Entities):
         kwargs["blobs"] = True  # force vector return
         self.find_similar(set, vector, fetch_k, **kwargs)
 
-        # MMR algorithm
-        # Calculate similarity between query and all documents
-        query_similarity = [self._vector_similarity(
-            vector, d["vector"]) for d in self]
-        # Calculate similarity between all pairs of documents
-        document_similarity = {}
-        for i, d in enumerate(self):
-            for j, d2 in enumerate(self[i + 1:], i + 1):
-                similarity = self._vector_similarity(d["vector"], d2["vector"])
-                document_similarity[(i, j)] = similarity
-                document_similarity[(j, i)] = similarity
-
-        # We just gather indexes here, not the actual entities
-        selected = []
-        unselected = list(range(len(self)))
-
-        while len(selected) < k_neighbors and unselected:
-            if not selected:
-                selected.append(0)
-                unselected.remove(0)
-            else:
-                selected_unselected_similarity = np.array(
-                    [
-                        [document_similarity[(i, j)] for j in unselected]
-                        for i in selected
-                    ]
-                )
-                worst_similarity = np.max(
-                    selected_unselected_similarity, axis=0)
-                relevance_scores = np.array(
-                    [query_similarity[i] for i in unselected])
-                scores = (
-                    1 - lambda_mult
-                ) * worst_similarity + lambda_mult * relevance_scores
-                max_index = unselected[np.argmax(scores)]
-                selected.append(max_index)
-                unselected.remove(max_index)
-        logger.info("Selected indexes: %s; unselected %s",
-                    selected, unselected)
+        selected = mmr(vector, np.array([d["vector"] for d in self]),
+                       k_neighbors, lambda_mult, self.metric)
+        logger.info("Selected indexes: %s", selected)
         self.response = [self[i] for i in selected]
+
+    def find_similar_mmr_batch(
+        self,
+        set: str,
+        matrix,
+        k_neighbors: int,
+        fetch_k: int,
+        lambda_mult: float = 0.5,
+        **kwargs,
+    ):
+        """
+        As find_similar_mmr, for every row of a matrix of query vectors.
+
+        Args:
+            set (str): Descriptor set name.
+            matrix (np.ndarray): (Q, D) array of query vectors.
+            k_neighbors (int): Number of results of each vector.
+            fetch_k (int): Number of neighbors to fetch from the database for each vector.
+            lambda_mult (float): Lambda multiplier for the MMR algorithm.
+                Defaults to 0.5.  1.0 means no diversity.
+            **kwargs: Passed to find_similar_batch.
+
+        Returns:
+            tuple: ids, distances and vectors, as find_similar_batch, with
+                the k_neighbors selected neighbors of each vector.
+        """
+        metric = self._descriptorset_metric(set)
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        kwargs["blobs"] = True  # force vector return
+        ids, distances, vectors = self.find_similar_batch(
+            set, matrix, fetch_k, **kwargs)
+
+        selected_ids = np.full((len(matrix), k_neighbors), None, dtype=object)
+        selected_distances = None if distances is None else np.full(
+            (len(matrix), k_neighbors), np.nan, dtype=np.float32)
+        selected_vectors = np.full(
+            (len(matrix), k_neighbors, matrix.shape[1]), np.nan, dtype=np.float32)
+        for i in range(len(matrix)):
+            found = sum(id is not None for id in ids[i])
+            selected = mmr(matrix[i], vectors[i, :found],
+                           k_neighbors, lambda_mult, metric)
+            selected_ids[i, :len(selected)] = ids[i, selected]
+            selected_vectors[i, :len(selected)] = vectors[i, selected]
+            if distances is not None:
+                selected_distances[i, :len(selected)] = distances[i, selected]
+        return selected_ids, selected_distances, selected_vectors
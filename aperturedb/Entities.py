@@ -1,16 +1,51 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Union
+import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Union
 from aperturedb.Query import Query, ObjectType
 
 from aperturedb.Subscriptable import Subscriptable
 from aperturedb.Constraints import Constraints
 from aperturedb.Connector import Connector
 from aperturedb.CommonLibrary import execute_query
+from aperturedb.ParallelQuery import ParallelQuery
 from aperturedb.Query import QueryBuilder
+from aperturedb.Operations import Operations
 import pandas as pd
 import logging
 logger = logging.getLogger(__name__)
 
+# Values in the "in" constraint of a single command.
+DEFAULT_IN_CHUNK_SIZE = 1000
+# Bounds of the transactions sent by Entities.bulk_update_properties.
+DEFAULT_UPDATE_BATCHSIZE = 100
+DEFAULT_UPDATE_BATCH_BYTES = 4 * 2**20
+# Blobs returned by a single command of Entities.get_blobs.
+DEFAULT_BLOB_BATCHSIZE = 100
+
+
+class QueryResults(Subscriptable):
+    """
+    Queries run through ParallelQuery, with their responses kept by index.
+    Each item is a whole transaction, none longer than the first one.
+    """
+
+    def __init__(self, queries: List[tuple]):
+        super().__init__()
+        self.queries = queries
+        self.results = [None] * len(queries)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def getitem(self, idx):
+        return self.queries[idx]
+
+    def response_handler(self, query, query_blobs, response, response_blobs, index):
+        self.results[index] = (response, response_blobs)
+
 
 class Entities(Subscriptable):
     """
@@ -181,49 +216,152 @@ class Entities(Subscriptable):
     def sort(self, key) -> Entities:
         return Entities(response = sorted(self.response, key=key), type=self.type)
 
+    def execute_queries(self, queries: List[tuple], numthreads: int = 1) -> List[tuple]:
+        """
+        Runs a list of (commands, blobs) transactions, over `numthreads` connections.
+
+        Returns:
+            List[tuple]: (responses, blobs) of every transaction, None for the failed ones.
+        """
+        if numthreads <= 1 or len(queries) <= 1:
+            results = []
+            for query, blobs in queries:
+                _, r, b = execute_query(self.client, query, blobs)
+                results.append((r, b) if self.client.last_query_ok() else None)
+            return results
+
+        # ParallelQuery splits the responses by the length of the first transaction.
+        order = sorted(range(len(queries)), key=lambda i: -len(queries[i][0]))
+        generator = QueryResults([queries[i] for i in order])
+        querier = ParallelQuery(self.client)
+        querier.progress_bar = False
+        querier.query(generator, batchsize=1, numthreads=numthreads)
+        results = [None] * len(queries)
+        for position, i in enumerate(order):
+            results[i] = generator.results[position]
+        return results
+
     def inspect(self, **kwargs) -> pd.DataFrame:
         return pd.json_normalize([item for item in self])
 
-    def update_properties(self, extra_properties: List[dict]) -> bool:
-        for entity, properties in zip(self, extra_properties):
-            query = [
-                {
+    def update_properties(self, extra_properties: List[dict], numthreads: int = 1) -> bool:
+        """
+        Adds or updates properties of the items of the collection.
+
+        Args:
+            extra_properties (List[dict]): The properties to set on every item, in the order of the items.
+            numthreads (int, optional): Number of parallel connections. Defaults to 1.
+
+        Returns:
+            bool: True if all the items were updated.
+        """
+        return all(self.bulk_update_properties(extra_properties, numthreads=numthreads))
+
+    def bulk_update_properties(self,
+                               extra_properties: List[dict],
+                               batchsize: int = DEFAULT_UPDATE_BATCHSIZE,
+                               max_batch_bytes: int = DEFAULT_UPDATE_BATCH_BYTES,
+                               numthreads: int = 1) -> List[bool]:
+        """
+        Updates the properties of the items of the collection, many per transaction.
+
+        Items with identical properties are updated together, by one command
+        with an "in" constraint on their ids, DEFAULT_IN_CHUNK_SIZE at most.
+        The commands are packed in transactions of at most `batchsize`
+        commands and `max_batch_bytes` of JSON, run over `numthreads` connections.
+
+        Args:
+            extra_properties (List[dict]): The properties to set on every item, in the order of the items.
+            batchsize (int, optional): Commands per transaction. Defaults to 100.
+            max_batch_bytes (int, optional): Size of the JSON of a transaction. Defaults to 4 MiB.
+            numthreads (int, optional): Number of parallel connections. Defaults to 1.
+
+        Returns:
+            List[bool]: Whether every item was updated, in the order of the items.
+        """
+        groups = {}
+        for index, (entity, properties) in enumerate(zip(self.response, extra_properties)):
+            key = json.dumps(properties, sort_keys=True, default=str)
+            groups.setdefault(key, (properties, []))[1].append(index)
+
+        succeeded = [False] * len(self.response)
+        commands = []
+        for properties, indices in groups.values():
+            if not properties:
+                for index in indices:
+                    succeeded[index] = True
+                continue
+            for start in range(0, len(indices), DEFAULT_IN_CHUNK_SIZE):
+                chunk = indices[start:start + DEFAULT_IN_CHUNK_SIZE]
+                command = {
                     self.update_command: {
                         "constraints": {
-                            "_uniqueid": ["==", entity["_uniqueid"]]
+                            "_uniqueid": ["in", [self.response[i]["_uniqueid"] for i in chunk]]
                         },
                         "properties": properties
                     }
                 }
-            ]
-            res, r, b = execute_query(self.client, query, [])
-
-    def get_connected_entities(self,  etype: Union[ObjectType, str], constraints: Constraints = None) -> List[Entities]:
+                size = len(json.dumps(command, default=str))
+                commands.append((command, size, chunk))
+
+        transactions = []
+        for command, size, chunk in commands:
+            if not transactions or len(transactions[-1][0]) >= batchsize or \
+                    transactions[-1][1] + size > max_batch_bytes:
+                transactions.append(([], 0, []))
+            query, total, chunks = transactions[-1]
+            query.append(command)
+            chunks.append(chunk)
+            transactions[-1] = (query, total + size, chunks)
+
+        results = self.execute_queries(
+            [(query, []) for query, _, _ in transactions], numthreads)
+        for (_, _, chunks), result in zip(transactions, results):
+            if result is None:
+                logger.warning(
+                    f"Failed to update {sum(len(c) for c in chunks)} entities")
+                continue
+            r, _ = result
+            for chunk, response in zip(chunks, r):
+                if response[self.update_command].get("status", 0) == 0:
+                    for index in chunk:
+                        succeeded[index] = True
+        return succeeded
+
+    def get_connected_entities(self,  etype: Union[ObjectType, str], constraints: Constraints = None,
+                               numthreads: int = 1) -> List[Entities]:
         """
         Gets all entities adjacent to and clustered around items of the collection
 
+        The items are found with an "in" constraint on their ids,
+        DEFAULT_IN_CHUNK_SIZE per query, and the adjacent entities are
+        grouped by source, then split back per item.
+
         Args:
-            pk (str): _description_
-            type (ObjectType): _description_
-            constraints (Constraints, optional): _description_. Defaults to None.
+            etype (ObjectType): Class of the adjacent entities.
+            constraints (Constraints, optional): Constraints on the adjacent entities. Defaults to None.
+            numthreads (int, optional): Number of parallel connections. Defaults to 1.
 
         Returns:
-            List[Entities]: _description_
+            List[Entities]: The adjacent entities of every item, in the order of the items.
         """
-        result = []
         entity_class = etype.value if isinstance(etype, ObjectType) else etype
-        for entity in self:
+        uniqueids = [entity["_uniqueid"] for entity in self]
+
+        queries = []
+        for start in range(0, len(uniqueids), DEFAULT_IN_CHUNK_SIZE):
             params_src = {
                 "_ref": 1,
                 "unique": False,
                 "constraints": {
-                    "_uniqueid": ["==", entity["_uniqueid"]]
+                    "_uniqueid": ["in", uniqueids[start:start + DEFAULT_IN_CHUNK_SIZE]]
                 }
             }
             params_dst = {
                 "is_connected_to": {
                     "ref": 1
                 },
+                "group_by_source": True,
                 "results": {
                     "all_properties": True
                 }
@@ -236,14 +374,22 @@ class Entities(Subscriptable):
                 QueryBuilder.find_command(
                     oclass=entity_class, params=params_dst)
             ]
-            res, r, b = execute_query(self.client, query, [])
-            cl = Entities
-            if entity_class in self.known_entities:
-                cl = self.known_entities[entity_class]
+            queries.append((query, []))
+
+        grouped = {}
+        for result in self.execute_queries(queries, numthreads):
+            if result is None:
+                raise Exception(
+                    f"Failed to get the connected {entity_class} entities")
+            r, _ = result
+            grouped.update(r[1][list(r[1].keys())[0]].get("entities") or {})
 
-            result.append(cl(
-                client=self.client, response=r[1][list(r[1].keys())[0]]["entities"], type=entity_class))
-        return result
+        cl = Entities
+        if entity_class in self.known_entities:
+            cl = self.known_entities[entity_class]
+
+        return [cl(client=self.client, response=grouped.get(uniqueid, []), type=entity_class)
+                for uniqueid in uniqueids]
 
     def get_object_name(self) -> str:
         as_str = self.db_object if not isinstance(
@@ -254,25 +400,111 @@ class Entities(Subscriptable):
         """
         Helper to get blobs for FindImage, FindVideo and FindBlob commands.
         """
+        return next(self.get_blobs([entity]))
+
+    def blob_query(self, uniqueids: List[str], operations: Union[Operations, list] = None) -> list:
+        """
+        FindImage, FindVideo or FindBlob command returning the blobs of the ids.
+        """
         cmd_params = {
             "constraints": {
-                "_uniqueid": ["==", entity["_uniqueid"]]
+                "_uniqueid": ["in", uniqueids]
             },
             "blobs": True,
-            "uniqueids": True,
             "results": {
-                "count": True
+                "list": ["_uniqueid"]
             }
         }
         # An entities object is created with the response of the query
         # or a spec. Check if the spec is not None, and if it has operations.
-        if self.spec and self.spec.operations:
-            cmd_params["operations"] = self.spec.operations.operations_arr
-        query = [
-            QueryBuilder.find_command(self.db_object, params=cmd_params)
-        ]
-        res, r, b = execute_query(self.client, query, [])
-        return b[0]
+        if operations is None and self.spec and self.spec.operations:
+            operations = self.spec.operations
+        if isinstance(operations, Operations):
+            operations = operations.operations_arr
+        if operations:
+            cmd_params["operations"] = operations
+        return [QueryBuilder.find_command(self.db_object, params=cmd_params)]
+
+    def fetch_blobs(self, client: Connector, uniqueids: List[str],
+                    operations: Union[Operations, list] = None) -> List[Any]:
+        """
+        Gets the blobs of the ids with one command, None for the missing ones.
+        """
+        _, r, b = execute_query(
+            client, self.blob_query(uniqueids, operations), [])
+        if not client.last_query_ok():
+            raise Exception(f"Failed to get the blobs: {r}")
+        cmd, = r[0].keys()
+        blobs = {}
+        for entity in r[0][cmd].get("entities") or []:
+            blobs.setdefault(entity["_uniqueid"], b[entity["_blob_index"]])
+        return [blobs.get(uniqueid) for uniqueid in uniqueids]
+
+    def get_blobs(self,
+                  entities: List[dict] = None,
+                  operations: Union[Operations, list] = None,
+                  batchsize: int = DEFAULT_BLOB_BATCHSIZE,
+                  numthreads: int = 1) -> Iterator[Any]:
+        """
+        Gets the blobs of many entities, `batchsize` per command.
+
+        The chunks are fetched over `numthreads` connections, a few ahead of
+        the consumer, and the blobs are yielded as soon as their chunk arrives.
+        A chunk comes back in one response, so `batchsize` should be lowered
+        for large blobs such as videos.
+
+        Args:
+            entities (List[dict], optional): The entities, with their _uniqueid. Defaults to the items of the collection.
+            operations (Operations, optional): Operations applied to the blobs. Defaults to the operations of the spec.
+            batchsize (int, optional): Blobs per command. Defaults to 100.
+            numthreads (int, optional): Number of parallel connections. Defaults to 1.
+
+        Yields:
+            The blob of every entity, in the order of the entities, None if not found.
+        """
+        if entities is None:
+            entities = self.response
+        uniqueids = [entity["_uniqueid"] for entity in entities]
+        chunks = [uniqueids[start:start + batchsize]
+                  for start in range(0, len(uniqueids), batchsize)]
+
+        if numthreads <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield from self.fetch_blobs(self.client, chunk, operations)
+            return
+
+        state = threading.local()
+        clients = []
+        lock = threading.Lock()
+
+        def fetch(chunk):
+            if not hasattr(state, "client"):
+                # A new connection will be created for each thread
+                state.client = self.client.clone()
+                with lock:
+                    clients.append(state.client)
+            return self.fetch_blobs(state.client, chunk, operations)
+
+        executor = ThreadPoolExecutor(max_workers=numthreads)
+        try:
+            pending = deque()
+            chunks = iter(chunks)
+            # Keep every thread busy, but only a few chunks in memory.
+            for chunk in chunks:
+                pending.append(executor.submit(fetch, chunk))
+                if len(pending) >= 2 * numthreads:
+                    break
+            while pending:
+                blobs = pending.popleft().result()
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending.append(executor.submit(fetch, chunk))
+                yield from blobs
+        finally:
+            # The chunks in flight still use their connection.
+            executor.shutdown(wait=True, cancel_futures=True)
+            for client in clients:
+                client.disconnect()
 
 
 def load_entities_registry(custom_entities: List[str] = None) -> dict:
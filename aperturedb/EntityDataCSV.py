@@ -59,7 +59,7 @@ class EntityDataCSV(CSVParser.CSVParser):
 
     def getitem(self, idx):
         idx = self.df.index.start + idx
-        eclass = self.df.loc[idx, ENTITY_CLASS]
+        eclass = self.cell(idx, ENTITY_CLASS)
         q = []
         ae = self._basic_command(idx,
                                  custom_fields={
@@ -66,7 +66,7 @@ class ImageDataProcessor():
                 logger.error(f"IMAGE ERROR: {filename}")
                 logger.exception(e)
 
-        return self.sources.load_from_file(filename)
+        return self.sources.load_from_file(filename, use_mmap=self.mmap_blobs)
 
     def check_image_buffer(self, img):
 
@@ -206,7 +206,7 @@ class ImageDataCSV(CSVParser.CSVParser, ImageDataProcessor):
         idx = self.df.index.start + idx
 
         image_path = os.path.join(
-            self.relative_path_prefix, self.df.loc[idx, self.source_type])
+            self.relative_path_prefix, self.cell(idx, self.source_type))
         img_ok, img = self.source_loader[self.source_type](image_path)
 
         if not img_ok:
@@ -217,7 +217,7 @@ class ImageDataCSV(CSVParser.CSVParser, ImageDataProcessor):
         blobs = []
         custom_fields = {}
         if self.format_given:
-            custom_fields["format"] = self.df.loc[idx, IMG_FORMAT]
+            custom_fields["format"] = self.cell(idx, IMG_FORMAT)
         ai = self._basic_command(idx, custom_fields)
         # Each getitem query should be properly defined with a ref.
         # A ref shouldb be added to each of the commands from getitem implementation.
@@ -283,7 +283,8 @@ class ImageUpdateDataCSV(SingleEntityUpdateDataCSV, ImageDataProcessor):
         [query_set, empty_blobs] = super().getitem(idx)
 
         image_path = os.path.join(
-            self.relative_path_prefix, self.df.loc[idx, self.source_type])
+            self.relative_path_prefix,
+            self.cell(self.df.index.start + idx, self.source_type))
         img_ok, img = self.source_loader[self.source_type](image_path)
         if not img_ok:
             logger.error("Error loading image: " + image_path)
@@ -333,7 +334,7 @@ class ImageForceNewestDataCSV(BlobNewestDataCSV, ImageDataProcessor):
         relative_path_prefix = os.path.dirname(self.filename) \
             if self.source_type == HEADER_PATH else ""
         image_path = os.path.join(
-            relative_path_prefix, self.df.loc[idx, self.source_type])
+            relative_path_prefix, self.cell(idx, self.source_type))
         img_ok, img = self.source_loader[self.source_type](image_path)
         if not img_ok:
             logger.error("Error loading image: " + image_path)
@@ -389,7 +390,8 @@ class ImageSparseAddDataCSV(SparseAddingDataCSV, ImageDataProcessor):
         [query_set, empty_blobs] = super().getitem(idx)
 
         image_path = os.path.join(
-            self.relative_path_prefix, self.df.loc[idx, self.source_type])
+            self.relative_path_prefix,
+            self.cell(self.df.index.start + idx, self.source_type))
         img_ok, img = self.source_loader[self.source_type](image_path)
 
         if not img_ok:
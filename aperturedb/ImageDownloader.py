@@ -34,10 +34,11 @@ class ImageDownloaderCSV(CSVParser.CSVParser):
 
     def __getitem__(self, idx):
 
-        url = self.df.loc[idx, HEADER_URL]
+        idx = self.df.index.start + idx
+        url = self.cell(idx, HEADER_URL)
 
         if self.has_filename:
-            filename = self.df.loc[idx, HEADER_PATH]
+            filename = self.cell(idx, HEADER_PATH)
         else:
             filename = self.url_to_filename(url)
 
@@ -4,6 +4,7 @@
 
 from __future__ import annotations
 from typing import Any, Dict, Iterable, List, Tuple, Union
+from collections import OrderedDict
 import cv2
 import math
 import numpy as np
@@ -11,7 +12,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from aperturedb import Utils
-from aperturedb.Entities import Entities
+from aperturedb.Entities import Entities, DEFAULT_IN_CHUNK_SIZE
 from aperturedb.Constraints import Constraints
 from aperturedb.CommonLibrary import execute_query
 from aperturedb.Query import QueryBuilder, ObjectType, class_entity
@@ -25,6 +26,57 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+# Bytes of encoded images kept by an Images object.
+DEFAULT_IMAGE_CACHE_BYTES = 512 * 2**20
+
+
+class ImageCache(OrderedDict):
+    """
+    **Encoded images by id, least recently used evicted past a number of bytes**
+
+    Args:
+        max_bytes (int): Bytes of images kept.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_IMAGE_CACHE_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+
+    @staticmethod
+    def size(image) -> int:
+        return len(image) if image is not None else 0
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, image):
+        if key in self:
+            del self[key]
+        super().__setitem__(key, image)
+        self.nbytes += self.size(image)
+        while self.nbytes > self.max_bytes and len(self) > 1:
+            self.popitem(last=False)
+
+    def __delitem__(self, key):
+        self.nbytes -= self.size(super().__getitem__(key))
+        super().__delitem__(key)
+
+    def popitem(self, last: bool = True):
+        key, image = super().popitem(last=last)
+        self.nbytes -= self.size(image)
+        return key, image
+
+    def clear(self):
+        super().clear()
+        self.nbytes = 0
+
+
 def np_arr_img_to_bytes(arr, format: str = 'JPEG') -> bytes:
     """
     **Convert a NumPy array to bytes**
@@ -191,12 +243,14 @@ class Images(Entities):
 
     # DW interface ends
 
-    def __init__(self, client, batch_size=100, response=None, **kwargs):
+    def __init__(self, client, batch_size=100, response=None,
+                 cache_bytes: int = DEFAULT_IMAGE_CACHE_BYTES, **kwargs):
         super().__init__(client, response)
 
         self.client = client
 
-        self.images = {}
+        self.cache_bytes = cache_bytes
+        self.images = ImageCache(cache_bytes)
         self.images_ids = []
         self.image_sizes = []
         self.images_bboxes = {}
@@ -229,6 +283,9 @@ class Images(Entities):
         # This is useful for usage of the class for it's utility methods.
         if "blobs" in kwargs:
             blobs = kwargs["blobs"]
+            # Images given by the caller are all kept.
+            self.images.max_bytes = max(
+                cache_bytes, sum(ImageCache.size(blob) for blob in blobs))
             for i, id in enumerate(self.images_ids):
                 self.images[id] = blobs[i]
 
@@ -241,46 +298,50 @@ class Images(Entities):
     def __retrieve_batch(self, index):
         '''
         **Retrieve the batch that contains the image with the specified index**
-        '''
 
-        # Implement the query to retrieve images
-        # for that batch
+        Returns:
+            dict: The images of the batch by id, also added to the cache.
+        '''
 
-        total_batches = math.ceil(len(self.images_ids) / self.batch_size)
         batch_id = int(math.floor(index / self.batch_size))
 
         start = batch_id * self.batch_size
         end = min(start + self.batch_size, len(self.images_ids))
+        ids = self.images_ids[start:end]
 
-        query = []
-
-        for idx in range(start, end):
-
-            find_params = {
-                "constraints": {
-                    self.img_id_prop: ["==", self.images_ids[idx]]
-                },
-                "blobs": True
+        find_params = {
+            "constraints": {
+                self.img_id_prop: ["in", ids]
+            },
+            "blobs": True,
+            "results": {
+                "list": [self.img_id_prop]
             }
+        }
 
-            if self.operations and len(self.operations.operations_arr) > 0:
-                find_params["operations"] = self.operations.operations_arr
-            query.append(QueryBuilder.find_command(
-                self.db_object, params=find_params))
+        if self.operations and len(self.operations.operations_arr) > 0:
+            find_params["operations"] = self.operations.operations_arr
+        query = [QueryBuilder.find_command(
+            self.db_object, params=find_params)]
 
         _, res, imgs = execute_query(self.client, query, [])
 
         if not self.client.last_query_ok():
             print(self.client.get_last_response_str())
-            return
-
-        for (idx, i) in zip(range(start, end), range(end - start)):
+            return {}
 
-            if idx >= len(self.images_ids):
-                return
+        cmd, = res[0].keys()
+        batch = {}
+        for entity in res[0][cmd].get("entities", []):
+            uniqueid = str(entity[self.img_id_prop])
+            if uniqueid not in batch:
+                batch[uniqueid] = imgs[entity["_blob_index"]]
 
-            uniqueid = self.images_ids[idx]
-            self.images[str(uniqueid)] = imgs[i]
+        retrieved = {}
+        for uniqueid in ids:
+            retrieved[str(uniqueid)] = batch.get(str(uniqueid))
+            self.images[str(uniqueid)] = retrieved[str(uniqueid)]
+        return retrieved
 
     def retrieve_polygons(self, index):
         return self.__retrieve_polygons(index, constraints=None, tag_key="_label", tag_format="{}")
@@ -492,13 +553,15 @@ class Images(Entities):
         uniqueid = self.images_ids[index]
 
         # If image is not retrieved, go and retrieve the batch
-        if not str(uniqueid) in self.images:
-            self.__retrieve_batch(index)
+        if str(uniqueid) in self.images:
+            image = self.images[str(uniqueid)]
+        else:
+            image = self.__retrieve_batch(index).get(str(uniqueid))
 
-        if self.images[str(uniqueid)] == None:
+        if image is None:
             print(f"{self.get_object_name()} was not retrieved")
 
-        return self.images[str(uniqueid)]
+        return image
 
     def get_np_image_by_index(self, index: int):
         """**Retrieves the NumPy representation of image from database**
@@ -557,7 +620,7 @@ class Images(Entities):
         self.format = format
         self.limit = limit
 
-        self.images = {}
+        self.images = ImageCache(self.cache_bytes)
         self.images_ids = []
         self.images_sizes = []
         self.images_bboxes = {}
@@ -650,80 +713,128 @@ class Images(Entities):
     def clear_overlays(self):
         self.overlays = []
 
-    def get_similar_images(self, set_name, n_neighbors):
+    def get_similar_images(self, set_name, n_neighbors, numthreads: int = 1):
+        """
+        **Images with the descriptors most similar to the ones of these images**
 
-        imgs_return = Images(self.client)
+        The images are processed `batch_size` per transaction: one to get their
+        descriptors, one for the k-NN searches and the images of the neighbors.
 
-        for uniqueid in self.images_ids:
+        Args:
+            set_name (str): Descriptor set of the descriptors of the images.
+            n_neighbors (int): Number of similar images per image.
+            numthreads (int, optional): Number of parallel connections. Defaults to 1.
 
-            find_image_params = {
-                "_ref": 1,
-                "constraints": {
-                    self.img_id_prop:  ["==", uniqueid]
-                },
-                "blobs": False,
-            }
-            find_descriptor_params = {
-                "set": set_name,
-                "is_connected_to": {
-                    "ref": 1,
-                },
-                "blobs": True
-            }
+        Returns:
+            Images: The similar images of every image, the image itself included.
+        """
 
-            _, response, blobs = execute_query(self.client,
-                                               [
-                                                   QueryBuilder.find_command(
-                                                       self.db_object, params=find_image_params),
-                                                   QueryBuilder.find_command(
-                                                       ObjectType.DESCRIPTOR, params=find_descriptor_params)
-                                               ], [])
-
-            find_descriptor_params = {
-                "_ref": 1,
-                "set": set_name,
-                "k_neighbors": n_neighbors + 1,
-                "blobs":     False,
-                "distances": True,
-                "uniqueids": True,
-            }
-            find_image_params = {
-                "is_connected_to": {
-                    "ref": 1,
-                },
-                "group_by_source": True,
-                "results": {
-                    "list": [self.img_id_prop]
-                }
-            }
+        imgs_return = Images(self.client)
 
-            _, response, blobs = execute_query(self.client,
-                                               [
-                                                   QueryBuilder.find_command(
-                                                       ObjectType.DESCRIPTOR, params=find_descriptor_params),
-                                                   QueryBuilder.find_command(
-                                                       self.db_object, params=find_image_params)
-                                               ], blobs)
-
-            try:
-                descriptors = response[0]["FindDescriptor"]["entities"]
-                ordered_descs_ids = [x["_uniqueid"] for x in descriptors]
-
-                # Images are not sorted by distance, so we need to sort them
-                # That's why we use "group_by_source":
-                # To have a mapping between descriptors and associated images.
-                cmd, = response[1].keys()
-                imgs_map = response[1][cmd]["entities"]
-
-                for desc_id in ordered_descs_ids:
-                    img_info = imgs_map[desc_id][0]
-                    # We could assert here that there is only one image per descriptor.
-                    imgs_return.images_ids.append(img_info[self.img_id_prop])
-
-            except Exception as e:
-                print("Error with search: {}".format(response))
-                print(e)
+        chunks = [self.images_ids[start:start + self.batch_size]
+                  for start in range(0, len(self.images_ids), self.batch_size)]
+
+        # The descriptor of every image
+        queries = []
+        for chunk in chunks:
+            query = []
+            for i, uniqueid in enumerate(chunk):
+                find_image_params = {
+                    "_ref": i + 1,
+                    "constraints": {
+                        self.img_id_prop:  ["==", uniqueid]
+                    },
+                    "blobs": False,
+                }
+                find_descriptor_params = {
+                    "set": set_name,
+                    "is_connected_to": {
+                        "ref": i + 1,
+                    },
+                    "blobs": True
+                }
+                query.append(QueryBuilder.find_command(
+                    self.db_object, params=find_image_params))
+                query.append(QueryBuilder.find_command(
+                    ObjectType.DESCRIPTOR, params=find_descriptor_params))
+            queries.append((query, []))
+
+        vectors = []
+        for chunk, result in zip(chunks, self.execute_queries(queries, numthreads)):
+            chunk_vectors = [None] * len(chunk)
+            if result is None:
+                print("Error with similarity search")
+            else:
+                response, blobs = result
+                offset = 0
+                for i in range(len(chunk)):
+                    returned = response[2 * i + 1]["FindDescriptor"].get(
+                        "returned", 0)
+                    if returned > 0:
+                        chunk_vectors[i] = blobs[offset]
+                    offset += returned
+            vectors.append(chunk_vectors)
+
+        # The neighbors of every descriptor, and their images
+        queries = []
+        for chunk_vectors in vectors:
+            query = []
+            blobs = []
+            for vector in chunk_vectors:
+                if vector is None:
+                    continue
+                ref = len(blobs) + 1
+                find_descriptor_params = {
+                    "_ref": ref,
+                    "set": set_name,
+                    "k_neighbors": n_neighbors + 1,
+                    "blobs":     False,
+                    "distances": True,
+                    "uniqueids": True,
+                }
+                find_image_params = {
+                    "is_connected_to": {
+                        "ref": ref,
+                    },
+                    "group_by_source": True,
+                    "results": {
+                        "list": [self.img_id_prop]
+                    }
+                }
+                query.append(QueryBuilder.find_command(
+                    ObjectType.DESCRIPTOR, params=find_descriptor_params))
+                query.append(QueryBuilder.find_command(
+                    self.db_object, params=find_image_params))
+                blobs.append(vector)
+            if query:
+                queries.append((query, blobs))
+
+        for result in self.execute_queries(queries, numthreads):
+            if result is None:
                 print("Error with similarity search")
+                continue
+            response, _ = result
+            for i in range(0, len(response), 2):
+                try:
+                    descriptors = response[i]["FindDescriptor"]["entities"]
+                    ordered_descs_ids = [x["_uniqueid"] for x in descriptors]
+
+                    # Images are not sorted by distance, so we need to sort them
+                    # That's why we use "group_by_source":
+                    # To have a mapping between descriptors and associated images.
+                    cmd, = response[i + 1].keys()
+                    imgs_map = response[i + 1][cmd]["entities"]
+
+                    for desc_id in ordered_descs_ids:
+                        img_info = imgs_map[desc_id][0]
+                        # We could assert here that there is only one image per descriptor.
+                        imgs_return.images_ids.append(
+                            img_info[self.img_id_prop])
+
+                except Exception as e:
+                    print("Error with search: {}".format(response[i:i + 2]))
+                    print(e)
+                    print("Error with similarity search")
 
         return imgs_return
 
@@ -954,12 +1065,16 @@ class Images(Entities):
 
         return props_array
 
-    def get_properties(self, prop_list: Iterable[str] = []) -> Dict[str, Any]:
+    def get_properties(self, prop_list: Iterable[str] = [], numthreads: int = 1) -> Dict[str, Any]:
         """
         **Get the properties of the images**
 
+        The images are found with an "in" constraint on their ids,
+        DEFAULT_IN_CHUNK_SIZE per command.
+
         Args:
             prop_list (List[str], optional): The list of properties to retrieve. Defaults to [].
+            numthreads (int, optional): Number of parallel connections. Defaults to 1.
 
             Returns:
                 property_values Dict[str, Any]: The properties of the images
@@ -967,32 +1082,42 @@ class Images(Entities):
         if len(prop_list) == 0:
             return {}
 
-        return_dictionary = {}
+        prop_list = list(prop_list)
+        results_list = prop_list if self.img_id_prop in prop_list \
+            else prop_list + [self.img_id_prop]
 
-        try:
-            for uniqueid in self.images_ids:
-
-                find_image_params = {
-                    "_ref": 1,
-                    "constraints": {
-                        self.img_id_prop: ["==", uniqueid]
-                    },
-                    "blobs": False,
-                    "results": {
-                        "list": prop_list
-                    }
+        queries = []
+        for start in range(0, len(self.images_ids), DEFAULT_IN_CHUNK_SIZE):
+            find_image_params = {
+                "constraints": {
+                    self.img_id_prop: ["in", self.images_ids[start:start + DEFAULT_IN_CHUNK_SIZE]]
+                },
+                "blobs": False,
+                "results": {
+                    "list": results_list
                 }
+            }
+            queries.append(([QueryBuilder.find_command(
+                self.db_object, params=find_image_params)], []))
 
-                _, res, images = execute_query(self.client, [
-                    QueryBuilder.find_command(self.db_object, params=find_image_params)], [])
-
+        found = {}
+        try:
+            for result in self.execute_queries(queries, numthreads):
+                res, _ = result
                 cmd, = res[0].keys()
-                return_dictionary[str(
-                    uniqueid)] = res[0][cmd]["entities"][0]
+                for entity in res[0][cmd]["entities"]:
+                    uniqueid = str(entity[self.img_id_prop])
+                    if uniqueid in found:
+                        continue
+                    if self.img_id_prop not in prop_list:
+                        entity = {k: v for k, v in entity.items()
+                                  if k != self.img_id_prop}
+                    found[uniqueid] = entity
         except:
             print("Cannot retrieved properties")
 
-        return return_dictionary
+        return {str(uniqueid): found[str(uniqueid)]
+                for uniqueid in self.images_ids if str(uniqueid) in found}
 
 
 class Frames(Images):
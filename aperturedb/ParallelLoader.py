@@ -1,4 +1,5 @@
 from aperturedb import ParallelQuery
+from aperturedb.ParallelQuery import DEFAULT_TARGET_LATENCY, DEFAULT_MAX_BATCH_BYTES
 from aperturedb.Connector import Connector
 from aperturedb.Utils import Utils
 from aperturedb.Subscriptable import Subscriptable
@@ -180,7 +181,11 @@ class ParallelLoader(ParallelQuery.ParallelQuery):
                         logger.warning(
                             f"Failed to create index for {connection_class}.{property_name}")
 
-    def ingest(self, generator: Subscriptable, batchsize: int = 1, numthreads: int = 4, stats: bool = False) -> None:
+    def ingest(self, generator: Subscriptable, batchsize: int = 1, numthreads: int = 4, stats: bool = False,
+               adaptive: bool = False, target_latency: float = DEFAULT_TARGET_LATENCY,
+               max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES, scheduler: str = "static",
+               prefetch: int = 0, loader_threads: int = 0, loader_processes: int = 0,
+               use_dask: bool = False) -> None:
         """
         **Method to ingest data into the database**
 
@@ -189,10 +194,27 @@ class ParallelLoader(ParallelQuery.ParallelQuery):
             batchsize (int, optional): The size of batch to be used. Defaults to 1.
             numthreads (int, optional): Number of workers to create. Defaults to 4.
             stats (bool, optional): If stats need to be presented, realtime. Defaults to False.
+            adaptive (bool, optional): Adapt the batch size to the observed latency and blob sizes,
+                see [ParallelQuery.query](/python_sdk/parallel_exec/ParallelQuery). Defaults to False.
+            target_latency (float, optional): Desired duration of a batch in adaptive mode, in seconds. Defaults to 1.0.
+            max_batch_bytes (int, optional): Blob bytes allowed per batch in adaptive mode. Defaults to 64 MiB.
+            scheduler (str, optional): "static" or "dynamic" distribution of the batches
+                among the workers, see [ParallelQuery.query](/python_sdk/parallel_exec/ParallelQuery). Defaults to "static".
+            prefetch (int, optional): Number of batches loaded ahead of the workers
+                by a separate pool of loader threads. Defaults to 0 (no prefetch).
+            loader_threads (int, optional): Size of the loader pool with prefetch. Defaults to numthreads.
+            loader_processes (int, optional): Build the batches in this many worker processes,
+                for CPU bound generators and transformers. The generator must be picklable. Defaults to 0.
+            use_dask (bool, optional): Distribute the ingestion over a dask cluster, by ranges of
+                indices for generators which are not dask backed CSVs. Defaults to False.
         """
         logger.info(
-            f"Starting ingestion with batchsize={batchsize}, numthreads={numthreads}")
-        self.query(generator, batchsize, numthreads, stats)
+            f"Starting ingestion with batchsize={batchsize}, numthreads={numthreads}, {adaptive=}, {scheduler=}, {prefetch=}")
+        self.query(generator, batchsize, numthreads, stats,
+                   adaptive=adaptive, target_latency=target_latency,
+                   max_batch_bytes=max_batch_bytes, scheduler=scheduler,
+                   prefetch=prefetch, loader_threads=loader_threads,
+                   loader_processes=loader_processes, use_dask=use_dask)
 
     def print_stats(self) -> None:
 
@@ -4,16 +4,146 @@ from aperturedb import Parallelizer
 import numpy as np
 import logging
 import inspect
+import queue
+import threading
+import time
+from threading import Thread
+from tqdm import tqdm
 
 
 from aperturedb.DaskManager import DaskManager
-from aperturedb.Connector import Connector
+from aperturedb.Connector import Connector, DEFAULT_MAX_MESSAGE_SIZE_MB
+from aperturedb.ProcessLoader import ProcessLoader
 from aperturedb.types import Commands, Blobs, CommandResponses
 from aperturedb.CommonLibrary import execute_query
 
 logger = logging.getLogger(__name__)
 
 
+def streaming_source(generator):
+    """
+    The streamed CSVParser feeding `generator`, looking through transformers, or None.
+    """
+    source = generator
+    while not hasattr(source, "next_chunk") and hasattr(source, "data"):
+        source = source.data
+    if hasattr(source, "next_chunk") and source.streaming():
+        return source
+    return None
+
+
+# Defaults for the adaptive batch size mode of ParallelQuery.query
+DEFAULT_TARGET_LATENCY = 1.0
+DEFAULT_MAX_BATCH_BYTES = 64 * 2**20
+DEFAULT_MAX_BATCHSIZE = 10000
+
+# How often blocked loaders and workers check whether the run was interrupted.
+PREFETCH_POLL_INTERVAL = 0.1
+
+
+def batch_payload_size(data: List[Tuple[Commands, Blobs]]) -> int:
+    """
+    Number of blob bytes carried by a batch of queries.
+    """
+    total = 0
+    for query in data:
+        if not isinstance(query, tuple) or len(query) < 2 or not isinstance(query[1], list):
+            continue
+        for blob in query[1]:
+            if isinstance(blob, memoryview):
+                total += blob.nbytes
+            elif isinstance(blob, (bytes, bytearray)):
+                total += len(blob)
+            elif hasattr(blob, "nbytes"):
+                total += blob.nbytes
+    return total
+
+
+class AdaptiveBatchSize:
+    """
+    **Per worker batch size controller**
+
+    Picks the size of the next batch from the time and blob bytes observed
+    on the previous ones, so that a transaction takes about `target_latency`
+    seconds and carries at most `max_batch_bytes` of blobs.
+    Entity only queries grow towards `max_batchsize`, while queries with
+    large blobs shrink to a handful per transaction.
+
+    Args:
+        batchsize (int): The batch size to start with.
+        target_latency (float, optional): Desired duration of a batch, in seconds. Defaults to 1.0.
+        max_batch_bytes (int, optional): Blob bytes allowed in a batch. Defaults to 64 MiB.
+            It is always kept below the maximum message size accepted by the connector.
+        max_batchsize (int, optional): Upper bound on queries per batch. Defaults to 10000.
+        smoothing (float, optional): Weight of the last batch in the running
+            per query estimates. Defaults to 0.5.
+    """
+
+    def __init__(self,
+                 batchsize: int,
+                 target_latency: float = DEFAULT_TARGET_LATENCY,
+                 max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+                 max_batchsize: int = DEFAULT_MAX_BATCHSIZE,
+                 smoothing: float = 0.5):
+        # Leave half of the message for the JSON part and the framing.
+        message_limit = DEFAULT_MAX_MESSAGE_SIZE_MB * 2**20 // 2
+        self.target_latency = target_latency
+        self.max_batch_bytes = min(max_batch_bytes, message_limit)
+        self.max_batchsize = max(1, max_batchsize)
+        self.smoothing = smoothing
+        self.batchsize = min(max(1, batchsize), self.max_batchsize)
+        self.time_per_query = None
+        self.bytes_per_query = None
+
+    def _smooth(self, previous, value):
+        if previous is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * previous
+
+    def update(self, queries: int, elapsed: float, payload: int, failed: bool = False) -> int:
+        """
+        Record the outcome of a batch and compute the next batch size.
+
+        Args:
+            queries (int): Number of queries in the batch.
+            elapsed (float): Time taken by the batch, in seconds.
+            payload (int): Blob bytes sent with the batch.
+            failed (bool, optional): Whether the batch failed. Defaults to False.
+
+        Returns:
+            batchsize (int): The size to use for the next batch.
+        """
+        if failed:
+            # Back off quickly, the batch may have been too large to go through.
+            self.batchsize = max(1, self.batchsize // 2)
+            return self.batchsize
+        if queries <= 0:
+            return self.batchsize
+
+        self.time_per_query = self._smooth(
+            self.time_per_query, elapsed / queries)
+        self.bytes_per_query = self._smooth(
+            self.bytes_per_query, payload / queries)
+
+        candidate = self.max_batchsize
+        if self.time_per_query > 0:
+            candidate = min(candidate, int(
+                self.target_latency / self.time_per_query))
+        if self.bytes_per_query > 0:
+            candidate = min(candidate, int(
+                self.max_batch_bytes / self.bytes_per_query))
+
+        # Move gradually, at most doubling or halving per batch, except when
+        # the byte budget demands a smaller batch right away.
+        lower = max(1, self.batchsize // 2)
+        if self.bytes_per_query > 0:
+            lower = min(lower, max(1, int(
+                self.max_batch_bytes / self.bytes_per_query)))
+        self.batchsize = max(1, min(max(candidate, lower),
+                                    2 * self.batchsize, self.max_batchsize))
+        return self.batchsize
+
+
 class ParallelQuery(Parallelizer.Parallelizer):
     """
     **Parallel and Batch Querier for ApertureDB**
@@ -65,6 +195,14 @@ class ParallelQuery(Parallelizer.Parallelizer):
         self.blobs_per_query = 0
         self.daskManager = None
         self.batch_command = execute_query
+        self.adaptive = False
+        self.target_latency = DEFAULT_TARGET_LATENCY
+        self.max_batch_bytes = DEFAULT_MAX_BATCH_BYTES
+        self.prefetch = 0
+        self.loader_threads = 0
+        self.process_loader = None
+        self.shared_sizer = None
+        self.sizer_lock = threading.Lock()
 
     def generate_batch(self, data: List[Tuple[Commands, Blobs]]) -> Tuple[Commands, Blobs]:
         """
@@ -223,9 +361,47 @@ class ParallelQuery(Parallelizer.Parallelizer):
         self.times_arr.append(query_time)
         self.actual_stats.append(worker_stats)
 
+    def worker_client(self) -> Connector:
+        """
+        Connection of the calling worker thread, created on first use.
+        """
+        if not hasattr(self.worker_state, "client"):
+            # A new connection will be created for each thread
+            self.worker_state.client = self.client.clone()
+        return self.worker_state.client
+
+    def worker_batch_size(self) -> AdaptiveBatchSize:
+        """
+        Batch size controller of the calling worker thread, for the adaptive mode.
+        With prefetch, the loaders pick the batch sizes, so all the threads
+        share a single controller.
+        """
+        if self.prefetch > 0:
+            with self.sizer_lock:
+                if self.shared_sizer is None:
+                    self.shared_sizer = AdaptiveBatchSize(
+                        self.batchsize,
+                        target_latency=self.target_latency,
+                        max_batch_bytes=self.max_batch_bytes)
+            return self.shared_sizer
+        if not hasattr(self.worker_state, "sizer"):
+            self.worker_state.sizer = AdaptiveBatchSize(
+                self.batchsize,
+                target_latency=self.target_latency,
+                max_batch_bytes=self.max_batch_bytes)
+        return self.worker_state.sizer
+
+    def claim_size(self, thid: int) -> int:
+        if self.adaptive:
+            return self.worker_batch_size().batchsize
+        return self.batchsize
+
     def worker(self, thid: int, generator, start: int, end: int, run_event) -> None:
-        # A new connection will be created for each thread
-        client = self.client.clone()
+        if self.adaptive:
+            self.adaptive_worker(thid, generator, start, end, run_event)
+            return
+
+        client = self.worker_client()
 
         total_batches = (end - start) // self.batchsize
 
@@ -253,6 +429,147 @@ class ParallelQuery(Parallelizer.Parallelizer):
                 self.pb.update(batch_end - batch_start)
         logger.info(f"Worker {thid} executed {total_batches} batches")
 
+    def run_batch(self, thid: int, i: int, client: Connector, batch_start: int, batch_end: int, load) -> Tuple[float, int, bool]:
+        """
+        Executes one batch, counting failures and updating the progress.
+
+        Args:
+            load (callable): Returns the data of the batch.
+
+        Returns:
+            (elapsed, payload, failed): Time taken, blob bytes sent and whether the batch failed.
+        """
+        failed = False
+        payload = 0
+        batch_time = time.time()
+        try:
+            data = load()
+            payload = batch_payload_size(data)
+            self.do_batch(client, batch_start, data)
+        except Exception as e:
+            logger.exception(e)
+            logger.warning(
+                f"Worker {thid} failed to execute batch {i}: [{batch_start},{batch_end}]")
+            self.error_counter += 1
+            failed = True
+        batch_time = time.time() - batch_time
+
+        if self.stats:
+            self.pb.update(batch_end - batch_start)
+        return batch_time, payload, failed
+
+    def update_batch_size(self, thid: int, i: int, sizer: AdaptiveBatchSize, queries: int,
+                          batch_time: float, payload: int, failed: bool) -> None:
+        with self.sizer_lock:
+            size = sizer.update(queries, batch_time, payload, failed)
+        logger.debug(
+            f"Worker {thid} batch {i}: {queries} queries, "
+            f"{payload} bytes in {batch_time:.3f}s, next batch size {size}")
+
+    def adaptive_worker(self, thid: int, generator, start: int, end: int, run_event) -> None:
+        """
+        Worker for the adaptive mode, the size of every batch is chosen
+        by an AdaptiveBatchSize from the previous ones.
+        """
+        client = self.worker_client()
+        sizer = self.worker_batch_size()
+
+        logger.info(
+            f"Worker {thid} executing [{start},{end}) with adaptive batches, {self.stats=}")
+        batch_start = start
+        i = 0
+        while batch_start < end:
+            if not run_event.is_set():
+                break
+            batch_end = min(batch_start + sizer.batchsize, end)
+
+            batch_time, payload, failed = self.run_batch(
+                thid, i, client, batch_start, batch_end,
+                lambda: generator[batch_start:batch_end])
+            self.update_batch_size(thid, i, sizer, batch_end - batch_start,
+                                   batch_time, payload, failed)
+            batch_start = batch_end
+            i += 1
+        logger.info(f"Worker {thid} executed {i} batches")
+
+    def producer_threads(self, generator, run_event) -> List[Thread]:
+        if self.prefetch <= 0:
+            return []
+        self.prefetched = queue.Queue(maxsize=self.prefetch)
+        self.active_loaders = self.loader_threads or self.numthreads
+        return [Thread(target=self.loader_worker, args=(i, generator, run_event))
+                for i in range(self.active_loaders)]
+
+    def put_prefetched(self, item, run_event) -> bool:
+        while run_event.is_set():
+            try:
+                self.prefetched.put(item, timeout=PREFETCH_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def load_batch(self, generator, batch_start: int, batch_end: int):
+        if self.process_loader is not None:
+            return self.process_loader.load(batch_start, batch_end)
+        return generator[batch_start:batch_end]
+
+    def loader_worker(self, thid: int, generator, run_event) -> None:
+        """
+        Loads the batches claimed from the shared cursor and queues them
+        for the query workers, in prefetch mode.
+        """
+        try:
+            while run_event.is_set():
+                batch_start, batch_end = self.claim(self.claim_size(thid))
+                if batch_start >= batch_end:
+                    break
+                try:
+                    data = self.load_batch(generator, batch_start, batch_end)
+                except Exception as e:
+                    logger.exception(e)
+                    logger.warning(
+                        f"Loader {thid} failed to load batch: [{batch_start},{batch_end}]")
+                    self.error_counter += 1
+                    if self.stats:
+                        self.pb.update(batch_end - batch_start)
+                    continue
+                if not self.put_prefetched((batch_start, batch_end, data), run_event):
+                    break
+        finally:
+            with self.claim_lock:
+                self.active_loaders -= 1
+                last = self.active_loaders == 0
+            if last:
+                # Tell every query worker that no more batches are coming.
+                for _ in range(self.numthreads):
+                    if not self.put_prefetched(None, run_event):
+                        break
+
+    def dynamic_worker(self, thid: int, generator, run_event) -> None:
+        if self.prefetch <= 0:
+            super().dynamic_worker(thid, generator, run_event)
+            return
+
+        client = self.worker_client()
+        sizer = self.worker_batch_size() if self.adaptive else None
+        i = 0
+        while run_event.is_set():
+            try:
+                item = self.prefetched.get(timeout=PREFETCH_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            batch_start, batch_end, data = item
+            batch_time, payload, failed = self.run_batch(
+                thid, i, client, batch_start, batch_end, lambda: data)
+            if sizer is not None:
+                self.update_batch_size(thid, i, sizer, batch_end - batch_start,
+                                       batch_time, payload, failed)
+            i += 1
+        logger.info(f"Worker {thid} executed {i} prefetched batches")
+
     def get_objects_existed(self) -> int:
         return sum([stat["objects_existed"]
                     for stat in self.actual_stats])
@@ -265,18 +582,54 @@ class ParallelQuery(Parallelizer.Parallelizer):
         return sum([stat["succeeded_commands"]
                     for stat in self.actual_stats])
 
-    def query(self, generator, batchsize: int = 1, numthreads: int = 4, stats: bool = False) -> None:
+    def query(self, generator, batchsize: int = 1, numthreads: int = 4, stats: bool = False,
+              adaptive: bool = False, target_latency: float = DEFAULT_TARGET_LATENCY,
+              max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES, scheduler: str = "static",
+              prefetch: int = 0, loader_threads: int = 0, loader_processes: int = 0,
+              use_dask: bool = False) -> None:
         """
         This function takes as input the data to be executed in specified number of threads.
         The generator yields a tuple : (array of commands, array of blobs)
         Args:
             generator (_type_): The class that generates the queries to be executed.
             batchsize (int, optional): Number of queries per transaction. Defaults to 1.
+                In adaptive mode, this is the size of the first batch of each worker.
             numthreads (int, optional): Number of parallel workers. Defaults to 4.
             stats (bool, optional): Show statistics at end of ingestion. Defaults to False.
+            adaptive (bool, optional): Let each worker grow or shrink its batch size
+                from the observed latency and blob bytes. Not used with dask. Defaults to False.
+            target_latency (float, optional): Desired duration of a batch in adaptive mode, in seconds. Defaults to 1.0.
+            max_batch_bytes (int, optional): Blob bytes allowed per batch in adaptive mode. Defaults to 64 MiB.
+            scheduler (str, optional): "static" splits the data into one contiguous range per worker,
+                "dynamic" has the workers pull batches from a shared cursor, which avoids stragglers
+                when rows are unevenly heavy. Not used with dask. Defaults to "static".
+            prefetch (int, optional): Number of batches loaded ahead by a separate pool of
+                loader threads, while the workers send the previous ones to the database.
+                0 loads each batch in the worker that sends it. Prefetch implies the
+                "dynamic" scheduler. Not used with dask. Defaults to 0.
+            loader_threads (int, optional): Size of the loader pool with prefetch. Defaults to numthreads.
+            loader_processes (int, optional): Build the batches in this many worker processes
+                instead of threads, for generators doing CPU bound work in `getitem`.
+                The generator must be picklable. Implies prefetch, with one loader thread
+                per process unless set otherwise. Not used with dask. Defaults to 0.
+            use_dask (bool, optional): Distribute the work over a dask cluster. This is implied
+                by CSV generators created with `use_dask=True`, while other generators are
+                split into ranges of indices and must be picklable. Defaults to False.
         """
-
-        use_dask = hasattr(generator, "use_dask") and generator.use_dask
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.max_batch_bytes = max_batch_bytes
+        self.prefetch = prefetch
+        self.loader_threads = loader_threads
+        self.shared_sizer = None
+        if loader_processes > 0:
+            self.prefetch = max(prefetch, loader_processes)
+            self.loader_threads = loader_threads or loader_processes
+        if self.prefetch > 0:
+            scheduler = "dynamic"
+
+        use_dask = use_dask or (
+            hasattr(generator, "use_dask") and generator.use_dask)
         if use_dask:
             self._reset(batchsize=batchsize, numthreads=numthreads)
             self.daskmanager = DaskManager(num_workers=numthreads)
@@ -285,8 +638,11 @@ class ParallelQuery(Parallelizer.Parallelizer):
             self.query_setup(generator)
 
         if use_dask:
-            results, self.total_actions_time = self.daskmanager.run(
-                self.__class__, self.client, generator, batchsize, stats=stats)
+            try:
+                results, self.total_actions_time = self.daskmanager.run(
+                    self.__class__, self.client, generator, batchsize, stats=stats)
+            finally:
+                self.daskmanager.close()
             self.actual_stats = []
             for result in results:
                 if result is not None:
@@ -296,7 +652,12 @@ class ParallelQuery(Parallelizer.Parallelizer):
                         {"succeeded_queries": result.succeeded_queries,
                          "succeeded_commands": result.succeeded_commands,
                          "objects_existed": result.objects_existed})
-            self.total_actions = len(generator.df)
+            if hasattr(generator, "df"):
+                self.total_actions = len(generator.df)
+            elif getattr(generator, "sample_count", None) is not None:
+                self.total_actions = generator.sample_count
+            else:
+                self.total_actions = len(generator)
 
             if stats:
                 self.print_stats()
@@ -320,7 +681,65 @@ class ParallelQuery(Parallelizer.Parallelizer):
                 f"Commands per query = {self.commands_per_query}, "
                 f"Blobs per query = {self.blobs_per_query}"
             )
-            self.batched_run(generator, batchsize, numthreads, stats)
+            source = streaming_source(generator)
+            if source is not None and loader_processes > 0:
+                raise ValueError(
+                    "loader_processes cannot be used with a streamed CSV file.")
+            if loader_processes > 0:
+                self.process_loader = ProcessLoader(
+                    generator, loader_processes)
+            try:
+                if source is not None:
+                    self.stream_run(generator, source, batchsize, numthreads, stats,
+                                    scheduler=scheduler)
+                else:
+                    self.batched_run(generator, batchsize, numthreads, stats,
+                                     scheduler=scheduler)
+            finally:
+                if self.process_loader is not None:
+                    self.process_loader.close()
+                    self.process_loader = None
+
+    def stream_run(self, generator, source, batchsize: int, numthreads: int, stats: bool,
+                   scheduler: str = "static") -> None:
+        """
+        Runs the queries of a streamed CSV file one chunk at a time,
+        with the progress reported in bytes of the file.
+        """
+        times_arr = []
+        actual_stats = []
+        error_counter = 0
+        total_actions = 0
+        start_time = time.time()
+        pb = tqdm(total=source.file_size(), desc="Progress",
+                  unit="B", unit_scale=True, dynamic_ncols=True)
+        self.progress_bar = False
+        try:
+            while True:
+                self.batched_run(generator, batchsize, numthreads, False,
+                                 scheduler=scheduler)
+                times_arr.extend(self.times_arr)
+                actual_stats.extend(self.actual_stats)
+                error_counter += self.error_counter
+                total_actions += self.total_actions
+                pb.update(source.bytes_read() - pb.n)
+                if not source.next_chunk():
+                    break
+                # Later chunks may bring new classes to index.
+                if hasattr(self, "query_setup"):
+                    self.query_setup(generator)
+        finally:
+            self.progress_bar = True
+            pb.close()
+
+        self.times_arr = times_arr
+        self.actual_stats = actual_stats
+        self.error_counter = error_counter
+        self.total_actions = total_actions
+        self.total_actions_time = time.time() - start_time
+        self.numthreads = numthreads
+        if stats:
+            self.print_stats()
 
     def print_stats(self) -> None:
 
@@ -5,6 +5,11 @@ import threading
 from threading import Thread
 from tqdm import tqdm as tqdm
 
+# Scheduling of the work among the threads of batched_run.
+# static: every thread gets a contiguous range up front.
+# dynamic: threads pull the next batch from a shared cursor as they go.
+SCHEDULERS = ["static", "dynamic"]
+
 
 class Parallelizer:
     """**Generic Parallelizer**
@@ -26,10 +31,16 @@ class Parallelizer:
         Batch6 :w6, after w4, 10s
 
     ```
+
+    With the `dynamic` scheduler, a worker that is done with its batch claims
+    the next unprocessed one, so slow rows do not leave the other workers idle
+    at the end of the run.
     """
 
     def __init__(self):
         self._reset()
+        # Whether batched_run shows its progress bar over the actions.
+        self.progress_bar = True
 
     def _reset(self, batchsize: int = 1, numthreads: int = 1):
 
@@ -43,23 +54,65 @@ class Parallelizer:
         self.error_counter = 0
         self.actual_stats = []
 
+        # Per thread state of the workers (connections, etc.)
+        self.worker_state = threading.local()
+        self.next_action = 0
+        self.claim_lock = threading.Lock()
+
     def get_times(self):
 
         return self.times_arr
 
-    def batched_run(self, generator, batchsize: int, numthreads: int, stats: bool):
+    def claim(self, size: int) -> tuple:
+        """
+        Reserve the next `size` actions for the calling worker.
+
+        Returns:
+            (start, end): The range claimed, empty when all actions are taken.
+        """
+        with self.claim_lock:
+            start = self.next_action
+            end = min(start + max(1, size), self.total_actions)
+            self.next_action = max(start, end)
+        return start, end
+
+    def claim_size(self, thid: int) -> int:
+        """
+        Number of actions a worker claims at once with the dynamic scheduler.
+        """
+        return self.batchsize
+
+    def producer_threads(self, generator, run_event) -> list:
+        """
+        Extra threads to run next to the workers, e.g. to prepare their input.
+        They are started and joined along with the workers.
+        """
+        return []
+
+    def dynamic_worker(self, thid: int, generator, run_event) -> None:
+        while run_event.is_set():
+            start, end = self.claim(self.claim_size(thid))
+            if start >= end:
+                break
+            self.worker(thid, generator, start, end, run_event)
+
+    def batched_run(self, generator, batchsize: int, numthreads: int, stats: bool, scheduler: str = "static"):
+        if scheduler not in SCHEDULERS:
+            raise ValueError(
+                f"Unknown scheduler {scheduler}, expected one of {SCHEDULERS}")
         run_event = threading.Event()
         run_event.set()
         self._reset(batchsize, numthreads)
         self.stats = stats
         self.generator = generator
-        if hasattr(generator, "sample_count"):
+        if getattr(generator, "sample_count", None) is not None:
             print("sample_count", generator.sample_count)
             self.total_actions = generator.sample_count
         else:
             self.total_actions = len(generator)
         self.pb = tqdm(total=self.total_actions, desc="Progress",
-                       unit="items", unit_scale=True, dynamic_ncols=True)
+                       unit="items", unit_scale=True, dynamic_ncols=True,
+                       disable=not self.progress_bar)
         start_time = time.time()
 
         if self.total_actions < batchsize:
@@ -71,18 +124,28 @@ class Parallelizer:
 
         thread_arr = []
         for i in range(self.numthreads):
-            idx_start = i * elements_per_thread
-            idx_end = min(idx_start + elements_per_thread,
-                          self.total_actions)
-
-            thread_add = Thread(target=self.worker,
-                                args=(i, generator, idx_start, idx_end, run_event))
+            if scheduler == "dynamic":
+                thread_add = Thread(target=self.dynamic_worker,
+                                    args=(i, generator, run_event))
+            else:
+                idx_start = i * elements_per_thread
+                idx_end = min(idx_start + elements_per_thread,
+                              self.total_actions)
+
+                thread_add = Thread(target=self.worker,
+                                    args=(i, generator, idx_start, idx_end, run_event))
             thread_arr.append(thread_add)
+        thread_arr.extend(self.producer_threads(generator, run_event))
 
         a = [th.start() for th in thread_arr]
         try:
-            while run_event.is_set() and any([th.is_alive() for th in thread_arr]):
-                time.sleep(1)
+            while run_event.is_set():
+                alive = [th for th in thread_arr if th.is_alive()]
+                if not alive:
+                    break
+                # Returns as soon as the thread is done, rather than sleeping
+                # a whole second after the last batch.
+                alive[0].join(1)
         except KeyboardInterrupt:
             print("Interrupted ... Shutting down workers")
         finally:
@@ -82,7 +82,7 @@ class PolygonDataCSV(CSVParser.CSVParser):
 
         q = []
 
-        img_id = self.df.loc[idx, self.img_key]
+        img_id = self.cell(idx, self.img_key)
 
         fi = {
             "FindImage": {
@@ -97,10 +97,10 @@ class PolygonDataCSV(CSVParser.CSVParser):
 
         polygon_fields = {
             "image_ref": 1,
-            "polygons": json.loads(self.df.loc[idx, HEADER_POLYGONS])
+            "polygons": json.loads(self.cell(idx, HEADER_POLYGONS))
         }
         for key in self.polygon_keys:
-            polygon_fields[POLYGON_FIELDS[key]] = self.df.loc[idx, key]
+            polygon_fields[POLYGON_FIELDS[key]] = self.cell(idx, key)
 
         ap = self._basic_command(idx, polygon_fields)
         q.append(ap)
@@ -0,0 +1,139 @@
+"""
+**Module providing the ProcessLoader.**
+
+This module provides the `ProcessLoader` class, which builds batches of a
+`Subscriptable` in a pool of worker processes instead of threads. It is meant
+for generators and transformers doing CPU bound work in `getitem`
+(decoding, hashing, embeddings), which the GIL serializes under threads.
+
+The generator is pickled once per worker process. The blobs of every batch
+come back to the parent through a shared memory segment instead of the
+result pipe.
+"""
+from __future__ import annotations
+import logging
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+from aperturedb.types import Commands, Blobs
+
+logger = logging.getLogger(__name__)
+
+# Batches with fewer blob bytes than this are returned through the pipe.
+SHARED_MEMORY_MIN_BYTES = 64 * 1024
+
+# Generator of the worker process, set by the initializer of the pool.
+_generator = None
+
+
+def _init_process(generator) -> None:
+    global _generator
+    _generator = generator
+
+
+def _is_blob(blob) -> bool:
+    return isinstance(blob, (bytes, bytearray, memoryview))
+
+
+def _shareable(query) -> bool:
+    return isinstance(query, tuple) and len(query) == 2 and \
+        isinstance(query[1], list) and all(_is_blob(b) for b in query[1])
+
+
+def _load_range(start: int, end: int) -> Tuple[list, str]:
+    """
+    Runs in the worker process: builds the queries of [start, end) and moves
+    their blobs to a shared memory segment.
+
+    Returns:
+        (items, name): Each item is either ("raw", query) or
+        ("shm", commands, spans), where spans are (offset, size) of the blobs
+        in the segment named `name`. `name` is None without shared memory.
+    """
+    batch = _generator[start:end]
+    data = [batch[i] for i in range(len(batch))]
+    total = sum(memoryview(b).nbytes for q in data if _shareable(q)
+                for b in q[1])
+    if total < SHARED_MEMORY_MIN_BYTES:
+        return [("raw", q) for q in data], None
+
+    shm = shared_memory.SharedMemory(create=True, size=total)
+    try:
+        items = []
+        offset = 0
+        for q in data:
+            if not _shareable(q):
+                items.append(("raw", q))
+                continue
+            spans = []
+            for blob in q[1]:
+                view = memoryview(blob).cast("B")
+                shm.buf[offset:offset + view.nbytes] = view
+                spans.append((offset, view.nbytes))
+                offset += view.nbytes
+            items.append(("shm", q[0], spans))
+        return items, shm.name
+    except BaseException:
+        shm.unlink()
+        raise
+    finally:
+        shm.close()
+
+
+def _unpack(items: list, name: str) -> List[Tuple[Commands, Blobs]]:
+    if name is None:
+        return [item[1] for item in items]
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        data = []
+        for item in items:
+            if item[0] == "raw":
+                data.append(item[1])
+            else:
+                _, commands, spans = item
+                data.append((commands, [bytes(shm.buf[offset:offset + size])
+                                        for offset, size in spans]))
+        return data
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class ProcessLoader:
+    """
+    **Pool of processes building batches of a Subscriptable**
+
+    Args:
+        generator (Subscriptable): The data to load, it must be picklable.
+        processes (int): Number of worker processes.
+        mp_context (str, optional): Start method of the processes. Defaults to "spawn",
+            which does not inherit the threads and connections of the caller.
+            As with any spawned process, the script starting the ingestion must be
+            guarded by `if __name__ == "__main__":`.
+    """
+
+    def __init__(self, generator, processes: int, mp_context: str = "spawn"):
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=mp.get_context(mp_context),
+            initializer=_init_process,
+            initargs=(generator,))
+
+    def load(self, start: int, end: int) -> List[Tuple[Commands, Blobs]]:
+        """
+        Builds the queries of [start, end) in one of the worker processes.
+        """
+        items, name = self.executor.submit(_load_range, start, end).result()
+        return _unpack(items, name)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
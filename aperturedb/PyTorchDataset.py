@@ -1,8 +1,14 @@
+import copy
 import math
+import os
+import queue
+import threading
 import numpy as np
 import cv2
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
+import torch.distributed as dist
 from torch.utils import data
 
 from aperturedb.CommonLibrary import execute_query
@@ -18,11 +24,32 @@ class ApertureDBDataset(data.Dataset):
     It is used to load images from ApertureDB into a PyTorch model.
     It can be initialized with a query that will be used to retrieve
     the images from ApertureDB.
+
+    Every process using the dataset, such as the workers of a DataLoader,
+    clones its own connection on first use. `worker_init_fn` can be given to
+    the DataLoader to connect when the workers start.
+
+    With `prefetch` > 0, the batches are fetched and decoded by a background
+    thread, up to `prefetch` batches ahead of the one being read. In
+    DataLoader workers, the batches ahead are only known with
+    `ApertureDBBatchSampler`: each worker computes the order of the epoch and
+    prefetches the batches it will be given, so every batch is fetched once.
+    Without it, workers fetch the batch being read only.
+
+    Args:
+        client (Connector): Connection to ApertureDB.
+        query (list): Query with one FindImage command.
+        label_prop (str, optional): Property returned as the label of the images. Defaults to None.
+        batch_size (int, optional): Number of images per FindImage batch. Defaults to 1.
+        prefetch (int, optional): Number of batches fetched ahead. Defaults to 0.
     """
 
-    def __init__(self, client: Connector, query, label_prop=None, batch_size=1):
+    def __init__(self, client: Connector, query, label_prop=None, batch_size=1, prefetch: int = 0):
 
         self.client = client.clone()
+        self.client_class = type(client)
+        self.client_config = client.config
+        self.client_pid = os.getpid()
         self.query = query
         self.find_image_idx = None
         self.total_elements = 0
@@ -31,6 +58,13 @@ class ApertureDBDataset(data.Dataset):
         self.batch_start    = 0
         self.batch_end      = 0
         self.label_prop     = label_prop
+        self.prefetch       = prefetch
+        self.sampling       = None
+        self.epoch          = 0
+        self.plan           = None
+        self.executor       = None
+        self.executor_pid   = None
+        self.batches        = {}
 
         for i in range(len(query)):
 
@@ -59,11 +93,127 @@ class ApertureDBDataset(data.Dataset):
                 f"Query error: {self.query} {self.client.get_last_response_str()}")
             raise
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Connections and threads are not inherited by other processes.
+        state["client"] = None
+        state["executor"] = None
+        state["batches"] = {}
+        state["plan"] = None
+        return state
+
+    @staticmethod
+    def worker_init_fn(worker_id):
+        """
+        To be given to a DataLoader, connects each worker as it starts.
+        """
+        data.get_worker_info().dataset.connection()
+
+    def connection(self) -> Connector:
+        """
+        The connection of the calling process, cloned on first use.
+        """
+        if self.client is None or self.client_pid != os.getpid():
+            if self.client is not None:
+                self.client = self.client.clone()
+            else:
+                self.client = self.client_class(config=self.client_config)
+            self.client_pid = os.getpid()
+        return self.client
+
+    def set_sampling(self, shuffle: bool, seed: int, num_replicas: int, rank: int):
+        """
+        Parameters of the ApertureDBBatchSampler reading the dataset, from
+        which the workers compute the order of the batches of every epoch.
+        """
+        self.sampling = dict(shuffle=shuffle, seed=seed,
+                             num_replicas=num_replicas, rank=rank)
+        self.plan = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def epoch_order(self, epoch):
+        total_batches = math.ceil(self.total_elements / self.batch_size)
+        if epoch not in self.plan["orders"]:
+            order, _ = ApertureDBBatchSampler.epoch_order(
+                total_batches, epoch=epoch, **self.sampling)
+            # The current epoch and the next one at most.
+            self.plan["orders"] = {e: v for e, v in self.plan["orders"].items()
+                                   if e >= epoch - 1}
+            self.plan["orders"][epoch] = (
+                order, {b: i for i, b in enumerate(order)})
+        return self.plan["orders"][epoch]
+
+    def plan_position(self, batch_idx, worker, workers):
+        """
+        Position of a batch in the order of the epoch read by the calling
+        worker, or None if it is not one the worker was expected to get.
+        """
+        if self.plan is None:
+            self.plan = {"epoch": self.epoch, "last": None, "orders": {}}
+        epoch, last = self.plan["epoch"], self.plan["last"]
+        # DataLoader workers are given the batches round robin, from the first
+        # worker. Persistent workers do not see set_epoch, so a new iteration
+        # may be over the next epoch.
+        candidates = []
+        if last is not None:
+            # The images of a batch are read one by one.
+            candidates += [(epoch, last), (epoch, last + workers)]
+        candidates += [(e, worker) for e in (epoch, epoch + 1, self.epoch)]
+        for e, expected in candidates:
+            _, positions = self.epoch_order(e)
+            if positions.get(batch_idx) == expected:
+                self.plan["epoch"], self.plan["last"] = e, expected
+                return expected
+        self.plan["last"] = None
+        return None
+
+    def next_batches(self, batch_idx):
+        info = data.get_worker_info()
+        worker, workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        if self.sampling is None:
+            if info is not None:
+                # The batches given to this worker are not known.
+                return []
+            total_batches = math.ceil(self.total_elements / self.batch_size)
+            return list(range(batch_idx + 1,
+                              min(batch_idx + self.prefetch + 1, total_batches)))
+
+        position = self.plan_position(batch_idx, worker, workers)
+        if position is None:
+            return []
+        order, _ = self.epoch_order(self.plan["epoch"])
+        return order[position + workers:position + workers * self.prefetch + 1:workers]
+
+    def prefetched_batch(self, batch_idx):
+        if self.executor is None or self.executor_pid != os.getpid():
+            # A single thread, which owns the connection of the process.
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            self.executor_pid = os.getpid()
+            self.batches = {}
+
+        ahead = [batch_idx] + self.next_batches(batch_idx)
+        for b in ahead:
+            if b not in self.batches:
+                self.batches[b] = self.executor.submit(
+                    self.fetch_batch, b, True)
+        # Only the batch being read and the ones ahead of it are kept.
+        for b in [b for b in self.batches if b not in ahead]:
+            self.batches.pop(b).cancel()
+
+        return self.batches[batch_idx].result()
+
     def __getitem__(self, index):
 
         if index >= self.total_elements:
             raise StopIteration
 
+        if self.prefetch > 0:
+            images, labels = self.prefetched_batch(index // self.batch_size)
+            idx = index % self.batch_size
+            return images[idx], labels[idx]
+
         if not self.is_in_range(index):
             self.get_batch(index)
 
@@ -71,11 +221,14 @@ class ApertureDBDataset(data.Dataset):
         img   = self.batch_images[idx]
         label = self.batch_labels[idx]
 
+        return self.decode(img), label
+
+    @staticmethod
+    def decode(img):
         nparr = np.frombuffer(img, dtype=np.uint8)
         img   = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         img   = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        return img, label
+        return img
 
     def __len__(self):
 
@@ -90,19 +243,29 @@ class ApertureDBDataset(data.Dataset):
 
     def get_batch(self, index):
 
+        batch_idx = math.floor(index / self.batch_size)
+        images, labels = self.fetch_batch(batch_idx)
+
+        self.batch_images = images
+        self.batch_start  = self.batch_size * batch_idx
+        self.batch_end    = self.batch_start + len(images)
+        self.batch_labels = labels
+
+    def fetch_batch(self, batch_idx, decode=False):
+        """
+        Images and labels of a batch, decoded or as encoded blobs.
+        """
         total_batches = math.ceil(self.total_elements / self.batch_size)
-        batch_idx     = math.floor(index / self.batch_size)
 
         if batch_idx >= total_batches:
             raise Exception("Index out of range")
 
-        query  = self.query
+        query  = copy.deepcopy(self.query)
         qbatch = query[self.find_image_idx]["FindImage"]["batch"]
         qbatch["batch_size"] = self.batch_size
         qbatch["batch_id"]   = batch_idx
 
-        query[self.find_image_idx]["FindImage"]["batch"] = qbatch
-
+        client = self.connection()
         try:
 
             # This is to handle potential issues with
@@ -110,30 +273,192 @@ class ApertureDBDataset(data.Dataset):
             connection_ok = False
             try:
                 _, r, b = execute_query(
-                    query=self.query, blobs=[], client=self.client)
+                    query=query, blobs=[], client=client)
                 connection_ok = True
             except:
                 # Connection failed, we retry just once to re-connect
-                self.client = self.client.clone()
+                client = self.client = client.clone()
 
             if not connection_ok:
                 # Connection failed, we have reconnected, we try again.
                 _, r, b = execute_query(
-                    query=self.query, blobs=[], client=self.client)
+                    query=query, blobs=[], client=client)
 
             if len(b) == 0:
-                logger.error(f"index: {index}")
+                logger.error(f"batch: {batch_idx}")
                 raise Exception("No results returned from ApertureDB")
 
-            self.batch_images = b
-            self.batch_start  = self.batch_size * batch_idx
-            self.batch_end    = self.batch_start + len(b)
-
             if self.label_prop:
                 entities = r[self.find_image_idx]["FindImage"]["entities"]
-                self.batch_labels = [l[self.label_prop] for l in entities]
+                labels = [l[self.label_prop] for l in entities]
             else:
-                self.batch_labels = ["none" for l in range(len(b))]
+                labels = ["none" for l in range(len(b))]
         except:
-            logger.error(f"Query error: {self.client.get_last_response_str()}")
+            logger.error(f"Query error: {client.get_last_response_str()}")
             raise
+
+        if decode:
+            return [self.decode(img) for img in b], labels
+        return b, labels
+
+
+class ApertureDBBatchSampler(data.Sampler):
+    """
+    Batch sampler of an ApertureDBDataset, yielding the indices of whole
+    FindImage batches, so that every batch is fetched once, by a single
+    DataLoader worker. Shuffling permutes the batches and the images within
+    each batch.
+
+    Use it as the `batch_sampler` of a DataLoader, created before iterating
+    over the DataLoader. The batches of an epoch are split between the ranks
+    of a distributed job. The sampler gives its parameters to the dataset, so
+    that the workers compute the same order of batches, and prefetch theirs.
+
+    Args:
+        dataset (ApertureDBDataset): The dataset.
+        shuffle (bool, optional): Shuffle the batches. Defaults to False.
+        seed (int, optional): Seed of the shuffling, with the epoch. Defaults to 0.
+        num_replicas (int, optional): Number of ranks. Defaults to 1.
+        rank (int, optional): Rank of this process. Defaults to 0.
+    """
+
+    def __init__(self, dataset: ApertureDBDataset, shuffle: bool = False, seed: int = 0,
+                 num_replicas: int = 1, rank: int = 0):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        dataset.set_sampling(shuffle, seed, num_replicas, rank)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self.dataset.set_epoch(epoch)
+
+    @staticmethod
+    def epoch_order(total_batches: int, shuffle: bool, seed: int, epoch: int,
+                    num_replicas: int, rank: int):
+        """
+        Batches of an epoch read by a rank, and the generator shuffling the images of the batches.
+        """
+        order = list(range(total_batches))
+        rng = np.random.default_rng(seed + epoch)
+        if shuffle:
+            rng.shuffle(order)
+        return order[rank::num_replicas], rng
+
+    def __len__(self):
+        total_batches = math.ceil(
+            self.dataset.total_elements / self.dataset.batch_size)
+        return len(range(self.rank, total_batches, self.num_replicas))
+
+    def __iter__(self):
+        total = self.dataset.total_elements
+        batch_size = self.dataset.batch_size
+        order, rng = self.epoch_order(
+            math.ceil(total / batch_size), self.shuffle, self.seed, self.epoch,
+            self.num_replicas, self.rank)
+
+        for batch_idx in order:
+            indices = list(range(batch_idx * batch_size,
+                                 min((batch_idx + 1) * batch_size, total)))
+            if self.shuffle:
+                rng.shuffle(indices)
+            yield indices
+
+
+class ApertureDBIterableDataset(data.IterableDataset):
+    """
+    This class implements a PyTorch IterableDataset for ApertureDB, streaming
+    the FindImage batches of a query in order instead of reading them at random.
+
+    The batches are split in contiguous ranges of batch ids, one per
+    DataLoader worker of every distributed rank, so that every image is read
+    once per epoch across the job. A background thread fetches up to
+    `prefetch` batches ahead while the images are decoded.
+
+    Args:
+        client (Connector): Connection to ApertureDB.
+        query (list): Query with one FindImage command.
+        label_prop (str, optional): Property returned as the label of the images. Defaults to None.
+        batch_size (int, optional): Number of images per FindImage batch. Defaults to 1.
+        prefetch (int, optional): Number of batches fetched ahead. Defaults to 2.
+    """
+
+    def __init__(self, client: Connector, query, label_prop=None, batch_size=1, prefetch: int = 2):
+        self.dataset = ApertureDBDataset(
+            client, query, label_prop=label_prop, batch_size=batch_size)
+        self.prefetch = prefetch
+
+    def shard(self):
+        """
+        Index of the calling worker among all the workers of all the ranks, and their number.
+        """
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        info = data.get_worker_info()
+        worker, workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        return rank * workers + worker, world_size * workers
+
+    def batch_range(self):
+        """
+        Batch ids read by the calling worker.
+        """
+        total_batches = math.ceil(
+            self.dataset.total_elements / self.dataset.batch_size)
+        index, count = self.shard()
+        return range(total_batches * index // count,
+                     total_batches * (index + 1) // count)
+
+    def __len__(self):
+        # Images of this rank, as seen by the DataLoader.
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        total = self.dataset.total_elements
+        batch_size = self.dataset.batch_size
+        total_batches = math.ceil(total / batch_size)
+        start = total_batches * rank // world_size
+        end = total_batches * (rank + 1) // world_size
+        return max(0, min(end * batch_size, total) - start * batch_size)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=max(1, self.prefetch))
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            try:
+                for batch_idx in self.batch_range():
+                    if not put(self.dataset.fetch_batch(batch_idx)):
+                        return
+                put(done)
+            except BaseException as e:
+                put(e)
+
+        fetcher = threading.Thread(target=fetch, daemon=True)
+        fetcher.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                images, labels = item
+                for img, label in zip(images, labels):
+                    yield ApertureDBDataset.decode(img), label
+        finally:
+            stop.set()
+            fetcher.join()
@@ -1,3 +1,4 @@
+import mmap
 import time
 import requests
 import logging
@@ -5,6 +6,19 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def map_file(filename):
+    """
+    Maps a file read-only, to be used as a blob without reading it into memory.
+    The pages are read by the connector as the blob is sent.
+    Empty files cannot be mapped, and are read instead.
+    """
+    with open(filename, "rb") as fd:
+        try:
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return fd.read()
+
+
 class Sources():
     """
     **Load data from various resources**
@@ -19,10 +33,19 @@ class Sources():
         self.http_client = requests.Session(
         ) if "http_client" not in kwargs else kwargs["http_client"]
 
-    def load_from_file(self, filename):
+    def load_from_file(self, filename, use_mmap: bool = False):
         """
         Load data from a file.
+        With use_mmap, the file is mapped instead of read.
         """
+        if use_mmap:
+            try:
+                return True, map_file(filename)
+            except Exception as e:
+                logger.error(f"VALIDATION ERROR: {filename}")
+                logger.exception(e)
+                return False, None
+
         try:
             fd = open(filename, "rb")
             buff = fd.read()
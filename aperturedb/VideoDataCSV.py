@@ -2,7 +2,7 @@ import cv2
 import logging
 import os
 from aperturedb import CSVParser
-from aperturedb.Sources import Sources
+from aperturedb.Sources import Sources, map_file
 import boto3
 
 
@@ -107,10 +107,11 @@ class VideoDataCSV(CSVParser.CSVParser):
         return True
 
     def getitem(self, idx):
+        idx = self.df.index.start + idx
         self.relative_path_prefix = os.path.dirname(self.filename) \
             if self.source_type == HEADER_PATH and self.blobs_relative_to_csv else ""
         uri = os.path.join(self.relative_path_prefix,
-                           self.df.loc[idx, self.source_type])
+                           self.cell(idx, self.source_type))
         video_ok, video = self.loaders[self.source_type](uri)
 
         if not video_ok:
@@ -137,6 +138,8 @@ class VideoDataCSV(CSVParser.CSVParser):
                 logger.exception(e)
 
         try:
+            if self.mmap_blobs:
+                return True, map_file(filename)
             fd = open(filename, "rb")
             buff = fd.read()
             fd.close()
@@ -20,6 +20,7 @@ class Videos(Entities):
         item = super().getitem(idx)
         if self.blobs:
             if 'preview' not in item:
+                # Videos are large, bulk fetches are left to get_blobs.
                 item['preview'] = self.get_blob(item)
         return item
 
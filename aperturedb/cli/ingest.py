@@ -90,7 +90,7 @@ def _create_pipeline(transformers: List[str]):
     return pipeline
 
 
-def _process_data(data, sample_count, module_name, batchsize, num_workers, stats, debug):
+def _process_data(data, sample_count, module_name, batchsize, num_workers, stats, debug, use_dask=False):
     if debug:
         _debug_samples(data, sample_count, module_name)
     else:
@@ -103,7 +103,8 @@ def _process_data(data, sample_count, module_name, batchsize, num_workers, stats
             data,
             stats=stats,
             batchsize=batchsize,
-            numthreads=num_workers)
+            numthreads=num_workers,
+            use_dask=use_dask)
 
 
 @app.command()
@@ -119,6 +120,8 @@ def from_generator(filepath: Annotated[str, typer.Argument(
         help="Size of the batch")] = 1,
     num_workers: Annotated[int, typer.Option(
         help="Number of workers for ingestion")] = 1,
+    use_dask: Annotated[bool, typer.Option(
+        help="Use dask based parallelization, the generator must be picklable")] = False,
     transformer: Annotated[Optional[List[TransformerType]], typer.Option(
         help="Apply transformer to the pipeline [Can be specified multiple times]")] = None,
     user_transformer: Annotated[Optional[List[str]], typer.Option(
@@ -157,7 +160,8 @@ def from_generator(filepath: Annotated[str, typer.Argument(
         batchsize=batchsize,
         num_workers=num_workers,
         stats=stats,
-        debug=debug
+        debug=debug,
+        use_dask=use_dask
     )
 
     while hasattr(data, "ncalls"):
@@ -189,6 +193,8 @@ def from_csv(filepath: Annotated[str, typer.Argument(
         help="Number of samples to ingest (-1 for all)")] = -1,
     debug: Annotated[bool, typer.Option(
         help="Debug mode")] = False,
+    chunksize: Annotated[int, typer.Option(
+        help="Stream the CSV file by chunks of this many rows (0 to load it whole)")] = 0,
 ):
     """
     Ingest data from a pre generated CSV file.
@@ -215,9 +221,19 @@ def from_csv(filepath: Annotated[str, typer.Argument(
         IngestType.VIDEO: VideoDataCSV
     }
 
-    data = ingest_types[ingest_type](filepath, use_dask=use_dask,
-                                     blobs_relative_to_csv=blobs_relative_to_csv)
-    data.sample_count = len(data) if sample_count == -1 else sample_count
+    if chunksize > 0:
+        if sample_count != -1:
+            console.log("sample_count is not supported when streaming with chunksize")
+            raise typer.Exit(code=1)
+        data = ingest_types[ingest_type](filepath, use_dask=use_dask,
+                                         blobs_relative_to_csv=blobs_relative_to_csv,
+                                         chunksize=chunksize)
+        # The length is only known chunk by chunk.
+        data.sample_count = None
+    else:
+        data = ingest_types[ingest_type](filepath, use_dask=use_dask,
+                                         blobs_relative_to_csv=blobs_relative_to_csv)
+        data.sample_count = len(data) if sample_count == -1 else sample_count
     if transformer or user_transformer:
         transformer = transformer or []
         user_transformer = user_transformer or []
@@ -37,3 +37,101 @@ elif google.protobuf.__version__.split(".")[0] == "6":
 else:
     raise Exception(
         f"aperturedb not compatible with {google.protobuf.__version__}")
+
+# Field numbers of queryMessage, see queryMessage.proto
+FIELD_JSON = 1
+FIELD_BLOBS = 2
+FIELD_TOKEN = 3
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+
+# Field values smaller than this are copied into a shared buffer when encoding,
+# larger ones are referenced in place.
+ENCODE_INLINE_LIMIT = 64 * 1024
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def encode_fields(fields, inline_limit: int = ENCODE_INLINE_LIMIT) -> list:
+    """
+    Encodes length delimited fields of a queryMessage in wire format.
+    Takes an iterable of (field_number, bytes-like) and returns a list of
+    buffers whose concatenation is the serialized message.
+    Small values are packed together, while large values (blobs) are
+    returned as views of the caller's buffers, so they are never copied.
+    """
+    buffers = []
+    chunk = bytearray()
+    for field, value in fields:
+        view = memoryview(value)
+        if view.format != "B" or view.ndim != 1:
+            view = view.cast("B")
+        chunk += encode_varint(field << 3 | WIRE_LENGTH_DELIMITED)
+        chunk += encode_varint(len(view))
+        if len(view) < inline_limit:
+            chunk += view
+        else:
+            buffers.append(chunk)
+            buffers.append(view)
+            chunk = bytearray()
+    if chunk:
+        buffers.append(chunk)
+    return buffers
+
+
+def _read_varint(view, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = view[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def decode_fields(data):
+    """
+    Walks the wire format of a serialized queryMessage, without copying it.
+    The data can be a single buffer, such as a received message.
+    Yields (field_number, memoryview) for every length delimited field,
+    in the order they appear; other fields are skipped.
+    This works the same with every protobuf version.
+    """
+    view = memoryview(data)
+    end = len(view)
+    pos = 0
+    while pos < end:
+        key, pos = _read_varint(view, pos)
+        wire_type = key & 0x7
+        if wire_type == WIRE_LENGTH_DELIMITED:
+            length, pos = _read_varint(view, pos)
+            if pos + length > end:
+                raise ValueError("Truncated queryMessage")
+            yield key >> 3, view[pos:pos + length]
+            pos += length
+        elif wire_type == WIRE_VARINT:
+            _, pos = _read_varint(view, pos)
+        elif wire_type == WIRE_FIXED64:
+            pos += 8
+        elif wire_type == WIRE_FIXED32:
+            pos += 4
+        else:
+            raise ValueError(
+                f"Unexpected wire type {wire_type} in queryMessage")
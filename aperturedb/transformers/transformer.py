@@ -81,6 +81,13 @@ class Transformer(Subscriptable):
     def __len__(self):
         return len(self.data)
 
+    def __getstate__(self):
+        # The connection is not picklable, it is created again on demand
+        # when the transformer is sent to another process.
+        state = self.__dict__.copy()
+        state["_client"] = None
+        return state
+
     def get_client(self):
         if self._client is None:
             self._client = create_connector()
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+
+from aperturedb.AsyncConnector import AsyncConnector
+from aperturedb.CommonLibrary import execute_query_async
+import dbinfo
+
+logger = logging.getLogger(__name__)
+
+
+def _make_async_connector():
+    return AsyncConnector(
+        host=dbinfo.DB_TCP_HOST,
+        port=dbinfo.DB_TCP_PORT,
+        user=dbinfo.DB_USER,
+        password=dbinfo.DB_PASSWORD,
+        use_ssl=True,
+        ca_cert=dbinfo.CA_CERT,
+        verify_hostname=dbinfo.VERIFY_HOSTNAME,
+        retry_max_attempts=3,
+        retry_interval_seconds=0)
+
+
+class TestAsyncConnector():
+    """
+    These check operation of the asyncio connector
+    """
+
+    def test_concurrent_queries(self):
+        async def run():
+            async with _make_async_connector() as client:
+                return await asyncio.gather(*[
+                    client.query([{"GetStatus": {}}]) for _ in range(100)])
+
+        results = asyncio.run(run())
+        assert len(results) == 100
+        for response, blobs in results:
+            assert response[0]["GetStatus"]["status"] == 0
+            assert blobs == []
+
+    def test_execute_query_async(self):
+        async def run():
+            async with _make_async_connector() as client:
+                return await execute_query_async(
+                    client, [{"FindEntity": {"results": {"count": True}}}])
+
+        result, response, blobs = asyncio.run(run())
+        assert result == 0
+        assert "count" in response[0]["FindEntity"]
+
+    def test_sessionRenew(self):
+        async def run():
+            async with _make_async_connector() as client:
+                await client.query([{"GetStatus": {}}])
+                # force session token expiry
+                client.shared_data.session.session_token_ttl = 1
+                await asyncio.sleep(2)
+                await client.query([{"GetStatus": {}}])
+                return client.shared_data.session.valid()
+
+        assert asyncio.run(run()) == True
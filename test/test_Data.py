@@ -395,3 +395,222 @@ class TestURILoader():
         data, _ = insert_data_from_csv(
             in_csv_file = "./input/gs_videos.adb.csv")
         self.assertEqual(len(data), utils.count_entities("_Video"))
+
+
+class TestCSVParser():
+    """
+    These check the row materialization of the CSV loaders, without a database
+    """
+
+    def test_cellsMatchDataFrame(self, tmp_path):
+        from aperturedb.EntityDataCSV import EntityDataCSV
+        from aperturedb.EntityUpdateDataCSV import SingleEntityUpdateDataCSV
+        df = pd.DataFrame({
+            "EntityClass": ["Person"] * 4,
+            "name": ["a", "b", None, "d"],
+            "age": [1, np.nan, 3, 4],
+            "date:dob": ["2020-01-01"] * 4,
+            "constraint_id": [10, 11, 12, 13],
+            "updateif_>version": [1, 2, 3, 4],
+            "updateif_date<:ts": ["2021-01-01"] * 4,
+        })
+        filename = str(tmp_path / "persons.csv")
+        df.to_csv(filename, index=False)
+
+        data = EntityDataCSV(filename)
+        for idx in range(len(data)):
+            for key in data.header:
+                cell = data.cell(idx, key)
+                expected = data.df.loc[idx, key]
+                assert cell == expected or (cell != cell and expected != expected)
+        # Labels outside of the rows are not read from the other end
+        for idx in [-1, len(data)]:
+            with pytest.raises(KeyError):
+                data.cell(idx, "name")
+
+        query, _ = data[1]
+        assert query[0]["AddEntity"]["properties"] == {
+            "name": "b", "dob": {"_date": "2020-01-01"}, "updateif_>version": 2,
+            "updateif_date<:ts": "2021-01-01"}
+        assert query[0]["AddEntity"]["if_not_found"] == {"id": ["==", 11]}
+
+        update = SingleEntityUpdateDataCSV("Person", filename)
+        search = update.parse_other_constraint(
+            "updateif_", update.search_keys, 2)
+        assert search["version"] == [">", 3]
+
+    def test_streamedChunks(self, tmp_path):
+        from aperturedb.EntityDataCSV import EntityDataCSV
+        rows = 25
+        df = pd.DataFrame({
+            "EntityClass": ["Person"] * rows,
+            "id": list(range(rows)),
+        })
+        filename = str(tmp_path / "persons.csv")
+        df.to_csv(filename, index=False)
+
+        data = EntityDataCSV(filename, chunksize=10)
+        assert data.streaming()
+        seen = []
+        lengths = []
+        while True:
+            lengths.append(len(data))
+            seen.extend(data[i][0][0]["AddEntity"]["properties"]["id"]
+                        for i in range(len(data)))
+            if not data.next_chunk():
+                break
+        assert lengths == [10, 10, 5]
+        assert seen == list(range(rows))
+        assert data.bytes_read() == data.file_size()
+
+    def test_streamedConnections(self, tmp_path):
+        from aperturedb.ConnectionDataCSV import ConnectionDataCSV
+        rows = 25
+        df = pd.DataFrame({
+            "ConnectionClass": ["knows"] * rows,
+            "Person@id": list(range(rows)),
+            "Person@id.1": list(range(100, 100 + rows)),
+            "weight": list(range(rows)),
+        })
+        filename = str(tmp_path / "connections.csv")
+        df.to_csv(filename, index=False)
+
+        data = ConnectionDataCSV(filename, chunksize=10)
+        seen = []
+        lengths = []
+        while True:
+            lengths.append(len(data))
+            for i in range(len(data)):
+                query = data[i][0]
+                src = query[0]["FindEntity"]["constraints"]["id"][1]
+                dst = query[1]["FindEntity"]["constraints"]["id"][1]
+                connection = query[2]["AddConnection"]
+                assert dst == src + 100
+                assert connection["properties"]["weight"] == src
+                seen.append(src)
+            if not data.next_chunk():
+                break
+        # The last chunk is partial
+        assert lengths == [10, 10, 5]
+        assert seen == list(range(rows))
+
+    def test_streamedChunksKeepDtypes(self, tmp_path):
+        from aperturedb.EntityDataCSV import EntityDataCSV
+        filename = str(tmp_path / "persons.csv")
+        with open(filename, "w") as f:
+            f.write("EntityClass,age,height\n")
+            f.write("Person,30,1.5\nPerson,40,1.5\n")
+            # Missing age, and whole heights
+            f.write("Person,,2\nPerson,50,1\n")
+
+        data = EntityDataCSV(filename, chunksize=2)
+        data.next_chunk()
+        properties = [data[i][0][0]["AddEntity"]["properties"]
+                      for i in range(len(data))]
+        assert properties == [{"height": 2.0}, {"age": 50, "height": 1.0}]
+        assert isinstance(properties[1]["age"], int)
+        assert all(isinstance(p["height"], float) for p in properties)
+
+    def test_columnarFiles(self, tmp_path):
+        pa = pytest.importorskip("pyarrow")
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+        from aperturedb.EntityDataCSV import EntityDataCSV
+        rows = 12
+        table = pa.table({
+            "EntityClass": ["Person"] * rows,
+            "age": pa.array([i if i % 3 else None for i in range(rows)], pa.int64()),
+            "date:dob": pa.array([f"2020-01-{i + 1:02d}" for i in range(rows)]).cast(pa.timestamp("s")),
+            "constraint_id": list(range(rows)),
+        })
+        parquet = str(tmp_path / "persons.parquet")
+        arrow = str(tmp_path / "persons.arrow")
+        pq.write_table(table, parquet, row_group_size=4)
+        feather.write_feather(table, arrow)
+
+        data = EntityDataCSV(parquet)
+        assert [data[i] for i in range(rows)] == [
+            EntityDataCSV(arrow)[i] for i in range(rows)]
+        properties = data[1][0][0]["AddEntity"]["properties"]
+        # Typed columns stay integers, and dates are sent as ISO strings
+        assert properties == {"age": 1, "dob": {"_date": "2020-01-02T00:00:00"}}
+        assert type(properties["age"]) is int
+        assert "age" not in data[3][0][0]["AddEntity"]["properties"]
+        assert type(data[1][0][0]["AddEntity"]["if_not_found"]["id"][1]) is int
+
+        subset = EntityDataCSV(parquet, row_groups=[2])
+        assert len(subset) == 4
+        assert subset[0][0][0]["AddEntity"]["if_not_found"] == {"id": ["==", 8]}
+
+        streamed = EntityDataCSV(arrow, chunksize=5)
+        lengths = [len(streamed)]
+        ages = [streamed[i][0][0]["AddEntity"]["properties"].get("age")
+                for i in range(len(streamed))]
+        while streamed.next_chunk():
+            lengths.append(len(streamed))
+            ages += [streamed[i][0][0]["AddEntity"]["properties"].get("age")
+                     for i in range(len(streamed))]
+        assert lengths == [5, 5, 2]
+        assert all(type(age) is int for age in ages if age is not None)
+
+    def test_descriptorRanges(self, tmp_path):
+        from aperturedb.DescriptorDataCSV import DescriptorDataCSV
+        vectors = np.arange(40, dtype=np.float64).reshape(10, 4)
+        np.save(tmp_path / "a.npy", vectors)
+        np.save(tmp_path / "b.npy", vectors * 2)
+        df = pd.DataFrame({
+            "filename": ["a.npy", "a.npy", "a.npy", "b.npy", "b.npy", "a.npy"],
+            "index": [0, 1, 2, 5, 7, 9],
+            "set": ["s"] * 6,
+            "label": ["x"] * 6,
+        })
+        filename = str(tmp_path / "descriptors.csv")
+        df.to_csv(filename, index=False)
+
+        data = DescriptorDataCSV(filename, max_open_files=1,
+                                 blobs_relative_to_csv=True)
+        batch = data[0:len(data)]
+        assert len(batch) == len(data)
+        for i in range(len(data)):
+            query, blobs = batch[i]
+            assert query == data[i][0]
+            assert bytes(blobs[0]) == bytes(data[i][1][0])
+        assert np.frombuffer(bytes(batch[4][1][0]), np.float32).tolist() == \
+            (vectors[7] * 2).tolist()
+        # .npy files are memory mapped, and only one stays open
+        assert len(data.npy_arrays) == 1
+        assert isinstance(next(iter(data.npy_arrays.values())), np.memmap)
+
+    def test_descriptorEvictionWhileLoading(self, tmp_path):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from aperturedb.DescriptorDataCSV import DescriptorDataCSV
+
+        class SlowDescriptorDataCSV(DescriptorDataCSV):
+            def retrieve_by_index(self, filename, index):
+                # Lets other threads open and evict files meanwhile.
+                time.sleep(0.001)
+                return super().retrieve_by_index(filename, index)
+
+        vectors = np.arange(40, dtype=np.float64).reshape(10, 4)
+        names = [f"{i}.npy" for i in range(4)]
+        for i, name in enumerate(names):
+            np.save(tmp_path / name, vectors + i)
+        df = pd.DataFrame({
+            "filename": [names[i % 4] for i in range(200)],
+            "index": [i % 10 for i in range(200)],
+            "set": ["s"] * 200,
+            "label": ["x"] * 200,
+        })
+        filename = str(tmp_path / "descriptors.csv")
+        df.to_csv(filename, index=False)
+
+        data = SlowDescriptorDataCSV(filename, max_open_files=1,
+                                     blobs_relative_to_csv=True)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            items = list(executor.map(data.getitem, range(len(data))))
+        for i, (_, blobs) in enumerate(items):
+            assert np.frombuffer(blobs[0], np.float32).tolist() == \
+                (vectors[i % 10] + i % 4).tolist()
+        # Back to the bound once the loads are done
+        assert len(data.npy_arrays) == 1 and not data.npy_pins
@@ -0,0 +1,266 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aperturedb.Connector import Connector
+from aperturedb.Descriptors import Descriptors, DescriptorCache, DescriptorMatrix, mmr
+
+
+class MockClient:
+    def __init__(self, failing_id=None):
+        self.config = "mock"
+        self.queries = []
+        self.lock = threading.Lock()
+        # AddDescriptor with this "id" property fails.
+        self.failing_id = failing_id
+
+    def clone(self):
+        return self
+
+    def query(self, q, blobs=None):
+        if blobs is None:
+            blobs = []
+        with self.lock:
+            self.queries.append((q, [bytes(b) for b in blobs]))
+        responses, blobs_out = [], []
+        for cmd, blob in zip(q, blobs + [None] * (len(q) - len(blobs))):
+            name = list(cmd.keys())[0]
+            if name == "FindDescriptorSet":
+                responses.append({name: {"status": 0, "returned": 1,
+                                         "entities": [{"_metrics": ["L2"]}]}})
+                continue
+            if name != "FindDescriptor":
+                failed = self.failing_id is not None and \
+                    cmd[name].get("properties", {}).get("id") == self.failing_id
+                responses.append({name: {"status": -1 if failed else 0}})
+                continue
+            # Neighbors of v are v + 1 .. v + k, at distances 1 .. k
+            vector = np.frombuffer(blob, dtype=np.float32)
+            found = min(cmd[name]["k_neighbors"], int(vector[0]) % 4)
+            entities = [{"_uniqueid": f"{int(vector[0])}.{j}", "_distance": float(j)}
+                        for j in range(1, found + 1)]
+            if cmd[name]["blobs"]:
+                blobs_out.extend((vector + j).tobytes()
+                                 for j in range(1, found + 1))
+            responses.append({name: {"status": 0, "returned": found,
+                                     "entities": entities}})
+        return responses, blobs_out
+
+    def last_query_ok(self):
+        return True
+
+    def get_last_query_time(self):
+        return 0.001
+
+
+def test_DescriptorMatrix_transactions():
+    matrix = np.arange(50, dtype=np.float32).reshape(10, 5)
+    properties = pd.DataFrame({
+        "id": range(10),
+        "name": ["a", None] * 5,
+    })
+    data = DescriptorMatrix("set", matrix, properties, batchsize=4)
+    assert len(data) == 3
+
+    query, blobs = data[2]
+    assert len(query) == len(blobs) == 2
+    assert query[0] == {"AddDescriptor": {
+        "set": "set", "properties": {"id": 8, "name": "a"}}}
+    assert query[1] == {"AddDescriptor": {
+        "set": "set", "properties": {"id": 9}}}
+    # Blobs are views of the rows of the matrix
+    row = np.frombuffer(blobs[1], dtype=np.float32)
+    assert np.shares_memory(row, matrix)
+    assert row.tolist() == matrix[9].tolist()
+
+
+def test_DescriptorMatrix_validation():
+    with pytest.raises(ValueError):
+        DescriptorMatrix("set", np.zeros(5))
+    with pytest.raises(ValueError):
+        DescriptorMatrix("set", np.zeros((5, 2)), pd.DataFrame({"id": [1]}))
+    # Other dtypes are converted once
+    data = DescriptorMatrix("set", np.ones((3, 2), dtype=np.float64))
+    assert np.frombuffer(data[0][1][2], np.float32).tolist() == [1.0, 1.0]
+
+
+def test_Descriptors_add_bulk():
+    client = MockClient()
+    matrix = np.random.rand(25, 8).astype(np.float32)
+    properties = pd.DataFrame({"id": range(25)})
+
+    assert Descriptors(client).add_bulk(
+        "set", matrix, properties, batchsize=10, numthreads=2)
+
+    transactions = [(q, b) for q, b in client.queries
+                    if "AddDescriptor" in q[0]]
+    assert sorted(len(q) for q, _ in transactions) == [5, 10, 10]
+    added = {cmd["AddDescriptor"]["properties"]["id"]: blob
+             for q, b in transactions for cmd, blob in zip(q, b)}
+    assert sorted(added) == list(range(25))
+    assert added[17] == matrix[17].tobytes()
+
+
+def test_Descriptors_add_bulk_partial_failure():
+    client = MockClient(failing_id=17)
+    matrix = np.random.rand(25, 8).astype(np.float32)
+    properties = pd.DataFrame({"id": range(25)})
+
+    # One command failed, in the transaction of rows 10 to 19
+    assert not Descriptors(client).add_bulk(
+        "set", matrix, properties, batchsize=10, numthreads=2)
+
+
+def test_Descriptors_find_similar_batch():
+    client = MockClient()
+    matrix = np.repeat(np.arange(10, dtype=np.float32)[:, None], 3, axis=1)
+
+    ids, distances, vectors = Descriptors(client).find_similar_batch(
+        "set", matrix, 2, blobs=True, batchsize=3, numthreads=2)
+
+    assert ids.shape == distances.shape == (10, 2)
+    assert vectors.shape == (10, 2, 3)
+    # 6 % 4 = 2 neighbors
+    assert ids[6].tolist() == ["6.1", "6.2"]
+    assert distances[6].tolist() == [1.0, 2.0]
+    assert vectors[6, 1].tolist() == [8.0, 8.0, 8.0]
+    # 5 % 4 = 1 neighbor, the other one is padded
+    assert ids[5].tolist() == ["5.1", None]
+    assert np.isnan(distances[5, 1]) and np.isnan(vectors[5, 1]).all()
+    assert vectors[5, 0].tolist() == [6.0, 6.0, 6.0]
+    # 3 searches per transaction at most
+    assert max(len(q) for q, _ in client.queries) == 3
+
+
+def loop_mmr(vector, vectors, k, lambda_mult, metric, penalty=True):
+    """
+    The selection loop of find_similar_mmr before it was vectorized. It added
+    the redundancy to the score, the penalty of MMR subtracts it.
+    """
+    def similarity(v1, v2):
+        if metric == "CS":
+            return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+        elif metric == "L2":
+            return -np.linalg.norm(v1 - v2)
+        return np.dot(v1, v2)
+
+    query_similarity = [similarity(vector, d) for d in vectors]
+    document_similarity = {}
+    for i, d in enumerate(vectors):
+        for j, d2 in enumerate(vectors[i + 1:], i + 1):
+            document_similarity[(i, j)] = document_similarity[(j, i)] = similarity(d, d2)
+
+    selected = []
+    unselected = list(range(len(vectors)))
+    while len(selected) < k and unselected:
+        if not selected:
+            selected.append(0)
+            unselected.remove(0)
+        else:
+            worst_similarity = np.max(np.array(
+                [[document_similarity[(i, j)] for j in unselected] for i in selected]), axis=0)
+            relevance_scores = np.array([query_similarity[i] for i in unselected])
+            sign = -1 if penalty else 1
+            scores = lambda_mult * relevance_scores + \
+                sign * (1 - lambda_mult) * worst_similarity
+            max_index = unselected[np.argmax(scores)]
+            selected.append(max_index)
+            unselected.remove(max_index)
+    return selected
+
+
+@pytest.mark.parametrize("metric", ["CS", "L2", "IP"])
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.3, 0.5, 1.0])
+def test_mmr_matches_loop(metric, lambda_mult):
+    rng = np.random.default_rng(7)
+    for _ in range(20):
+        vector = rng.standard_normal(16).astype(np.float32)
+        vectors = rng.standard_normal((12, 16)).astype(np.float32)
+        assert mmr(vector, vectors, 6, lambda_mult, metric) == \
+            loop_mmr(vector, vectors, 6, lambda_mult, metric)
+
+
+def test_mmr():
+    vector = np.array([0.9, 0.2], dtype=np.float32)
+    vectors = np.array([[1.0, 0.0], [0.99, 0.01], [0.9, -0.4], [0.0, 1.0]],
+                       dtype=np.float32)
+    # Without diversity, the order of relevance
+    assert mmr(vector, vectors, 3, 1.0, "L2") == [0, 1, 2]
+    # The near duplicate of the first one is skipped
+    assert mmr(vector, vectors, 3, 0.5, "L2") == [0, 3, 2]
+    # Adding the redundancy instead picked the near duplicate
+    assert loop_mmr(vector, vectors, 3, 0.5, "L2", penalty=False) == [0, 1, 2]
+    assert mmr(vector, vectors[:2], 3, 0.5, "L2") == [0, 1]
+    assert mmr(vector, vectors[:0], 3) == []
+
+
+def test_Descriptors_find_similar_mmr_batch():
+    client = MockClient()
+    matrix = np.repeat(np.arange(8, dtype=np.float32)[:, None], 3, axis=1)
+
+    ids, distances, vectors = Descriptors(client).find_similar_mmr_batch(
+        "set", matrix, 2, fetch_k=3, batchsize=4)
+
+    assert ids.shape == distances.shape == (8, 2)
+    assert vectors.shape == (8, 2, 3)
+    # 7 % 4 = 3 neighbors, the first one and then the farthest
+    assert ids[7].tolist() == ["7.1", "7.3"]
+    assert distances[7].tolist() == [1.0, 3.0]
+    assert vectors[7, 1].tolist() == [10.0, 10.0, 10.0]
+    # No neighbor
+    assert ids[4].tolist() == [None, None]
+
+
+def test_DescriptorCache(monkeypatch):
+    sent = []
+
+    def query(self, q, blobs=[], try_resume=True):
+        sent.append(q)
+        if "FindDescriptor" in q[0]:
+            return [{"FindDescriptor": {"status": 0, "entities": [{"_uniqueid": str(len(sent))}]}}], []
+        return [{list(q[0].keys())[0]: {"status": 0}}], []
+
+    monkeypatch.setattr(Connector, "_query", query)
+    monkeypatch.setattr(Connector, "_renew_session", lambda self: None)
+    monkeypatch.setattr(Connector, "authenticate", lambda self, **kwargs: None)
+    client = Connector()
+    cache = DescriptorCache(max_entries=2)
+    descriptors = Descriptors(client, cache=cache)
+
+    descriptors.find_similar("a", [1.0, 2.0], 1)
+    descriptors.find_similar("a", [1.0, 2.0], 1)
+    assert len(sent) == 1 and descriptors[0]["_uniqueid"] == "1"
+    # Other vector, k or set
+    descriptors.find_similar("a", [1.0, 2.5], 1)
+    descriptors.find_similar("b", [1.0, 2.0], 1)
+    assert len(sent) == 3
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+    # Bounded to the 2 most recent searches
+    descriptors.find_similar("a", [1.0, 2.0], 1)
+    assert len(sent) == 4
+
+    # Adding to a set, even through a clone, drops its entries only
+    client.clone().query([{"AddDescriptor": {"set": "b"}}], [b""])
+    descriptors.find_similar("a", [1.0, 2.0], 1)
+    descriptors.find_similar("b", [1.0, 2.0], 1)
+    # The AddDescriptor and the search of b
+    assert len(sent) == 6
+
+    cache.detach(client)
+    client.query([{"DeleteDescriptor": {"constraints": {}}}])
+    descriptors.find_similar("b", [1.0, 2.0], 1)
+    assert len(sent) == 7
+
+
+def test_DescriptorCache_ttl(monkeypatch):
+    cache = DescriptorCache(ttl=10)
+    now = [100.0]
+    monkeypatch.setattr("aperturedb.Descriptors.time.monotonic", lambda: now[0])
+    key = DescriptorCache.key("a", [1.0], 5)
+    cache.put(key, [{"_uniqueid": "1"}])
+    assert cache.get(key) == [{"_uniqueid": "1"}]
+    now[0] += 11
+    assert cache.get(key) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,150 @@
+from unittest.mock import patch
+
+from aperturedb.Entities import Entities, DEFAULT_IN_CHUNK_SIZE
+from aperturedb.Images import Images
+from aperturedb.Operations import Operations
+from aperturedb.Query import ObjectType
+
+
+class MockClient:
+    def __init__(self):
+        self.queries = []
+        self.ok = True
+
+    def query(self, q, blobs=None):
+        self.queries.append(q)
+        return [{}], []
+
+    def clone(self):
+        return self
+
+    def last_query_ok(self):
+        return self.ok
+
+    def disconnect(self):
+        pass
+
+
+def test_Entities_get_connected_entities_grouped():
+    client = MockClient()
+    count = DEFAULT_IN_CHUNK_SIZE + 5
+    entities = Entities(client=client, response=[
+        {"_uniqueid": str(i)} for i in range(count)])
+
+    def find(client, query, blobs):
+        params = query[0]["FindEntity"]
+        assert params["constraints"]["_uniqueid"][0] == "in"
+        assert query[1]["FindImage"]["group_by_source"]
+        # Odd entities have two images, even ones none
+        grouped = {id: [{"_uniqueid": f"{id}.{j}"} for j in range(2)]
+                   for id in params["constraints"]["_uniqueid"][1] if int(id) % 2}
+        return 0, [{"FindEntity": {}}, {"FindImage": {"entities": grouped}}], []
+
+    with patch('aperturedb.Entities.execute_query', side_effect=find) as mock_execute:
+        connected = entities.get_connected_entities(ObjectType.IMAGE)
+        # One query per chunk of entities, instead of one per entity
+        assert mock_execute.call_count == 2
+
+    assert len(connected) == count
+    assert isinstance(connected[3], Images)
+    assert [e["_uniqueid"] for e in connected[3].response] == ["3.0", "3.1"]
+    assert len(connected[4].response) == 0
+    assert [e["_uniqueid"] for e in connected[count - 4].response] == [
+        f"{count - 4}.0", f"{count - 4}.1"]
+
+
+def test_Entities_bulk_update_properties():
+    client = MockClient()
+    count = 10
+    entities = Entities(client=client, response=[
+        {"_uniqueid": str(i)} for i in range(count)])
+    # Three distinct patches, and one empty
+    patches = [{"risk": i % 3} for i in range(count - 1)] + [{}]
+
+    def update(client, query, blobs):
+        responses = []
+        for cmd in query:
+            ids = cmd["UpdateEntity"]["constraints"]["_uniqueid"][1]
+            status = -1 if "4" in ids else 0
+            responses.append({"UpdateEntity": {"status": status}})
+        # A failed command fails the whole transaction
+        client.ok = not any(r["UpdateEntity"]["status"] for r in responses)
+        return (0 if client.ok else -1), responses, []
+
+    with patch('aperturedb.Entities.execute_query', side_effect=update) as mock_execute:
+        succeeded = entities.bulk_update_properties(patches, batchsize=2)
+        # Identical patches are coalesced, two commands per transaction
+        queries = [call.args[1] for call in mock_execute.call_args_list]
+        assert [len(q) for q in queries] == [2, 1]
+        assert queries[0][0] == {"UpdateEntity": {
+            "constraints": {"_uniqueid": ["in", ["0", "3", "6"]]},
+            "properties": {"risk": 0}}}
+
+    # The first transaction failed on the 4th entity, its other command
+    # succeeded but was rolled back with it
+    assert succeeded == [i % 3 == 2 for i in range(count - 1)] + [True]
+
+
+def test_Entities_get_blobs_chunked():
+    client = MockClient()
+    count = 25
+    entities = Entities(client=client, response=[
+        {"_uniqueid": str(i)} for i in range(count)])
+    entities.db_object = "_Blob"
+
+    def find(client, query, blobs):
+        params = query[0]["FindBlob"]
+        assert params["operations"] == [{"type": "resize", "width": 10, "height": 10}]
+        # Every blob but the 7th, returned in reverse order
+        found = [id for id in reversed(params["constraints"]["_uniqueid"][1])
+                 if id != "7"]
+        entities = [{"_uniqueid": id, "_blob_index": i}
+                    for i, id in enumerate(found)]
+        return 0, [{"FindBlob": {"entities": entities}}], [id.encode() for id in found]
+
+    operations = Operations()
+    operations.resize(10, 10)
+    with patch('aperturedb.Entities.execute_query', side_effect=find) as mock_execute:
+        blobs = entities.get_blobs(operations=operations,
+                                   batchsize=4, numthreads=3)
+        assert list(blobs) == [str(i).encode() if i != 7 else None
+                               for i in range(count)]
+        # One command per chunk of blobs
+        assert mock_execute.call_count == 7
+
+
+def test_Entities_get_blobs_closes_connections():
+    class CloningClient(MockClient):
+        def __init__(self):
+            super().__init__()
+            self.clones = []
+            self.connected = True
+
+        def clone(self):
+            clone = CloningClient()
+            self.clones.append(clone)
+            return clone
+
+        def disconnect(self):
+            self.connected = False
+
+    client = CloningClient()
+    entities = Entities(client=client, response=[
+        {"_uniqueid": str(i)} for i in range(25)])
+    entities.db_object = "_Blob"
+
+    def find(client, query, blobs):
+        ids = query[0]["FindBlob"]["constraints"]["_uniqueid"][1]
+        entities = [{"_uniqueid": id, "_blob_index": i}
+                    for i, id in enumerate(ids)]
+        return 0, [{"FindBlob": {"entities": entities}}], [id.encode() for id in ids]
+
+    with patch('aperturedb.Entities.execute_query', side_effect=find):
+        blobs = entities.get_blobs(batchsize=4, numthreads=3)
+        # Stop early, with chunks still in flight
+        assert next(blobs) == b"0"
+        blobs.close()
+
+    assert 0 < len(client.clones) <= 3
+    assert not any(clone.connected for clone in client.clones)
+    assert client.connected
@@ -1,5 +1,5 @@
 import numpy as np
-from aperturedb.Images import Images, resolve, rotate
+from aperturedb.Images import Images, ImageCache, resolve, rotate
 from unittest.mock import patch
 
 
@@ -89,7 +89,8 @@ def test_Images_get_image_by_index():
     img.images_ids = ["111"]
 
     with patch('aperturedb.Images.execute_query') as mock_execute:
-        mock_execute.return_value = (0, [], [b'fakeimageblob'])
+        mock_execute.return_value = (0, [{"FindImage": {"entities": [
+            {"_uniqueid": "111", "_blob_index": 0}]}}], [b'fakeimageblob'])
         # Override last_query_ok since MockClient does that
         client.last_query_ok = lambda: True
 
@@ -109,8 +110,100 @@ def test_Images_get_np_image_by_index():
         fake_np = np.zeros((10, 10, 3), dtype=np.uint8)
         _, fake_blob = cv2.imencode('.jpg', fake_np)
 
-        mock_execute.return_value = (0, [], [fake_blob.tobytes()])
+        mock_execute.return_value = (0, [{"FindImage": {"entities": [
+            {"_uniqueid": "111", "_blob_index": 0}]}}], [fake_blob.tobytes()])
         client.last_query_ok = lambda: True
 
         res = img.get_np_image_by_index(0)
         assert res.shape == (10, 10, 3)
+
+
+def test_Images_retrieve_batch_in_one_command():
+    client = MockClient()
+    img = Images(client, batch_size=3)
+    img.images_ids = ["1", "2", "3", "4"]
+
+    with patch('aperturedb.Images.execute_query') as mock_execute:
+        # Entities come back in any order, "2" is missing
+        mock_execute.return_value = (0, [{"FindImage": {"entities": [
+            {"_uniqueid": "3", "_blob_index": 0},
+            {"_uniqueid": "1", "_blob_index": 1}]}}], [b'three', b'one'])
+
+        assert img.get_image_by_index(0) == b'one'
+        query_passed = mock_execute.call_args[0][1]
+        assert len(query_passed) == 1
+        assert query_passed[0]["FindImage"]["constraints"] == {
+            "_uniqueid": ["in", ["1", "2", "3"]]}
+        assert img.get_image_by_index(2) == b'three'
+        assert img.get_image_by_index(1) is None
+        mock_execute.assert_called_once()
+
+
+def test_ImageCache_bounded_by_bytes():
+    cache = ImageCache(max_bytes=10)
+    cache["a"] = b'1234'
+    cache["b"] = b'1234'
+    assert cache["a"] == b'1234'
+    # "b" is the least recently used
+    cache["c"] = b'1234'
+    assert list(cache) == ["a", "c"] and cache.nbytes == 8
+    cache["a"] = b'12'
+    assert cache.nbytes == 6
+    # Larger than the bound, kept alone
+    cache["d"] = b'x' * 20
+    assert list(cache) == ["d"] and cache.nbytes == 20
+
+
+def test_Images_get_properties_in_chunks():
+    client = MockClient()
+    img = Images(client)
+    img.images_ids = [str(i) for i in range(2500)]
+
+    def find(client, query, blobs):
+        ids = query[0]["FindImage"]["constraints"]["_uniqueid"][1]
+        assert query[0]["FindImage"]["results"]["list"] == [
+            "width", "_uniqueid"]
+        return 0, [{"FindImage": {"entities": [
+            {"_uniqueid": id, "width": int(id)} for id in reversed(ids)]}}], []
+
+    with patch('aperturedb.Entities.execute_query', side_effect=find) as mock_execute:
+        properties = img.get_properties(["width"])
+        # One command per chunk of ids instead of one per image
+        assert mock_execute.call_count == 3
+    assert list(properties) == img.images_ids
+    assert properties["1234"] == {"width": 1234}
+
+
+def test_Images_get_similar_images_batched():
+    client = MockClient()
+    img = Images(client, batch_size=2)
+    img.images_ids = ["a", "b", "c"]
+
+    def find(client, query, blobs):
+        if "FindImage" in query[0]:
+            # Descriptors of the images, "b" has none
+            response, out = [], []
+            for i in range(0, len(query), 2):
+                id = query[i]["FindImage"]["constraints"]["_uniqueid"][1]
+                # Without results, only the number of blobs is returned
+                returned = 0 if id == "b" else 1
+                out += [id.encode()] * returned
+                response += [{"FindImage": {}},
+                             {"FindDescriptor": {"returned": returned}}]
+            return 0, response, out
+        response = []
+        for blob in blobs:
+            id = blob.decode()
+            response += [
+                {"FindDescriptor": {"entities": [
+                    {"_uniqueid": f"d{id}"}, {"_uniqueid": f"n{id}"}]}},
+                {"FindImage": {"entities": {
+                    f"d{id}": [{"_uniqueid": id}],
+                    f"n{id}": [{"_uniqueid": f"{id}2"}]}}}]
+        return 0, response, []
+
+    with patch('aperturedb.Entities.execute_query', side_effect=find) as mock_execute:
+        similar = img.get_similar_images("set", 1)
+        # 2 transactions per chunk of 2 images
+        assert mock_execute.call_count == 4
+    assert similar.images_ids == ["a", "a2", "c", "c2"]
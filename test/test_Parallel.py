@@ -1,8 +1,14 @@
 import logging
 import random
+import threading
+import time
+
+import pytest
 
 from aperturedb.Connector import Connector
-from aperturedb.ParallelQuery import ParallelQuery
+from aperturedb.ParallelQuery import ParallelQuery, AdaptiveBatchSize, batch_payload_size
+from aperturedb.Parallelizer import Parallelizer
+from aperturedb.ProcessLoader import ProcessLoader, SHARED_MEMORY_MIN_BYTES
 from aperturedb.Subscriptable import Subscriptable
 
 logger = logging.getLogger(__name__)
@@ -81,3 +87,219 @@ class TestParallel():
             print(e)
             print("Failed to renew Session")
             assert False
+
+    def test_adaptiveBatches(self, db: Connector):
+        """
+        Verifies that every query runs once with adaptive batch sizes
+        """
+        elements = 500
+        generator = GeneratorWithErrors(elements=elements, error_pct=0)
+        querier = ParallelQuery(db, dry_run=False)
+        querier.query(generator, batchsize=1,
+                      numthreads=4,
+                      stats=True,
+                      adaptive=True)
+        assert querier.get_succeeded_queries() == elements
+        # Batches grow, so there are fewer transactions than queries.
+        assert len(querier.get_times()) < elements
+
+    def test_dynamicScheduler(self, db: Connector):
+        """
+        Verifies that every query runs once when workers pull batches
+        """
+        elements = 500
+        generator = GeneratorWithErrors(elements=elements, error_pct=0)
+        querier = ParallelQuery(db, dry_run=False)
+        querier.query(generator, batchsize=7,
+                      numthreads=4,
+                      stats=True,
+                      scheduler="dynamic")
+        assert querier.get_succeeded_queries() == elements
+
+    def test_prefetch(self, db: Connector):
+        """
+        Verifies that every query runs once when loaders prefetch batches
+        """
+        elements = 500
+        generator = GeneratorWithErrors(elements=elements, error_pct=0)
+        querier = ParallelQuery(db, dry_run=False)
+        querier.query(generator, batchsize=7,
+                      numthreads=4,
+                      stats=True,
+                      prefetch=3,
+                      loader_threads=2)
+        assert querier.get_succeeded_queries() == elements
+
+
+class RecordingParallelizer(Parallelizer):
+    """
+    Records which thread processed which element, the first elements are slow.
+    """
+
+    def __init__(self, slow=10):
+        super().__init__()
+        self.slow = slow
+        self.seen = []
+        self.lock = threading.Lock()
+
+    def worker(self, thid, generator, start, end, run_event):
+        for i in range(start, end):
+            time.sleep(0.05 if i < self.slow else 0.001)
+            with self.lock:
+                self.seen.append((thid, i))
+
+    def print_stats(self):
+        pass
+
+
+class TestScheduler():
+    """
+    These check how Parallelizer distributes work, without a database
+    """
+
+    def test_dynamicCoversAll(self):
+        p = RecordingParallelizer()
+        p.batched_run(list(range(200)), 3, 4, False, scheduler="dynamic")
+        assert sorted(i for _, i in p.seen) == list(range(200))
+
+    def test_dynamicBalancesSlowRows(self):
+        p = RecordingParallelizer(slow=40)
+        p.batched_run(list(range(200)), 1, 4, False, scheduler="dynamic")
+        # The slow rows are spread over all workers, instead of all
+        # landing in the range of the first one.
+        assert len({thid for thid, i in p.seen if i < 40}) == 4
+
+    def test_unknownScheduler(self):
+        p = RecordingParallelizer()
+        with pytest.raises(ValueError):
+            p.batched_run(list(range(10)), 1, 2, False, scheduler="random")
+
+
+class TestAdaptiveBatchSize():
+    """
+    These check the batch size controller, without a database
+    """
+
+    def test_growsWhenFast(self):
+        sizer = AdaptiveBatchSize(1, target_latency=1.0)
+        sizes = [sizer.update(sizer.batchsize, 0.001 * sizer.batchsize, 0)
+                 for _ in range(20)]
+        assert sizes == sorted(sizes)
+        assert sizes[-1] == 1000
+
+    def test_shrinksWhenSlow(self):
+        sizer = AdaptiveBatchSize(64, target_latency=1.0)
+        for _ in range(10):
+            sizer.update(sizer.batchsize, 0.5 * sizer.batchsize, 0)
+        assert sizer.batchsize == 2
+
+    def test_byteBudget(self):
+        sizer = AdaptiveBatchSize(100, max_batch_bytes=10 * 2**20)
+        # Queries carrying 1 MiB each, fast enough to grow otherwise.
+        assert sizer.update(100, 0.01, 100 * 2**20) == 10
+        assert sizer.update(10, 0.001, 10 * 2**20) == 10
+
+    def test_failureBacksOff(self):
+        sizer = AdaptiveBatchSize(16)
+        assert sizer.update(16, 0.1, 0, failed=True) == 8
+        sizer = AdaptiveBatchSize(1)
+        assert sizer.update(1, 0.1, 0, failed=True) == 1
+
+    def test_payloadSize(self):
+        data = [([{}], [b"abc", memoryview(b"de")]), ([{}], [])]
+        assert batch_payload_size(data) == 5
+
+
+class TestProcessLoader():
+    """
+    These check loading batches in worker processes, without a database
+    """
+
+    def test_loadRanges(self):
+        big = SHARED_MEMORY_MIN_BYTES
+        data = [([{"FindEntity": {"_ref": i}}], [bytes([i]) * big, b"small"])
+                for i in range(10)]
+        data.append(([{"FindEntity": {}}], []))
+        with ProcessLoader(data, 2) as loader:
+            # Through shared memory
+            assert loader.load(0, 4) == data[0:4]
+            # Below the threshold, through the pipe
+            assert loader.load(10, 11) == data[10:11]
+
+
+class CountingConnector():
+    """
+    Stands for a Connector on a dask worker, counting its connections.
+    """
+    opened = 0
+    closed = 0
+
+    def __init__(self, **kwargs):
+        self.config = "counting"
+        self.connected = True
+        CountingConnector.opened += 1
+
+    def clone(self):
+        return CountingConnector()
+
+    def query(self, q, blobs=[]):
+        return [{list(cmd.keys())[0]: {"status": 0}} for cmd in q], []
+
+    def last_query_ok(self):
+        return True
+
+    def get_last_query_time(self):
+        return 0.001
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            CountingConnector.closed += 1
+
+    def __del__(self):
+        self.disconnect()
+
+
+@pytest.mark.dask
+class TestDaskManager():
+    """
+    These check that the local cluster is shared, without a database
+    """
+
+    def test_clusterReused(self):
+        from aperturedb import DaskManager
+        first = DaskManager.DaskManager(num_workers=1)
+        first.close()
+        second = DaskManager.DaskManager(num_workers=1)
+        third = DaskManager.DaskManager(num_workers=1)
+        assert second._client is third._client
+        # In use, so not closed
+        DaskManager.shutdown_clusters()
+        assert 1 in DaskManager._clusters
+        second.close()
+        third.close()
+        DaskManager.shutdown_clusters()
+        assert 1 not in DaskManager._clusters
+
+    def test_exitClosesClustersInUse(self):
+        from aperturedb import DaskManager
+        manager = DaskManager.DaskManager(num_workers=1)
+        cluster = DaskManager._clusters[1].cluster
+        # As done at exit, for DaskManagers which were never closed
+        DaskManager.shutdown_clusters(in_use=True)
+        assert 1 not in DaskManager._clusters
+        assert cluster.status.name == "closed"
+
+    def test_rangeUsesOneWorkerConnection(self):
+        from aperturedb import DaskManager
+        CountingConnector.opened = CountingConnector.closed = 0
+        generator = GeneratorWithErrors(elements=40, error_pct=0)
+        connection = ("host", 55555, False, None, False,
+                      None, CountingConnector)
+        metrics = DaskManager._process_range(
+            0, 40, generator, ParallelQuery, 2, connection)
+        assert metrics.succeeded_queries == 40
+        # The connection of the range, the one of the loader and the one
+        # of its worker thread, rather than one per batch, all closed.
+        assert CountingConnector.opened == 3
+        assert CountingConnector.closed == 3
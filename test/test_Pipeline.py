@@ -0,0 +1,70 @@
+import logging
+
+from aperturedb.Connector import Connector, Pipeline
+
+logger = logging.getLogger(__name__)
+
+
+class TestPipeline():
+    """
+    These check the pipelined mode of the Connector
+    """
+
+    def test_responses_in_order(self, db: Connector):
+        """
+        Verifies that responses are matched to requests in submission order
+        """
+        count = 50
+        db.query([{"AddEntity": {"class": "Pipelined",
+                                 "properties": {"number": i}}}
+                  for i in range(count)])
+        assert db.last_query_ok()
+
+        # Each response is told apart by the entity it finds.
+        queries = [[{"FindEntity": {"with_class": "Pipelined",
+                                    "constraints": {"number": ["==", i]},
+                                    "results": {"list": ["number"]}}}]
+                   for i in range(count)]
+        with db.pipeline(depth=8) as pipeline:
+            futures = [pipeline.submit(q) for q in queries]
+            results = [f.result() for f in futures]
+
+        assert len(results) == len(queries)
+        for i, (response, blobs) in enumerate(results):
+            assert isinstance(response, list)
+            assert response[0]["FindEntity"]["status"] == 0
+            assert response[0]["FindEntity"]["entities"] == [{"number": i}]
+            assert blobs == []
+
+    def test_query_after_pipeline(self, db: Connector):
+        """
+        Verifies that the Connector is usable synchronously once the pipeline is closed
+        """
+        with db.pipeline(depth=4) as pipeline:
+            futures = [pipeline.submit([{"GetStatus": {}}])
+                       for _ in range(10)]
+        assert all(f.done() for f in futures)
+
+        response, _ = db.query([{"GetStatus": {}}])
+        assert isinstance(response, list)
+        assert db.last_query_ok()
+
+    def test_ssl_is_synchronous(self):
+        """
+        Verifies that over SSL, the socket is never read by a second thread
+        """
+        class SSLConnector():
+            use_ssl = True
+
+            def query(self, q, blobs=[]):
+                if q == "fail":
+                    raise ConnectionError("lost")
+                return [{"GetStatus": {"status": 0}}], blobs
+
+        with Pipeline(SSLConnector(), depth=4) as pipeline:
+            future = pipeline.submit([{"GetStatus": {}}])
+            failed = pipeline.submit("fail")
+            assert pipeline._reader is None
+
+        assert future.result() == ([{"GetStatus": {"status": 0}}], [])
+        assert isinstance(failed.exception(), ConnectionError)
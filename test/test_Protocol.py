@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from aperturedb import queryMessage
+from aperturedb.Connector import Session, parse_response, serialize_query
+
+
+class TestProtocol():
+    """
+    These check the encoding of messages, and don't need a server
+    """
+
+    def _message(self, blobs):
+        msg = queryMessage.queryMessage()
+        msg.json = json.dumps([{"FindImage": {"info": "naïve ✓"}}])
+        msg.token = "token"
+        for blob in blobs:
+            msg.blobs.append(blob)
+        return bytearray(msg.SerializeToString())
+
+    def test_parse_matches_protobuf(self):
+        blobs = [b"", b"a", os.urandom(1000), os.urandom(200000)]
+        response, out = parse_response(self._message(blobs))
+        assert response[0]["FindImage"]["info"] == "naïve ✓"
+        assert out == blobs
+        assert all(isinstance(b, bytes) for b in out)
+
+    def test_parse_zero_copy(self):
+        blobs = [os.urandom(100), os.urandom(5000)]
+        data = self._message(blobs)
+        _, out = parse_response(data, zero_copy_blobs=True)
+        assert all(isinstance(b, memoryview) for b in out)
+        assert [bytes(b) for b in out] == blobs
+        # Slices share the received buffer.
+        assert out[0].obj is data
+
+    def test_serialize_round_trip(self):
+        session = Session("session", "refresh", 10, 10)
+        data = b"".join(serialize_query(
+            [{"GetStatus": {}}], [b"blob"], session))
+        msg = queryMessage.queryMessage()
+        msg.ParseFromString(data)
+        assert msg.token == "session"
+        assert parse_response(data) == ([{"GetStatus": {}}], [b"blob"])
+
+    def test_serialize_references_large_blobs(self):
+        large = bytearray(os.urandom(queryMessage.ENCODE_INLINE_LIMIT))
+        buffers = serialize_query([{"AddImage": {}}], [b"small", large])
+        # The large blob is sent from the caller's buffer.
+        assert any(isinstance(b, memoryview) and b.obj is large
+                   for b in buffers)
+        msg = queryMessage.queryMessage()
+        msg.ParseFromString(b"".join(buffers))
+        assert list(msg.blobs) == [b"small", bytes(large)]
+
+    def test_parse_truncated(self):
+        data = self._message([os.urandom(1000)])
+        with pytest.raises(ValueError):
+            parse_response(data[:100])
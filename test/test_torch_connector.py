@@ -1,6 +1,8 @@
 import time
 import os
 import logging
+import multiprocessing
+from collections import Counter
 from typing import Union
 
 import torch
@@ -14,6 +16,15 @@ from aperturedb.ConnectorRest import ConnectorRest
 logger = logging.getLogger(__name__)
 
 
+class CountingDataset(PyTorchDataset.ApertureDBDataset):
+    # Ids of the fetched batches, shared with the DataLoader workers.
+    fetched = None
+
+    def fetch_batch(self, batch_idx, decode=False):
+        self.fetched.append(batch_idx)
+        return super().fetch_batch(batch_idx, decode)
+
+
 class TestTorchDatasets():
     def validate_dataset(self, dataset: Union[DataLoader, Dataset], expected_length):
         start = time.time()
@@ -124,3 +135,118 @@ class TestTorchDatasets():
 
         self.validate_dataset(data_loader, len_limit)
         dist.destroy_process_group()
+
+    def test_prefetchWithBatchSampler(self, db, utils, images):
+        len_limit = utils.count_images()
+        dim = 224 if isinstance(db, ConnectorRest) else 225
+        query = [{
+            "FindImage": {
+                "constraints": {
+                    "age": [">=", 0]
+                },
+                "operations": [
+                    {
+                        "type": "resize",
+                        "width": dim,
+                        "height": dim
+                    }
+                ],
+                "results": {
+                    "list": ["license"],
+                    "limit": len_limit
+                }
+            }
+        }]
+
+        batch_size = 10
+        dataset = PyTorchDataset.ApertureDBDataset(
+            db, query, label_prop="license", batch_size=batch_size, prefetch=2)
+        sampler = PyTorchDataset.ApertureDBBatchSampler(
+            dataset, shuffle=True)
+
+        # Every DataLoader batch is a whole batch of the dataset,
+        # fetched once by one of the workers.
+        data_loader = DataLoader(
+            dataset,
+            batch_sampler=sampler,
+            num_workers=2,
+            worker_init_fn=PyTorchDataset.ApertureDBDataset.worker_init_fn,
+        )
+
+        self.validate_dataset(data_loader, len_limit)
+
+    def test_iterableDataset(self, db, utils, images):
+        len_limit = utils.count_images()
+        dim = 224 if isinstance(db, ConnectorRest) else 225
+        query = [{
+            "FindImage": {
+                "constraints": {
+                    "age": [">=", 0]
+                },
+                "operations": [
+                    {
+                        "type": "resize",
+                        "width": dim,
+                        "height": dim
+                    }
+                ],
+                "results": {
+                    "list": ["license"],
+                    "limit": len_limit
+                }
+            }
+        }]
+
+        dataset = PyTorchDataset.ApertureDBIterableDataset(
+            db, query, label_prop="license", batch_size=10)
+        self.validate_dataset(dataset, len_limit)
+
+        # The workers stream disjoint ranges of batches.
+        data_loader = DataLoader(dataset, batch_size=10, num_workers=3)
+        self.validate_dataset(data_loader, len_limit)
+
+    def test_prefetchFetchesBatchesOnce(self, db, utils, images):
+        len_limit = utils.count_images()
+        dim = 224 if isinstance(db, ConnectorRest) else 225
+        query = [{
+            "FindImage": {
+                "constraints": {
+                    "age": [">=", 0]
+                },
+                "operations": [
+                    {
+                        "type": "resize",
+                        "width": dim,
+                        "height": dim
+                    }
+                ],
+                "results": {
+                    "list": ["license"],
+                    "limit": len_limit
+                }
+            }
+        }]
+
+        batch_size = 5
+        with multiprocessing.Manager() as manager:
+            dataset = CountingDataset(
+                db, query, label_prop="license", batch_size=batch_size, prefetch=3)
+            dataset.fetched = manager.list()
+            sampler = PyTorchDataset.ApertureDBBatchSampler(
+                dataset, shuffle=True)
+            data_loader = DataLoader(
+                dataset,
+                batch_sampler=sampler,
+                num_workers=3,
+                persistent_workers=True,
+                worker_init_fn=PyTorchDataset.ApertureDBDataset.worker_init_fn,
+            )
+
+            for epoch in range(2):
+                sampler.set_epoch(epoch)
+                del dataset.fetched[:]
+                self.validate_dataset(data_loader, len_limit)
+                # Every batch read by one worker, and prefetched by that one only.
+                fetched = Counter(dataset.fetched)
+                assert max(fetched.values()) == 1
+                assert len(fetched) <= len(sampler)